@@ -1,182 +1,645 @@
 # -*- coding: utf-8 -*-
-import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 import os
-from urllib.request import urlopen
-from whoosh.index import open_dir
-from whoosh.qparser import (
-    QueryParser, MultifieldParser, OrGroup, FieldsPlugin, WildcardPlugin,
-    PhrasePlugin, SequencePlugin
-)
+import threading
+import time
+from django.conf import settings
+from .autocomplete import AutocompleteIndex
+from .backends import loadBackend
+from .backends.base import SearchResults
+from .cache import ResultCache
+from .locator import SpanLocator
+from .metrics import LatencyHistograms, Timings, formatMetric
+from .normalization import normalize
+from .phonetic import PhoneticIndex
+from .pipeline import REFINE_STAGE, SearchPipeline
+from .querylog import QueryLog
+from .similarity import SIMILARITY_FILENAME, loadNeighbours
 from .special_cases import SPECIAL_CASES
+from .spelling import SpellingCorrector
+from .translations import DatabaseTranslations, TranslationStore
+
+
+_engine = None
+_engineLock = threading.Lock()
+# Thread pools by name, shared by every engine of the process.
+_executors = {}
+_executorsLock = threading.Lock()
+
+
+def _getSharedExecutor(name, maxWorkers):
+    """Returns a process-wide thread pool, creating it on first use. Engines share
+    their pools, so short-lived engines, like the ones benchmark_iqra opens for cold
+    queries, do not leave idle threads behind.
+
+    :param name: The name of the pool
+    :type name: str
+    :param maxWorkers: The number of threads of the pool, if it is created
+    :type maxWorkers: int
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executorsLock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(
+                        max_workers=maxWorkers, thread_name_prefix='iqra-' + name)
+    return executor
+
+
+class Page(namedtuple('Page', ['limit', 'offset', 'ranked'])):
+    """A page of search results.
+
+    :param limit: Maximum number of matches to return, or None for all of them
+    :param offset: Number of matches to skip
+    :param ranked: True to order matches by score instead of by surah/ayah, which lets
+        the search stop at the top limit + offset hits
+    """
+    __slots__ = ()
+
+    def __new__(cls, limit=None, offset=0, ranked=False):
+        return super(Page, cls).__new__(cls, limit, offset, ranked)
+
+    @property
+    def start(self):
+        return self.offset
+
+    @property
+    def end(self):
+        return None if self.limit is None else self.offset + self.limit
+
+
+def getIqra():
+    """Returns the process-wide Iqra engine, opening the index on first use.
+    The engine is shared by every request handled by this worker.
+
+    :return: The warm search engine
+    :rtype: Iqra
+    """
+    global _engine
+    if _engine is None:
+        with _engineLock:
+            if _engine is None:
+                _engine = Iqra(settings.IQRA_INDEX_DIR)
+    return _engine
 
 
 class Iqra(object):
 
-    def __init__(self, directory='whooshdir'):
+    def __init__(self, directory='whooshdir', refreshInterval=None, translations=None,
+                 resultCache=None, backend=None, concurrentFallback=None,
+                 queryLog=None):
         ROOT_DIR = os.path.abspath(os.path.dirname(__file__))
         index_dir = os.path.join(ROOT_DIR, directory)
-        self._ix = open_dir(index_dir)
-        self._quranFilePath = 'https://s3.amazonaws.com/zappa-tarteel-static/iqra_quran/'
+        self._backend = loadBackend(backend or settings.IQRA_BACKEND, index_dir)
+        if translations is None:
+            if settings.IQRA_TRANSLATION_SOURCE == 'database':
+                translations = DatabaseTranslations()
+            else:
+                translations = TranslationStore(settings.IQRA_TRANSLATION_DIR,
+                                                settings.IQRA_TRANSLATION_URL,
+                                                settings.IQRA_TRANSLATION_CACHE_BYTES)
+        self._translations = translations
+        if resultCache is None:
+            resultCache = ResultCache(settings.IQRA_RESULT_CACHE_SIZE,
+                                      settings.IQRA_RESULT_CACHE_TTL)
+        self.resultCache = resultCache
+        if queryLog is None and settings.IQRA_QUERY_LOG:
+            queryLog = QueryLog(settings.IQRA_QUERY_LOG_BATCH_SIZE,
+                                settings.IQRA_QUERY_LOG_MAX_QUEUED,
+                                settings.IQRA_QUERY_LOG_FLUSH_SECONDS)
+        self.queryLog = queryLog
+        if refreshInterval is None:
+            refreshInterval = settings.IQRA_REFRESH_INTERVAL
+        self._refreshInterval = refreshInterval
+        if concurrentFallback is None:
+            concurrentFallback = settings.IQRA_CONCURRENT_FALLBACK
+        # The fallback stages get their own pool: batch searches already run on the
+        # batch pool, and waiting on a pool from one of its own threads can deadlock.
+        fallbackExecutor = None
+        if concurrentFallback:
+            fallbackExecutor = _getSharedExecutor('fallback',
+                                                  settings.IQRA_FALLBACK_WORKERS)
+        self._pipeline = SearchPipeline(executor=fallbackExecutor)
+        self.histograms = LatencyHistograms()
+        self._compileSpecialCases()
+        self._compileDocuments()
+        self._derived = {}
+        self._derivedLock = threading.Lock()
+        self._lastRefreshCheck = time.time()
+        self._refreshLock = threading.Lock()
 
-    def _getResponseObjectFromParams(self, queryText, matches, matchedTerms, suggestions):
-        return {
+    @property
+    def generation(self):
+        """The generation of the index currently being searched."""
+        return self._backend.generation
+
+    def _compileSpecialCases(self):
+        """Maps the normalized text of every special case to its replacement query text
+        and the stored fields of its ayahs, so matching one is a dictionary lookup.
+        """
+        documents = self._backend.getDocuments(
+                tuple(ayah) for case in SPECIAL_CASES for ayah in case[2])
+
+        # Later entries win over earlier ones with the same text.
+        specialCases = {}
+        for caseText, queryText, caseAyahs in SPECIAL_CASES:
+            specialCases[normalize(caseText)] = (
+                queryText,
+                [documents[tuple(ayah)] for ayah in caseAyahs if tuple(ayah) in documents]
+            )
+        self._specialCases = specialCases
+
+    def _compileDocuments(self):
+        """Keeps the stored fields of every ayah and normalizes their simple text, once
+        per index generation.
+        """
+        self._documents = {
+            (document['surah_num'], document['ayah_num']): document
+            for document in self._backend.getAllDocuments()
+        }
+        self._normalizedAyahs = {
+            ayah: normalize(document['simple_ayah'])
+            for ayah, document in self._documents.items()
+        }
+
+    def getNormalizedAyahs(self):
+        """Returns the normalized simple text of every ayah in the index.
+
+        :return: The normalized texts by (surah number, ayah number)
+        :rtype: dict
+        """
+        return self._normalizedAyahs
+
+    def stageStats(self):
+        """Returns the call count, hit rate and mean latency of every search stage.
+
+        :rtype: dict
+        """
+        return self._pipeline.stats.snapshot()
+
+    def _checkGeneration(self):
+        """Looks for a newer index generation, at most once per refresh interval."""
+        now = time.time()
+        if now - self._lastRefreshCheck < self._refreshInterval:
+            return
+        with self._refreshLock:
+            if now - self._lastRefreshCheck < self._refreshInterval:
+                return
+            self._lastRefreshCheck = now
+            if self._backend.refresh():
+                self._compileSpecialCases()
+                self._compileDocuments()
+
+    def _getDerived(self, name, build):
+        """Returns a structure derived from the current index generation, building it
+        on first use and again after the generation changes.
+
+        :param name: Name of the structure
+        :type name: str
+        :param build: Builds the structure
+        :type build: callable
+        """
+        generation = self.generation
+        entry = self._derived.get(name)
+        if entry is None or entry[0] != generation:
+            with self._derivedLock:
+                entry = self._derived.get(name)
+                if entry is None or entry[0] != generation:
+                    entry = (generation, build())
+                    self._derived[name] = entry
+        return entry[1]
+
+    def _buildCorrector(self):
+        budget = settings.IQRA_SPELLING_BUDGET_MS
+        return SpellingCorrector(self._backend.getVocabulary("simple_ayah"),
+                                 settings.IQRA_SPELLING_MAX_DISTANCE,
+                                 None if budget is None else budget / 1000.0)
+
+    def _getCorrector(self):
+        """Returns the spelling corrector over the simple_ayah vocabulary.
+
+        :return: The corrector, or None if corrections are disabled
+        :rtype: SpellingCorrector, None
+        """
+        if settings.IQRA_SPELLING_MAX_DISTANCE <= 0:
+            return None
+        return self._getDerived('corrector', self._buildCorrector)
+
+    def _getNeighbours(self):
+        """Returns the similar ayahs of every ayah, computed offline by
+        build_iqra_similarity.
+
+        :return: The similar ayahs by (surah number, ayah number), or None if they have
+            not been computed for this index
+        :rtype: dict, None
+        """
+        return self._getDerived('neighbours', lambda: loadNeighbours(
+                os.path.join(self._backend.directory, SIMILARITY_FILENAME)))
+
+    def _getPhoneticIndex(self):
+        """Returns the phonetic skeletons of the words of every ayah.
+
+        :return: The index, or None if phonetic matching is disabled
+        :rtype: PhoneticIndex, None
+        """
+        if not settings.IQRA_PHONETIC_MATCHING:
+            return None
+        return self._getDerived(
+                'phonetic', lambda: PhoneticIndex(self._normalizedAyahs, self._documents))
+
+    def _getResponseObjectFromParams(self, queryText, matches, matchedTerms, suggestions,
+                                     total=None):
+        response = {
             "queryText"   : queryText,
             "matches"     : matches,
             "matchedTerms": matchedTerms,
             "suggestions" : suggestions,
         }
+        # Only paginated searches report the total number of matches.
+        if total is not None:
+            response["total"] = total
+        return response
+
+    def _getEmptyResponse(self, value, page=None):
+        return self._getResponseObjectFromParams(value, [], [], [],
+                                                 0 if page is not None else None)
+
+    def _normalizeQuery(self, value):
+        """Returns the form of a query that is searched and used as its cache key.
+        Queries that only differ in whitespace are parsed into the same search, so they
+        share a key. Indexes built with the Arabic normalization also fold tashkeel and
+        letter variants, which older indexes would not match.
+        """
+        if self._backend.normalized:
+            return normalize(value)
+        return ' '.join(value.split())
 
-    def _getEmptyResponse(self, value):
-        return self._getResponseObjectFromParams(value, [], [], [])
+    def _getMatchesFromResults(self, results, translation, page=None, timings=None):
+        """Builds the matches for a page of results. Unranked results are returned in
+        surah/ayah order; ranked results keep the order of their scores. Translations
+        are only looked up for the ayahs in the page.
 
-    def _getTranslationFromURL(self, translation, encoding='utf-8'):
-        """Downloads JSON from URL and converts it to python dict
-        :param translation: Filename without the .json extension
+        :param results: Search results or stored field dicts
+        :type results: SearchResults, list
+        :param translation: The requested translation type
         :type translation: str
-        :return: The JSON as a python dict
-        :rtype: dict
+        :param page: The requested page, or None for every result in surah/ayah order
+        :type page: Page, None
+        :param timings: Collects the time spent sorting, loading the translation and
+            building the matches
+        :type timings: Timings, None
+        :return: The matches and the total number of results
+        :rtype: tuple(list, int)
         """
-        file_url = self._quranFilePath + translation + '.json'
-        data_response = urlopen(file_url)
-        json_data = data_response.read()
-        json_str = json_data.decode(encoding)
-        return json.loads(json_str)
-
-    def _getMatchesFromResults(self, results, translation):
-        translatedQuranObj = self._getTranslationFromURL(translation)
-
-        finalMatches = []
-        for result in results:
-            finalMatches.append({
-                "surahNum"            : result['surah_num'],
-                "ayahNum"             : result['ayah_num'],
-                "translationSurahName": result['surah_name_en'],
-                "arabicSurahName"     : result['surah_name_ar'],
-                "translationAyah"     : translatedQuranObj[result['surah_num'] - 1][
-                    result['ayah_num'] - 1],
-                "arabicAyah"          : result['ayah']
-            })
-        return sorted(finalMatches, key=itemgetter('surahNum', 'ayahNum'))
-
-    def getSpecialCasesResults(self, value, translation):
+        if timings is None:
+            timings = Timings()
+        with timings.measure('sort'):
+            if isinstance(results, SearchResults):
+                total = results.total if page is not None else None
+                documents = results.documents()
+            else:
+                total = len(results)
+                documents = results
+            if page is None or not page.ranked:
+                documents = sorted(documents, key=itemgetter('surah_num', 'ayah_num'))
+            if page is not None:
+                documents = documents[page.start:page.end]
+
+        with timings.measure('translation'):
+            translations = self._translations.lookup(
+                    translation,
+                    [(result['surah_num'], result['ayah_num']) for result in documents])
+        with timings.measure('matches'):
+            finalMatches = []
+            for result in documents:
+                finalMatches.append({
+                    "surahNum"            : result['surah_num'],
+                    "ayahNum"             : result['ayah_num'],
+                    "translationSurahName": result['surah_name_en'],
+                    "arabicSurahName"     : result['surah_name_ar'],
+                    "translationAyah"     : translations.get((result['surah_num'],
+                                                              result['ayah_num'])),
+                    "arabicAyah"          : result['ayah']
+                })
+        return finalMatches, total
+
+    def getSpecialCasesResults(self, value, translation, page=None, timings=None):
         """Takes in a query and compares it to hard-coded special cases.
         The special cases are for the "Miracle Letters"
 
         :param translation: The requested translation type
         :type translation: str
+        :param page: The requested page, or None for all matches
+        :type page: Page, None
+        :param timings: Collects the time spent building the matches
+        :type timings: Timings, None
         :return: A list of ayah matches if there is a match, otherwise returns None
         :rtype: list, None
         """
-        matchingAyahList = []
-        for case in SPECIAL_CASES:
-            if case[0] == value:
-                value = case[1]
-                matchingAyahList = case[2]
-
-        if len(matchingAyahList) > 0:
-            allowedResults = []
-            for matchingAyah in matchingAyahList:
-                allowedResults.append(
-                    "surah_num:" + str(matchingAyah[0]) + " AND ayah_num:" + str(
-                            matchingAyah[1]))
-            parser = MultifieldParser(["surah_num", "ayah_num"], self._ix.schema)
-            parser.remove_plugin_class(PhrasePlugin)
-            parser.add_plugin(SequencePlugin())
-            query = parser.parse(" OR ".join(allowedResults))
-            with self._ix.searcher() as searcher:
-                results = searcher.search(query, limit=7)
-                return self._getResponseObjectFromParams(
-                        value,
-                        self._getMatchesFromResults(results, translation),
-                        [],
-                        []
-                )
-        else:
+        specialCase = self._specialCases.get(normalize(value))
+        if specialCase is None:
             return None
 
-    def getResult(self, value, translation):
-        specialCasesResults = self.getSpecialCasesResults(value, translation)
+        queryText, documents = specialCase
+        # Special cases have no score, so they are always in surah/ayah order.
+        if page is not None and page.ranked:
+            page = Page(page.limit, page.offset)
+        matches, total = self._getMatchesFromResults(documents, translation, page,
+                                                     timings)
+        return self._getResponseObjectFromParams(
+                queryText,
+                matches,
+                [],
+                [],
+                total if page is not None else None
+        )
+
+    def getResult(self, value, translation, page=None, debug=False):
+        """Searches for the ayahs matching a query. Results are cached per normalized
+        query, translation and page until the index generation changes. The time spent
+        in each step is added to the engine's histograms, and the search is added to the
+        query log if there is one.
+
+        :param value: The query text
+        :type value: str
+        :param translation: The requested translation type
+        :type translation: str
+        :param page: The requested page, or None for all matches in surah/ayah order
+        :type page: Page, None
+        :param debug: True to add the time spent in each step, in milliseconds, to the
+            response
+        :type debug: bool
+        :return: The query text, matches, matched terms and suggestions
+        :rtype: dict
+        """
+        timings = Timings()
+        with timings.measure('total'):
+            with timings.measure('refresh'):
+                self._checkGeneration()
+            searchText = self._normalizeQuery(value)
+            key = (searchText, translation, page)
+            generation = self.generation
+            with timings.measure('cache'):
+                entry = self.resultCache.get(key, generation)
+            cached = entry is not None
+            if entry is None:
+                entry = self._search(searchText, translation, page, timings)
+                self.resultCache.set(key, entry, generation)
+
+            stageName, response = entry
+            response = dict(response)
+            if response["queryText"] is None:
+                response["queryText"] = value
+            if response["matchedTerms"] is None:
+                response["matchedTerms"] = value.split(' ')
+        self.histograms.observe('search', timings)
+        if self.queryLog is not None:
+            self.queryLog.record(searchText,
+                                 response.get("total", len(response["matches"])),
+                                 stageName, timings.steps['total'], cached)
+        if debug:
+            response["timings"] = timings.asDict()
+        return response
+
+    def _search(self, value, translation, page=None, timings=None):
+        """Runs a normalized query through the special cases and the search cascade. The
+        query text and matched terms are left as None in the response when they are the
+        query itself, so the response can be shared by queries with the same cache key.
+
+        :return: The name of the stage that matched ('special_case', or None if nothing
+            did) and the response
+        :rtype: tuple(str, dict)
+        """
+        if timings is None:
+            timings = Timings()
+        with timings.measure('specialCases'):
+            specialCasesResults = self.getSpecialCasesResults(value, translation, page,
+                                                              timings)
         if specialCasesResults:
-            return specialCasesResults
-
-        with self._ix.searcher() as searcher:
-            isSingleWordQuery = False
-            if len(value.split()) == 1:
-                parser = MultifieldParser(
-                        ["simple_ayah", "roots", "decomposed_ayah"], self._ix.schema
-                )
-                isSingleWordQuery = True
-            else:
-                parser = QueryParser("simple_ayah", self._ix.schema)
-            parser.remove_plugin_class(FieldsPlugin)
-            parser.remove_plugin_class(WildcardPlugin)
-            query = parser.parse(value)
-            results = searcher.search(query, limit=None)
-            if results:
-                finalMatches = self._getMatchesFromResults(results, translation)
-                return self._getResponseObjectFromParams(
-                    value,
-                    finalMatches,
-                    value.split(' '),
-                    []
-                )
-
-            if not isSingleWordQuery:
-                parser = QueryParser("simple_ayah", self._ix.schema, group=OrGroup)
-                parser.remove_plugin_class(FieldsPlugin)
-                parser.remove_plugin_class(WildcardPlugin)
-                query = parser.parse(value)
-                results = searcher.search(query, terms=True, limit=None)
-                if not results:
-                    parser = QueryParser("roots", self._ix.schema, group=OrGroup)
-                    parser.remove_plugin_class(FieldsPlugin)
-                    parser.remove_plugin_class(WildcardPlugin)
-                    query = parser.parse(value)
-                    results = searcher.search(query, terms=True, limit=None)
-                    if not results:
-                        parser = QueryParser("decomposed_ayah", self._ix.schema, group=OrGroup)
-                        parser.remove_plugin_class(FieldsPlugin)
-                        parser.remove_plugin_class(WildcardPlugin)
-                        query = parser.parse(value)
-                        results = searcher.search(query, terms=True, limit=None)
-                if results:
-                    matchedTerms = results.matched_terms()
-
-                    firstResults = None
-                    if len(matchedTerms) > 1 and results.scored_length() > 1:
-                        if results[1].score > 10:
-                            firstResults = results
-
-                        parser = QueryParser("simple_ayah", self._ix.schema)
-                        parser.remove_plugin_class(FieldsPlugin)
-                        parser.remove_plugin_class(WildcardPlugin)
-                        query = parser.parse(results[0]["simple_ayah"])
-                        results = searcher.search(query, limit=None)
-
-                    finalMatches = self._getMatchesFromResults(results, translation)
-
-                    suggestions = []
-                    if firstResults:
-                        for result in [fR for fR in firstResults if fR.score > 10]:
-                            suggestions.append(result['simple_ayah'])
-
-                    return self._getResponseObjectFromParams(
-                        value,
-                        finalMatches,
-                        # term is a tuple where the second index contains the matching
-                        # term
-                        [term[1] for term in matchedTerms],
-                        suggestions
-                    )
-
-        return self._getEmptyResponse(value)
-
-    def getTranslations(self, ayahs, translation):
-        # Load the json file with the user's requested translation
-        translatedQuranObj = self._getTranslationFromURL(translation)
-        for idx, ayahObj in enumerate(ayahs):
-            surahIdx = ayahObj["surahNum"] - 1
-            ayahIdx = ayahObj["ayahNum"] - 1
-            ayahs[idx]["translationAyah"] = translatedQuranObj[surahIdx][ayahIdx]
-        return ayahs
\ No newline at end of file
+            return 'special_case', specialCasesResults
+
+        # Ranked pages only need the top hits by score; everything else is sorted by
+        # surah/ayah afterwards, so every hit is needed.
+        searchLimit = page.end if page is not None and page.ranked else None
+        corrector = self._getCorrector()
+        stage, results = self._pipeline.run(self._backend, value, searchLimit,
+                                            corrector and corrector.correct, timings,
+                                            self._getPhoneticIndex())
+        if results is None:
+            return None, self._getEmptyResponse(None, page)
+
+        if not stage.fallback:
+            finalMatches, total = self._getMatchesFromResults(results, translation, page,
+                                                              timings)
+            return stage.name, self._getResponseObjectFromParams(
+                None,
+                finalMatches,
+                results.matchedTerms,
+                [],
+                total if page is not None else None
+            )
+
+        matchedTerms = results.matchedTerms
+
+        suggestions = []
+        if len(matchedTerms) > 1 and len(results.hits) > 1:
+            bestFields = results.hits[0].fields
+            neighbours = self._getNeighbours()
+            if neighbours is not None:
+                # The ayahs similar to the best match are looked up, not scored.
+                suggestions = [
+                    self._documents[ayah]['simple_ayah'] for ayah in neighbours.get(
+                        (bestFields["surah_num"], bestFields["ayah_num"]), ())
+                    if ayah in self._documents
+                ]
+            elif results.hits[1].score > 10:
+                suggestions = [hit.fields['simple_ayah'] for hit in results.hits
+                               if hit.score > 10]
+
+            bestAyah = bestFields["simple_ayah"]
+            if self._backend.normalized:
+                bestAyah = self._normalizedAyahs.get(
+                        (bestFields["surah_num"], bestFields["ayah_num"]), bestAyah)
+            with timings.measure('refine'):
+                results = self._backend.search(REFINE_STAGE, bestAyah, searchLimit)
+
+        finalMatches, total = self._getMatchesFromResults(results, translation, page,
+                                                          timings)
+
+        return stage.name, self._getResponseObjectFromParams(
+            None,
+            finalMatches,
+            matchedTerms,
+            suggestions,
+            total if page is not None else None
+        )
+
+    def _getExecutor(self):
+        """Returns the thread pool used for batch searches, shared by every engine."""
+        return _getSharedExecutor('batch', settings.IQRA_BATCH_WORKERS)
+
+    def _getTimedResult(self, value, translation, page, debug=False):
+        start = time.perf_counter()
+        result = self.getResult(value, translation, page, debug)
+        return result, time.perf_counter() - start
+
+    def getResults(self, queries, parallel=False, debug=False):
+        """Runs several searches on this engine, optionally spread over a thread pool.
+        The pool threads share this engine and its backend.
+
+        :param queries: (query text, translation, page) tuples
+        :type queries: list
+        :param parallel: True to run the queries concurrently
+        :type parallel: bool
+        :param debug: True to add the time spent in each step to the results
+        :type debug: bool
+        :return: The (result, seconds) of every query, in the order of the queries
+        :rtype: list
+        """
+        if not parallel or len(queries) < 2:
+            return [self._getTimedResult(*query, debug=debug) for query in queries]
+        executor = self._getExecutor()
+        futures = [executor.submit(self._getTimedResult, *query, debug=debug)
+                   for query in queries]
+        return [future.result() for future in futures]
+
+    def getAutocomplete(self, value, limit=10):
+        """Completes a partial phrase of ayah text. The last word is completed unless
+        the phrase ends with whitespace, in which case the next word is suggested.
+
+        :param value: The partial phrase
+        :type value: str
+        :param limit: Maximum number of continuations and ayahs
+        :type limit: int
+        :return: The query text, continuations, matching ayahs and the number of times
+            the phrase occurs
+        :rtype: dict
+        """
+        self._checkGeneration()
+        index = self._getDerived(
+                'autocomplete', lambda: AutocompleteIndex(self._normalizedAyahs))
+        phrase = normalize(value)
+        if value[-1:].isspace():
+            phrase += ' '
+        continuations, ayahs, total = index.complete(phrase, limit)
+        return {
+            "queryText"    : value,
+            "continuations": [{"text": text, "count": count}
+                              for text, count in continuations],
+            "ayahs"        : [{
+                "surahNum"       : document['surah_num'],
+                "ayahNum"        : document['ayah_num'],
+                "arabicSurahName": document['surah_name_ar'],
+                "arabicAyah"     : document['ayah'],
+            } for document in map(self._documents.get, ayahs) if document],
+            "total"        : total,
+        }
+
+    def getLocation(self, value, translation):
+        """Locates the span of consecutive ayahs a long transcript was recited from,
+        for recitations that run over several ayahs.
+
+        :param value: The transcript
+        :type value: str
+        :param translation: The requested translation type
+        :type translation: str
+        :return: The query text, the surah number, first and last ayah numbers of the
+            span (None if it could not be located), the fraction of the transcript
+            aligned with it and the ayahs of the span
+        :rtype: dict
+        """
+        self._checkGeneration()
+        locator = self._getDerived('locator', lambda: SpanLocator(self._normalizedAyahs))
+        location = locator.locate(normalize(value))
+        response = {
+            "queryText": value,
+            "surahNum" : None,
+            "startAyah": None,
+            "endAyah"  : None,
+            "coverage" : 0.0,
+            "matches"  : [],
+        }
+        if location is None:
+            return response
+
+        documents = [self._documents[(location.surahNum, ayahNum)]
+                     for ayahNum in range(location.startAyah, location.endAyah + 1)
+                     if (location.surahNum, ayahNum) in self._documents]
+        response.update({
+            "surahNum" : location.surahNum,
+            "startAyah": location.startAyah,
+            "endAyah"  : location.endAyah,
+            "coverage" : location.coverage,
+            "matches"  : self._getMatchesFromResults(documents, translation)[0],
+        })
+        return response
+
+    def getTranslations(self, ayahs, translation, timings=None):
+        """Adds the translation of every ayah to copies of the ayah objects. The
+        translations of all the ayahs are looked up at once.
+
+        :param ayahs: Objects with the surahNum and ayahNum of the ayahs
+        :type ayahs: list(dict)
+        :param translation: The requested translation type
+        :type translation: str
+        :param timings: Collects the time spent looking up and adding the translations
+        :type timings: Timings, None
+        :return: The ayah objects with their translationAyah
+        :rtype: list(dict)
+        """
+        if timings is None:
+            timings = Timings()
+        with timings.measure('total'):
+            with timings.measure('translation'):
+                translations = self._translations.lookup(
+                        translation,
+                        [(ayahObj["surahNum"], ayahObj["ayahNum"]) for ayahObj in ayahs])
+            with timings.measure('lookup'):
+                result = [
+                    dict(ayahObj, translationAyah=translations.get(
+                            (ayahObj["surahNum"], ayahObj["ayahNum"])))
+                    for ayahObj in ayahs
+                ]
+        self.histograms.observe('translations', timings)
+        return result
+
+    def renderMetrics(self):
+        """Renders the step latency histograms, the search stage counters and the
+        result cache counters in the Prometheus text format.
+
+        :rtype: str
+        """
+        lines = self.histograms.render()
+        lines += [
+            '# HELP iqra_stage_calls_total Searches run by each stage of the cascade.',
+            '# TYPE iqra_stage_calls_total counter',
+        ]
+        stageStats = sorted(self.stageStats().items())
+        lines += [formatMetric('iqra_stage_calls_total', stats['calls'],
+                               [('stage', name)]) for name, stats in stageStats]
+        lines += [
+            '# HELP iqra_stage_hits_total Searches with results in each stage.',
+            '# TYPE iqra_stage_hits_total counter',
+        ]
+        lines += [formatMetric('iqra_stage_hits_total', stats['hits'], [('stage', name)])
+                  for name, stats in stageStats]
+        cacheStats = self.resultCache.stats()
+        for name in ('hits', 'misses', 'evictions'):
+            metric = 'iqra_result_cache_{}_total'.format(name)
+            lines += ['# TYPE {} counter'.format(metric),
+                      formatMetric(metric, cacheStats[name])]
+        lines += ['# TYPE iqra_result_cache_size gauge',
+                  formatMetric('iqra_result_cache_size', cacheStats['size'])]
+        if self.queryLog is not None:
+            logStats = self.queryLog.stats()
+            for name in ('recorded', 'dropped', 'written', 'failed'):
+                metric = 'iqra_query_log_{}_total'.format(name)
+                lines += ['# TYPE {} counter'.format(metric),
+                          formatMetric(metric, logStats[name])]
+            lines += ['# TYPE iqra_query_log_queued gauge',
+                      formatMetric('iqra_query_log_queued', logStats['queued'])]
+        return '\n'.join(lines) + '\n'
\ No newline at end of file
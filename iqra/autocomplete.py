@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Prefix autocomplete over the normalized ayah texts.
+
+Every word position of every ayah starts a suffix: the words from that position to the
+end of the ayah, cut at ``maxWords`` words. The suffixes are kept in one sorted list, so
+all the places a partial phrase occurs are a contiguous range found with two bisects.
+Suffixes sharing their first words also form contiguous groups inside that range,
+which is what makes counting the continuations of a phrase cheap.
+"""
+from array import array
+from bisect import bisect_left
+
+# Sorts right after the space separating two words and before every letter, so
+# bisecting for ``phrase + _AFTER_WORD`` finds the end of the suffixes whose first
+# words are exactly ``phrase``.
+_AFTER_WORD = '!'
+_AFTER_ALL = u'\uffff'
+
+
+class AutocompleteIndex(object):
+    """A sorted array of the word suffixes of every ayah.
+
+    :param ayahs: The normalized text of every ayah by (surah number, ayah number)
+    :type ayahs: dict
+    :param maxWords: Number of words kept per suffix. Longer phrases are completed from
+        their last maxWords - 1 words.
+    :type maxWords: int
+    :param maxSamples: Upper bound on the groups looked at to rank continuations. Every
+        continuation occurring more than 1/maxSamples of the time is always counted.
+    :type maxSamples: int
+    """
+
+    def __init__(self, ayahs, maxWords=8, maxSamples=128):
+        self.maxWords = maxWords
+        self.maxSamples = maxSamples
+        self.ayahs = sorted(ayahs)
+        suffixes = []
+        for ayahId, ayah in enumerate(self.ayahs):
+            words = ayahs[ayah].split()
+            for start in range(len(words)):
+                suffixes.append((' '.join(words[start:start + maxWords]), ayahId))
+        suffixes.sort()
+        self._keys = [key for key, _ in suffixes]
+        self._ayahIds = array('H', [ayahId for _, ayahId in suffixes])
+
+    def _range(self, prefix):
+        keys = self._keys
+        lo = bisect_left(keys, prefix)
+        return lo, bisect_left(keys, prefix + _AFTER_ALL, lo)
+
+    def _groups(self, lo, hi, depth):
+        """Yields the (start, end, continuation) of the groups of suffixes sharing their
+        first depth words in a range. Large ranges are sampled at a fixed stride, which
+        visits every group at least as long as the stride.
+        """
+        keys = self._keys
+        step = max(1, (hi - lo) // self.maxSamples)
+        position = lo
+        while position < hi:
+            continuation = ' '.join(keys[position].split(' ')[:depth])
+            start = bisect_left(keys, continuation, lo, position)
+            end = bisect_left(keys, continuation + _AFTER_WORD, position, hi)
+            yield start, end, continuation
+            nextSample = lo + ((position - lo) // step + 1) * step
+            position = max(end, nextSample)
+
+    def complete(self, value, limit=10):
+        """Completes a partial phrase. The last word is treated as partial unless the
+        phrase ends with whitespace, in which case the next word is completed.
+
+        :param value: The normalized partial phrase
+        :type value: str
+        :param limit: Maximum number of continuations and ayahs to return
+        :type limit: int
+        :return: The continuations with their number of occurrences, most frequent
+            first, the (surah number, ayah number) of ayahs containing them in surah/ayah
+            order and the number of occurrences of the phrase
+        :rtype: tuple(list, list, int)
+        """
+        words = value.split()
+        nextWord = not words or value[-1:].isspace()
+        words = words[-(self.maxWords - 1):]
+        prefix = ' '.join(words) + (' ' if nextWord and words else '')
+        depth = len(words) + (1 if nextWord else 0)
+        lo, hi = self._range(prefix)
+        if lo == hi:
+            return [], [], 0
+
+        groups = sorted(self._groups(lo, hi, depth),
+                        key=lambda group: (group[0] - group[1], group[2]))[:limit]
+        continuations = [(continuation, end - start)
+                         for start, end, continuation in groups]
+        # The ayahs of the most frequent continuations are taken first.
+        ayahIds = set()
+        for start, end, _ in groups:
+            for position in range(start, end):
+                if len(ayahIds) == limit:
+                    break
+                ayahIds.add(self._ayahIds[position])
+        return continuations, [self.ayahs[ayahId] for ayahId in sorted(ayahIds)], hi - lo
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.utils.module_loading import import_string
+
+# Short names accepted by the IQRA_BACKEND setting, besides full dotted paths.
+BACKENDS = {
+    'whoosh': 'iqra.backends.whoosh_backend.WhooshBackend',
+    'memory': 'iqra.backends.memory.MemoryBackend',
+    'sqlite': 'iqra.backends.sqlite_fts.SqliteBackend',
+}
+
+
+def loadBackend(name, directory):
+    """Opens an index directory with a search backend.
+
+    :param name: A short name from BACKENDS or the dotted path of a backend class
+    :type name: str
+    :param directory: The index directory
+    :type directory: str
+    :rtype: iqra.backends.base.SearchBackend
+    """
+    return import_string(BACKENDS.get(name, name))(directory)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import os
+
+# A search hit: its score and the stored fields of the ayah.
+Hit = namedtuple('Hit', ['score', 'fields'])
+
+
+class SearchResults(object):
+    """The hits of a search, best first.
+
+    :param hits: The collected hits, best first
+    :type hits: list(Hit)
+    :param total: The number of matching ayahs, or a callable computing it. Backends
+        that stop at the top hits may only know it at an extra cost.
+    :type total: int, callable
+    :param matchedTerms: The query terms found in the hits, if they were requested
+    :type matchedTerms: list(str), None
+    """
+
+    def __init__(self, hits, total, matchedTerms=None):
+        self.hits = hits
+        self._total = total
+        self.matchedTerms = matchedTerms
+
+    @property
+    def total(self):
+        if callable(self._total):
+            self._total = self._total()
+        return self._total
+
+    def documents(self):
+        """Returns the stored fields of the hits, best first.
+
+        :rtype: list(dict)
+        """
+        return [hit.fields for hit in self.hits]
+
+    def __bool__(self):
+        return bool(self.hits)
+
+
+class SearchBackend(object):
+    """Interface of the Iqra search backends.
+
+    A backend searches the ayahs of one index directory. It must be safe to use from
+    several threads at once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def generation(self):
+        """Identifies the version of the index being searched. Results computed for
+        one generation are not valid for another.
+        """
+        raise NotImplementedError
+
+    @property
+    def normalized(self):
+        """True if the index was built with the Arabic normalization, so queries can be
+        normalized before searching without losing matches.
+        """
+        raise NotImplementedError
+
+    def _readGeneration(self, ix):
+        """Returns the generation of a whoosh index opened on this backend's directory.
+        Rebuilt indexes are swapped in by pointing the directory at a new one, which
+        starts its own whoosh generation count, so the resolved path is part of it.
+
+        :rtype: tuple(str, int)
+        """
+        return os.path.realpath(self.directory), ix.latest_generation()
+
+    def _directoryChanged(self, generation):
+        """True if the index directory now points somewhere other than it did at the
+        given generation.
+        """
+        return os.path.realpath(self.directory) != generation[0]
+
+    def refresh(self):
+        """Picks up a newer version of the index if there is one.
+
+        :return: True if the generation changed
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def search(self, stage, value, limit=None, terms=False):
+        """Runs a query for one stage of the search cascade.
+
+        :param stage: The stage, which gives the fields and how terms are combined
+        :type stage: iqra.pipeline.SearchStage
+        :param value: The query text
+        :type value: str
+        :param limit: Maximum number of top scoring hits to collect, None for all
+        :type limit: int, None
+        :param terms: True to report which query terms matched
+        :type terms: bool
+        :rtype: SearchResults
+        """
+        raise NotImplementedError
+
+    def getDocuments(self, ayahs):
+        """Returns the stored fields of some ayahs.
+
+        :param ayahs: (surah number, ayah number) tuples
+        :type ayahs: iterable
+        :return: The stored fields of the ayahs found, by (surah number, ayah number)
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def getAllDocuments(self):
+        """Returns the stored fields of every ayah in the index.
+
+        :return: The stored fields, in surah/ayah order
+        :rtype: list(dict)
+        """
+        raise NotImplementedError
+
+    def getVocabulary(self, fieldName):
+        """Returns the indexed terms of a field.
+
+        :param fieldName: The field
+        :type fieldName: str
+        :return: The number of ayahs containing each term
+        :rtype: dict
+        """
+        raise NotImplementedError
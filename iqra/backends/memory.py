@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory search backend.
+
+The whole Quran is only 6,236 ayahs, so instead of going through whoosh's on-disk
+segments for every query, the postings of the searched fields are read from the
+whoosh index once and kept in memory. Ayahs are numbered by a global id (0-6235, in
+surah/ayah order) and every term's postings are stored both as a sorted array of ids
+and as a bitmap in a Python int, so AND/OR of whole posting lists are single big-int
+operations done in C.
+
+Queries are analyzed with the index's own field analyzers and scored with the same
+BM25F formula as whoosh, so results and scores match the whoosh backend.
+"""
+from array import array
+from bisect import bisect_left
+import heapq
+from math import log
+import re
+import threading
+from whoosh.index import open_dir
+from .base import Hit, SearchBackend, SearchResults
+from ..normalization import isNormalized
+from ..pipeline import OR
+
+_PHRASE = re.compile(r'"([^"]*)"')
+
+
+def _bitmap(ids, size):
+    """Converts a list of ids to a bitmap with bit i set for id i."""
+    bits = bytearray((size + 7) // 8)
+    for ayahId in ids:
+        bits[ayahId >> 3] |= 1 << (ayahId & 7)
+    return int.from_bytes(bytes(bits), 'little')
+
+
+def _iterBits(bitmap):
+    """Yields the ids of the bits set in a bitmap, in increasing order."""
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+class _Postings(object):
+    __slots__ = ('bitmap', 'ids', 'weights')
+
+    def __init__(self, entries, size):
+        entries.sort()
+        self.ids = array('H', [ayahId for ayahId, _ in entries])
+        self.weights = array('f', [weight for _, weight in entries])
+        self.bitmap = _bitmap(self.ids, size)
+
+    def weight(self, ayahId):
+        return self.weights[bisect_left(self.ids, ayahId)]
+
+
+class _FieldIndex(object):
+    """Postings, field lengths and (if the index has positions) the token sequence of
+    every ayah for one field.
+    """
+
+    def __init__(self, reader, fieldType, fieldName, ayahIds):
+        size = len(ayahIds)
+        self.fieldType = fieldType
+        self.lengths = array('f', [0.0] * size)
+        for docnum, ayahId in ayahIds.items():
+            # whoosh returns None instead of the default for empty fields
+            self.lengths[ayahId] = reader.doc_field_length(docnum, fieldName, 1) or 0
+        self.averageLength = (reader.field_length(fieldName) / size) if size else 1.0
+        self.averageLength = self.averageLength or 1.0
+
+        self.postings = {}
+        positionsByAyah = None
+        for termBytes in reader.lexicon(fieldName):
+            term = fieldType.from_bytes(termBytes)
+            matcher = reader.postings(fieldName, termBytes)
+            hasPositions = matcher.supports('positions')
+            if hasPositions and positionsByAyah is None:
+                positionsByAyah = [{} for _ in range(size)]
+            entries = []
+            while matcher.is_active():
+                ayahId = ayahIds.get(matcher.id())
+                if ayahId is not None:
+                    entries.append((ayahId, matcher.weight()))
+                    if hasPositions:
+                        for position in matcher.value_as('positions'):
+                            positionsByAyah[ayahId][position] = term
+                matcher.next()
+            if entries:
+                self.postings[term] = _Postings(entries, size)
+
+        self.tokens = None
+        if positionsByAyah is not None:
+            self.tokens = [
+                [positions[position] for position in sorted(positions)]
+                for positions in positionsByAyah
+            ]
+
+    def analyze(self, text):
+        """Returns the terms of a piece of query text, as the index analyzed them."""
+        return list(self.fieldType.process_text(text, mode='query'))
+
+
+class MemoryIndex(object):
+    """An immutable in-memory snapshot of a whoosh index: the stored fields of every
+    ayah in surah/ayah order and the postings of some of its fields.
+
+    :param ix: The whoosh index
+    :type ix: whoosh.index.Index
+    :param fieldNames: The fields to load postings for
+    :type fieldNames: iterable
+    :param generation: The generation of the index being read
+    """
+
+    def __init__(self, ix, fieldNames, generation=None):
+        self.generation = generation
+        schema = ix.schema
+        self.normalized = isNormalized(schema)
+        with ix.reader() as reader:
+            stored = {docnum: reader.stored_fields(docnum)
+                      for docnum in reader.all_doc_ids()}
+            order = sorted(stored, key=lambda docnum: (stored[docnum]['surah_num'],
+                                                       stored[docnum]['ayah_num']))
+            self.documents = [stored[docnum] for docnum in order]
+            self.byAyah = {(document['surah_num'], document['ayah_num']): ayahId
+                           for ayahId, document in enumerate(self.documents)}
+            ayahIds = {docnum: ayahId for ayahId, docnum in enumerate(order)}
+            self.fields = {
+                fieldName: _FieldIndex(reader, schema[fieldName], fieldName, ayahIds)
+                for fieldName in fieldNames if fieldName in schema
+            }
+
+
+class MemoryBackend(SearchBackend):
+    """Searches postings held in memory, built from the whoosh index at startup."""
+
+    FIELDS = ("simple_ayah", "roots", "decomposed_ayah")
+
+    def __init__(self, directory, B=0.75, K1=1.2):
+        super(MemoryBackend, self).__init__(directory)
+        self._ix = open_dir(directory)
+        self._B = B
+        self._K1 = K1
+        self._index = MemoryIndex(self._ix, self.FIELDS, self._readGeneration(self._ix))
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._index.generation
+
+    @property
+    def normalized(self):
+        return self._index.normalized
+
+    def refresh(self):
+        with self._lock:
+            ix = self._ix
+            if self._directoryChanged(self._index.generation):
+                ix = open_dir(self.directory)
+            generation = self._readGeneration(ix)
+            if generation == self._index.generation:
+                return False
+            self._ix = ix
+            self._index = MemoryIndex(ix, self.FIELDS, generation)
+            return True
+
+    def _idf(self, index, postings):
+        return log(len(index.documents) / (len(postings.ids) + 1)) + 1
+
+    def _bm25(self, idf, weight, length, averageLength):
+        return idf * ((weight * (self._K1 + 1)) / (
+            weight + self._K1 * ((1 - self._B) + self._B * length / averageLength)))
+
+    def _matchClause(self, field, clause, isPhrase):
+        """Finds the ayahs matching one query word or phrase in one field.
+
+        :return: The bitmap of matching ayahs and the postings of the clause's terms,
+            or None if the text has no searchable terms in this field
+        :rtype: tuple(int, list), None
+        """
+        terms = field.analyze(clause)
+        if not terms:
+            return None
+        postingsList = [field.postings.get(term) for term in terms]
+        if any(postings is None for postings in postingsList):
+            return 0, []
+        bitmap = postingsList[0].bitmap
+        for postings in postingsList[1:]:
+            bitmap &= postings.bitmap
+        if isPhrase and len(terms) > 1 and field.tokens is not None:
+            phraseLength = len(terms)
+            phraseBitmap = 0
+            for ayahId in _iterBits(bitmap):
+                tokens = field.tokens[ayahId]
+                for start in range(len(tokens) - phraseLength + 1):
+                    if tokens[start:start + phraseLength] == terms:
+                        phraseBitmap |= 1 << ayahId
+                        break
+            bitmap = phraseBitmap
+        return bitmap, list(zip(terms, postingsList))
+
+    def search(self, stage, value, limit=None, terms=False):
+        index = self._index
+        phrases = _PHRASE.findall(value)
+        clauses = [(word, False) for word in _PHRASE.sub(' ', value).split()]
+        clauses += [(phrase, True) for phrase in phrases]
+
+        # Every clause matches if it matches in any of the stage's fields.
+        clauseMatches = []
+        for clause, isPhrase in clauses:
+            clauseBitmap = None
+            scoring = []
+            for fieldName in stage.fields:
+                field = index.fields.get(fieldName)
+                match = field and self._matchClause(field, clause, isPhrase)
+                if match is None:
+                    continue
+                fieldBitmap, termPostings = match
+                clauseBitmap = fieldBitmap | (clauseBitmap or 0)
+                scoring.extend((fieldName, field, term, postings, fieldBitmap)
+                               for term, postings in termPostings)
+            # Words without any searchable term are dropped, as the query parser does.
+            if clauseBitmap is not None:
+                clauseMatches.append((clauseBitmap, scoring))
+
+        if not clauseMatches:
+            return SearchResults([], 0, [] if terms else None)
+        bitmap = clauseMatches[0][0]
+        for clauseBitmap, _ in clauseMatches[1:]:
+            if stage.group == OR:
+                bitmap |= clauseBitmap
+            else:
+                bitmap &= clauseBitmap
+
+        scorers = []
+        matchedTerms = []
+        for _, scoring in clauseMatches:
+            for fieldName, field, term, postings, fieldBitmap in scoring:
+                if not fieldBitmap & bitmap:
+                    continue
+                if (fieldName, term) not in matchedTerms:
+                    matchedTerms.append((fieldName, term))
+                scorers.append((field, postings, fieldBitmap, self._idf(index, postings)))
+
+        scored = []
+        for ayahId in _iterBits(bitmap):
+            score = 0.0
+            for field, postings, fieldBitmap, idf in scorers:
+                if fieldBitmap >> ayahId & 1:
+                    score += self._bm25(idf, postings.weight(ayahId),
+                                        field.lengths[ayahId], field.averageLength)
+            scored.append((-score, ayahId))
+        if limit is None:
+            scored.sort()
+        else:
+            scored = heapq.nsmallest(limit, scored)
+
+        hits = [Hit(-negativeScore, index.documents[ayahId])
+                for negativeScore, ayahId in scored]
+        return SearchResults(hits, bin(bitmap).count('1'),
+                             [term for _, term in matchedTerms] if terms else None)
+
+    def getDocuments(self, ayahs):
+        index = self._index
+        return {ayah: index.documents[index.byAyah[ayah]]
+                for ayah in ayahs if ayah in index.byAyah}
+
+    def getAllDocuments(self):
+        return list(self._index.documents)
+
+    def getVocabulary(self, fieldName):
+        field = self._index.fields[fieldName]
+        return {term: len(postings.ids) for term, postings in field.postings.items()}
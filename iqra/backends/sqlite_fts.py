@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite FTS5 search backend.
+
+The ayahs are searched in a SQLite database kept next to the whoosh index, in
+``<index dir>/fts.sqlite3``. The stored fields of every ayah are in a plain table, and
+the searched fields go into an FTS5 virtual table, already run through the Arabic
+analyzer so the FTS5 tokenizer only has to split them on spaces. Both tables share
+their rowid, ``surah number * 1000 + ayah number``.
+
+Queries are analyzed the same way and compiled to an FTS5 expression per stage, which
+SQLite ranks with its built-in BM25. The database is built from the whoosh index by the
+``build_iqra_fts`` command and replaced atomically, so a rebuild is picked up like a
+new index generation.
+"""
+import os
+import re
+import sqlite3
+import threading
+from urllib.request import pathname2url
+from .base import Hit, SearchBackend, SearchResults
+from ..normalization import ArabicAnalyzer
+from ..pipeline import OR
+
+FTS_FILENAME = 'fts.sqlite3'
+FTS_FIELDS = ("simple_ayah", "roots", "decomposed_ayah")
+STORED_FIELDS = ("surah_num", "ayah_num", "surah_name_en", "surah_name_ar", "ayah",
+                 "simple_ayah")
+
+# SQLite versions before 3.32 accept at most 999 parameters per statement.
+_MAX_PARAMETERS = 500
+_PHRASE = re.compile(r'"([^"]*)"')
+
+
+def _rowid(surahNum, ayahNum):
+    return surahNum * 1000 + ayahNum
+
+
+def _analyze(analyzer, text, mode=''):
+    return [token.text for token in analyzer(text, mode=mode)]
+
+
+def _quote(terms):
+    """Quotes terms as one FTS5 string, which matches them as a phrase."""
+    return '"{}"'.format(' '.join(term.replace('"', '""') for term in terms))
+
+
+def writeDatabase(path, documents):
+    """Writes the FTS database of some ayahs, replacing the file at path atomically.
+
+    :param path: The database file
+    :type path: str
+    :param documents: The stored fields of every ayah, with its roots and
+        decomposed_ayah
+    :type documents: iterable(dict)
+    :return: The number of ayahs written
+    :rtype: int
+    """
+    analyzer = ArabicAnalyzer()
+    partialPath = path + '.partial'
+    if os.path.exists(partialPath):
+        os.remove(partialPath)
+    connection = sqlite3.connect(partialPath)
+    count = 0
+    try:
+        with connection:
+            connection.execute(
+                    'CREATE TABLE ayahs (rowid INTEGER PRIMARY KEY, {})'.format(
+                        ', '.join(STORED_FIELDS)))
+            connection.execute(
+                    "CREATE VIRTUAL TABLE ayahs_fts USING fts5({}, content='', "
+                    "tokenize='unicode61 remove_diacritics 0')".format(
+                        ', '.join(FTS_FIELDS)))
+            connection.execute(
+                    "CREATE VIRTUAL TABLE ayahs_vocab USING fts5vocab(ayahs_fts, 'col')")
+            for document in documents:
+                rowid = _rowid(document['surah_num'], document['ayah_num'])
+                connection.execute(
+                        'INSERT INTO ayahs VALUES (?, {})'.format(
+                            ', '.join('?' * len(STORED_FIELDS))),
+                        [rowid] + [document[fieldName] for fieldName in STORED_FIELDS])
+                connection.execute(
+                        'INSERT INTO ayahs_fts (rowid, {}) VALUES (?, {})'.format(
+                            ', '.join(FTS_FIELDS), ', '.join('?' * len(FTS_FIELDS))),
+                        [rowid] + [' '.join(_analyze(analyzer, document.get(fieldName)
+                                                     or ''))
+                                   for fieldName in FTS_FIELDS])
+                count += 1
+            connection.execute("INSERT INTO ayahs_fts (ayahs_fts) VALUES ('optimize')")
+    except BaseException:
+        connection.close()
+        os.remove(partialPath)
+        raise
+    connection.close()
+    os.replace(partialPath, path)
+    return count
+
+
+class SqliteBackend(SearchBackend):
+    """Searches the SQLite FTS5 database of an index directory."""
+
+    def __init__(self, directory):
+        super(SqliteBackend, self).__init__(directory)
+        self._analyzer = ArabicAnalyzer()
+        self._generation = self._readDatabaseGeneration()
+        # sqlite3 connections can only be used by the thread that opened them, so each
+        # thread keeps its own and reuses it across queries.
+        self._local = threading.local()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, FTS_FILENAME)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def normalized(self):
+        # The database always holds analyzed text, whatever the whoosh index it was
+        # built from.
+        return True
+
+    def _readDatabaseGeneration(self):
+        """Returns the resolved path and modification time of the database. Rebuilds
+        replace the file, so a new modification time is a new database.
+
+        :rtype: tuple(str, int)
+        """
+        path = os.path.realpath(self.path)
+        if not os.path.isfile(path):
+            raise IOError('No FTS database at {}: build it with build_iqra_fts.'.format(
+                    path))
+        return path, os.stat(path).st_mtime_ns
+
+    def refresh(self):
+        generation = self._readDatabaseGeneration()
+        if generation == self._generation:
+            return False
+        self._generation = generation
+        return True
+
+    def _getConnection(self):
+        """Returns this thread's read-only connection, reopening it if the database has
+        been replaced.
+
+        :rtype: sqlite3.Connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.generation == self._generation:
+            return connection
+        if connection is not None:
+            connection.close()
+        generation = self._generation
+        connection = sqlite3.connect(
+                'file:{}?mode=ro'.format(pathname2url(generation[0])), uri=True)
+        self._local.connection = connection
+        self._local.generation = generation
+        return connection
+
+    def _compile(self, stage, value):
+        """Compiles a query to an FTS5 expression. Quoted phrases are kept together,
+        every other word is one clause, and a clause matches if it matches in any of
+        the stage's fields, like with the whoosh query parser.
+
+        :return: The expression, or None if the query has no searchable terms, and the
+            terms of the query
+        :rtype: tuple(str, list)
+        """
+        clauses = [_analyze(self._analyzer, word, 'query')
+                   for word in _PHRASE.sub(' ', value).split()]
+        clauses += [_analyze(self._analyzer, phrase, 'query')
+                    for phrase in _PHRASE.findall(value)]
+        # Words without any searchable term are dropped, as the query parser does.
+        clauses = [terms for terms in clauses if terms]
+        if not clauses:
+            return None, []
+        columns = '{{{}}} : '.format(' '.join(stage.fields))
+        operator = ' OR ' if stage.group == OR else ' AND '
+        expression = operator.join(columns + _quote(terms) for terms in clauses)
+        terms = []
+        for clauseTerms in clauses:
+            terms.extend(term for term in clauseTerms if term not in terms)
+        return expression, terms
+
+    def _toDocument(self, row):
+        return dict(zip(STORED_FIELDS, row))
+
+    def search(self, stage, value, limit=None, terms=False):
+        expression, queryTerms = self._compile(stage, value)
+        if expression is None:
+            return SearchResults([], 0, [] if terms else None)
+        connection = self._getConnection()
+        # bm25() is lower for better matches, so scores are its negation.
+        rows = connection.execute(
+                'SELECT -bm25(ayahs_fts), ayahs_fts.rowid, {} FROM ayahs_fts '
+                'JOIN ayahs ON ayahs.rowid = ayahs_fts.rowid '
+                'WHERE ayahs_fts MATCH ? ORDER BY bm25(ayahs_fts) LIMIT ?'.format(
+                    ', '.join('ayahs.' + fieldName for fieldName in STORED_FIELDS)),
+                (expression, -1 if limit is None else limit)).fetchall()
+        hits = [Hit(row[0], self._toDocument(row[2:])) for row in rows]
+
+        matchedTerms = None
+        if terms:
+            rowids = [row[1] for row in rows][:_MAX_PARAMETERS]
+            columns = '{{{}}} : '.format(' '.join(stage.fields))
+            matchedTerms = [
+                term for term in queryTerms
+                if rowids and connection.execute(
+                    'SELECT 1 FROM ayahs_fts WHERE ayahs_fts MATCH ? AND rowid IN ({}) '
+                    'LIMIT 1'.format(', '.join('?' * len(rowids))),
+                    [columns + _quote([term])] + rowids).fetchone()
+            ]
+
+        def countMatches():
+            return self._getConnection().execute(
+                    'SELECT count(*) FROM ayahs_fts WHERE ayahs_fts MATCH ?',
+                    (expression,)).fetchone()[0]
+        # Counting every match is an extra query, so it is only done on demand.
+        return SearchResults(hits, countMatches if limit is not None else len(hits),
+                             matchedTerms)
+
+    def getDocuments(self, ayahs):
+        rowids = sorted({_rowid(*ayah) for ayah in ayahs})
+        connection = self._getConnection()
+        documents = {}
+        for start in range(0, len(rowids), _MAX_PARAMETERS):
+            chunk = rowids[start:start + _MAX_PARAMETERS]
+            for row in connection.execute(
+                    'SELECT {} FROM ayahs WHERE rowid IN ({})'.format(
+                        ', '.join(STORED_FIELDS), ', '.join('?' * len(chunk))), chunk):
+                document = self._toDocument(row)
+                documents[(document['surah_num'], document['ayah_num'])] = document
+        return documents
+
+    def getAllDocuments(self):
+        return [self._toDocument(row) for row in self._getConnection().execute(
+                'SELECT {} FROM ayahs ORDER BY rowid'.format(', '.join(STORED_FIELDS)))]
+
+    def getVocabulary(self, fieldName):
+        return dict(self._getConnection().execute(
+                'SELECT term, doc FROM ayahs_vocab WHERE col = ?', (fieldName,)))
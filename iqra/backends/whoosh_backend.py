@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from operator import itemgetter
+import threading
+from whoosh.index import open_dir
+from whoosh.qparser import (
+    QueryParser, MultifieldParser, AndGroup, OrGroup, FieldsPlugin, WildcardPlugin,
+    PhrasePlugin, SequencePlugin
+)
+from .base import Hit, SearchBackend, SearchResults
+from ..normalization import isNormalized
+from ..pipeline import OR
+
+
+class WhooshBackend(SearchBackend):
+    """Searches the whoosh index on disk."""
+
+    def __init__(self, directory):
+        super(WhooshBackend, self).__init__(directory)
+        self._ix = open_dir(directory)
+        self._generation = self._readGeneration(self._ix)
+        self._normalized = isNormalized(self._ix.schema)
+        self._parsers = {}
+        # Whoosh searchers keep open file handles and are not safe to share between
+        # threads, so each thread keeps its own and reuses it across queries.
+        self._local = threading.local()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def normalized(self):
+        return self._normalized
+
+    def refresh(self):
+        ix = self._ix
+        if self._directoryChanged(self._generation):
+            ix = open_dir(self.directory)
+        generation = self._readGeneration(ix)
+        if generation == self._generation:
+            return False
+        # The schema may have changed with the index, so the parsers are rebuilt.
+        self._ix = ix
+        self._parsers = {}
+        self._normalized = isNormalized(ix.schema)
+        self._generation = generation
+        return True
+
+    def _getSearcher(self):
+        """Returns this thread's searcher, refreshing it if the index has changed.
+
+        :return: A searcher over the latest known index generation
+        :rtype: whoosh.searching.Searcher
+        """
+        searcher = getattr(self._local, 'searcher', None)
+        if searcher is None:
+            searcher = self._ix.searcher()
+        elif self._local.generation != self._generation:
+            if self._local.generation[0] == self._generation[0]:
+                # Same directory: only the changed segments are reopened.
+                newSearcher = searcher.refresh()
+            else:
+                newSearcher = self._ix.searcher()
+            if newSearcher is not searcher:
+                searcher.close()
+            searcher = newSearcher
+        self._local.searcher = searcher
+        self._local.generation = self._generation
+        return searcher
+
+    def _getParser(self, stage):
+        """Returns the query parser of a stage, building it on first use. Reading the
+        schema reads the index TOC from disk, so parsers are only built once per index
+        generation. Parsing keeps no state on the parser, so they are shared between
+        threads.
+
+        :rtype: whoosh.qparser.QueryParser
+        """
+        parsers = self._parsers
+        parser = parsers.get(stage.name)
+        if parser is None:
+            group = OrGroup if stage.group == OR else AndGroup
+            if len(stage.fields) == 1:
+                parser = QueryParser(stage.fields[0], self._ix.schema, group=group)
+            else:
+                parser = MultifieldParser(stage.fields, self._ix.schema, group=group)
+            parser.remove_plugin_class(FieldsPlugin)
+            parser.remove_plugin_class(WildcardPlugin)
+            parsers[stage.name] = parser
+        return parser
+
+    def search(self, stage, value, limit=None, terms=False):
+        query = self._getParser(stage).parse(value)
+        results = self._getSearcher().search(query, terms=terms, limit=limit)
+        matchedTerms = None
+        if terms:
+            # term is a tuple where the second index contains the matching term
+            matchedTerms = [term[1].decode('utf-8') if isinstance(term[1], bytes)
+                            else term[1] for term in results.matched_terms()]
+        hits = [Hit(hit.score, hit.fields()) for hit in results]
+        # len() of limited results counts every match, so it is only done on demand.
+        return SearchResults(hits, results.__len__ if limit is not None else len(hits),
+                             matchedTerms)
+
+    def getDocuments(self, ayahs):
+        ayahs = sorted(set(ayahs))
+        if not ayahs:
+            return {}
+        parser = MultifieldParser(["surah_num", "ayah_num"], self._ix.schema)
+        parser.remove_plugin_class(PhrasePlugin)
+        parser.add_plugin(SequencePlugin())
+        query = parser.parse(" OR ".join(
+                "surah_num:{} AND ayah_num:{}".format(*ayah) for ayah in ayahs))
+        return {
+            (hit['surah_num'], hit['ayah_num']): hit.fields()
+            for hit in self._getSearcher().search(query, limit=None)
+        }
+
+    def getAllDocuments(self):
+        documents = list(self._getSearcher().all_stored_fields())
+        documents.sort(key=itemgetter('surah_num', 'ayah_num'))
+        return documents
+
+    def getVocabulary(self, fieldName):
+        reader = self._getSearcher().reader()
+        fieldType = self._ix.schema[fieldName]
+        return {fieldType.from_bytes(termBytes): termInfo.doc_frequency()
+                for termBytes, termInfo in reader.iter_field(fieldName)}
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResultCache(object):
+    """Thread-safe LRU cache for search results with an optional time to live.
+    Entries are tied to an index generation and the whole cache is dropped as soon as
+    a different generation is seen.
+    """
+
+    def __init__(self, maxSize, ttl=None, clock=time.monotonic):
+        """
+        :param maxSize: Maximum number of entries, 0 disables the cache
+        :type maxSize: int
+        :param ttl: Seconds an entry stays valid, or None to keep it until evicted
+        :type ttl: float, None
+        """
+        self._maxSize = maxSize
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _checkGeneration(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key, generation):
+        """Returns the cached value for a key, or None on a miss.
+
+        :param key: The cache key
+        :type key: hashable
+        :param generation: The index generation the caller is searching
+        :type generation: int
+        """
+        with self._lock:
+            self._checkGeneration(generation)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expiry = entry
+                if expiry is None or expiry > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation):
+        if self._maxSize <= 0:
+            return
+        expiry = None if self._ttl is None else self._clock() + self._ttl
+        with self._lock:
+            self._checkGeneration(generation)
+            self._entries[key] = (value, expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the cache counters.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "size"     : len(self._entries),
+                "maxSize"  : self._maxSize,
+                "hits"     : self.hits,
+                "misses"   : self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Building the Iqra whoosh index.
+
+Every build writes a complete index into a new generation directory next to the index
+directory (``<index dir>.generations/<timestamp>``). The index directory itself is a
+symlink to the active generation, and publishing a build swaps that symlink atomically,
+so search engines never see a half-written index and pick the new one up on their
+next refresh. A plain index directory, like the one shipped in the repository, is never
+replaced: rebuilt indexes are published at a path outside the source tree.
+"""
+import json
+import os
+import shutil
+import time
+from whoosh.fields import Schema, KEYWORD, NUMERIC, STORED, TEXT
+from whoosh.index import open_dir
+from .backends.memory import MemoryIndex
+from .backends.sqlite_fts import FTS_FILENAME, writeDatabase
+from .normalization import ArabicAnalyzer, ArabicKeywordAnalyzer, normalize
+from .similarity import SIMILARITY_FILENAME, similarAyahs, writeNeighbours
+
+MORPHOLOGY_FIELDS = ("roots", "decomposed_ayah")
+
+
+def buildSchema():
+    """Returns the schema of the Iqra index. The text fields are analyzed with the
+    Arabic normalization, so queries only need to be normalized the same way.
+
+    :rtype: whoosh.fields.Schema
+    """
+    return Schema(
+        surah_num=NUMERIC(stored=True),
+        ayah_num=NUMERIC(stored=True),
+        surah_name_en=STORED,
+        surah_name_ar=STORED,
+        ayah=STORED,
+        simple_ayah=TEXT(stored=True, analyzer=ArabicAnalyzer()),
+        # Stored so that rebuilds without a morphology file can carry them over.
+        roots=KEYWORD(stored=True, scorable=True, analyzer=ArabicKeywordAnalyzer()),
+        decomposed_ayah=KEYWORD(stored=True, scorable=True,
+                                analyzer=ArabicKeywordAnalyzer()),
+    )
+
+
+def loadMorphology(path):
+    """Loads the roots and decomposed forms of the ayahs from a JSON file shaped like
+    ``{"2:255": {"roots": "...", "decomposed_ayah": "..."}}``.
+
+    :return: The fields by (surah number, ayah number)
+    :rtype: dict
+    """
+    with open(path, encoding='utf-8') as morphology_file:
+        data = json.load(morphology_file)
+    morphology = {}
+    for key, fields in data.items():
+        surah_num, ayah_num = key.split(':')
+        morphology[(int(surah_num), int(ayah_num))] = fields
+    return morphology
+
+
+def morphologyFromIndex(directory):
+    """Recovers the roots and decomposed forms of the ayahs from an existing index.
+    Indexes built by build_iqra_index store them. Older indexes only have them if
+    their postings have positions, and then they are rebuilt as the analyzer left them.
+    Fields indexed without positions cannot be recovered.
+
+    :return: The fields by (surah number, ayah number), only for the ayahs whose
+        fields were all recovered
+    :rtype: dict
+    """
+    index = MemoryIndex(open_dir(directory), MORPHOLOGY_FIELDS)
+    morphology = {}
+    for ayahId, document in enumerate(index.documents):
+        fields = {}
+        for fieldName in MORPHOLOGY_FIELDS:
+            field = index.fields.get(fieldName)
+            if fieldName in document:
+                fields[fieldName] = document[fieldName]
+            elif field is not None and field.tokens is not None:
+                fields[fieldName] = ' '.join(field.tokens[ayahId])
+        if len(fields) == len(MORPHOLOGY_FIELDS):
+            morphology[(document['surah_num'], document['ayah_num'])] = fields
+    return morphology
+
+
+def missingMorphology(morphology, surahs=None):
+    """Returns the ayahs of the quran database that have no roots or decomposed form.
+
+    :param morphology: The fields by (surah number, ayah number)
+    :type morphology: dict
+    :param surahs: Only check the ayahs of these surah numbers
+    :type surahs: list, None
+    :return: The (surah number, ayah number) of the ayahs missing
+    :rtype: list
+    """
+    from quran.models import Ayah
+
+    ayahs = Ayah.objects.order_by('chapter_id__number', 'verse_number')
+    if surahs:
+        ayahs = ayahs.filter(chapter_id__number__in=surahs)
+    return [
+        key for key in ayahs.values_list('chapter_id__number', 'verse_number')
+        if not all(fieldName in morphology.get(key, {})
+                   for fieldName in MORPHOLOGY_FIELDS)
+    ]
+
+
+def writeFtsDatabase(directory):
+    """Writes the database of the sqlite backend into an index directory, from the
+    whoosh index in it.
+
+    :return: The number of ayahs written
+    :rtype: int
+    """
+    morphology = morphologyFromIndex(directory)
+    with open_dir(directory).searcher() as searcher:
+        documents = [
+            dict(fields, **morphology.get((fields['surah_num'], fields['ayah_num']), {}))
+            for fields in searcher.all_stored_fields()
+        ]
+    return writeDatabase(os.path.join(directory, FTS_FILENAME), documents)
+
+
+def hasFtsDatabase(directory):
+    return os.path.isfile(os.path.join(directory, FTS_FILENAME))
+
+
+def writeSimilarity(directory, **options):
+    """Writes the similar ayahs of every ayah into an index directory, from the
+    whoosh index in it.
+
+    :param options: Keyword arguments of :func:`iqra.similarity.similarAyahs`
+    :return: The number of ayahs with similar ayahs
+    :rtype: int
+    """
+    with open_dir(directory).searcher() as searcher:
+        ayahs = {
+            (fields['surah_num'], fields['ayah_num']): normalize(fields['simple_ayah'])
+            for fields in searcher.all_stored_fields()
+        }
+    similar = similarAyahs(ayahs, **options)
+    writeNeighbours(os.path.join(directory, SIMILARITY_FILENAME), similar)
+    return len(similar)
+
+
+def hasSimilarity(directory):
+    return os.path.isfile(os.path.join(directory, SIMILARITY_FILENAME))
+
+
+def ayahDocuments(surahs=None, morphology=None):
+    """Yields the index documents of the ayahs in the quran database.
+
+    :param surahs: Only yield the ayahs of these surah numbers
+    :type surahs: list, None
+    :param morphology: The roots and decomposed forms by (surah number, ayah number)
+    :type morphology: dict, None
+    """
+    from quran.models import Ayah
+
+    morphology = morphology or {}
+    ayahs = Ayah.objects.select_related('chapter_id').order_by('chapter_id__number',
+                                                               'verse_number')
+    if surahs:
+        ayahs = ayahs.filter(chapter_id__number__in=surahs)
+    for ayah in ayahs.iterator():
+        surah = ayah.chapter_id
+        fields = morphology.get((surah.number, ayah.verse_number), {})
+        yield {
+            'surah_num'      : surah.number,
+            'ayah_num'       : ayah.verse_number,
+            'surah_name_en'  : surah.name_en or '',
+            'surah_name_ar'  : surah.name_ar or '',
+            'ayah'           : ayah.text_madani,
+            'simple_ayah'    : ayah.text_simple,
+            'roots'          : fields.get('roots', ''),
+            'decomposed_ayah': fields.get('decomposed_ayah', ''),
+        }
+
+
+def generationsDir(indexDir):
+    return os.path.normpath(indexDir) + '.generations'
+
+
+def newGenerationDir(indexDir):
+    """Creates an empty directory for a new index generation.
+
+    :rtype: str
+    """
+    root = generationsDir(indexDir)
+    name = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(root, name)
+    suffix = 1
+    while os.path.exists(path):
+        path = os.path.join(root, '{}-{}'.format(name, suffix))
+        suffix += 1
+    os.makedirs(path)
+    return path
+
+
+def copyGeneration(indexDir, generationDir):
+    """Copies the active index into a generation directory, for incremental builds."""
+    os.rmdir(generationDir)
+    shutil.copytree(os.path.realpath(indexDir), generationDir,
+                    ignore=shutil.ignore_patterns('*WRITELOCK'))
+
+
+def canPublish(indexDir):
+    """True if generations can be published at an index directory: it is a symlink or
+    does not exist yet. A plain directory, e.g. the index tracked in the repository, is
+    never replaced.
+    """
+    indexDir = os.path.normpath(indexDir)
+    return os.path.islink(indexDir) or not os.path.lexists(indexDir)
+
+
+def publishGeneration(indexDir, generationDir):
+    """Points the index directory at a generation by atomically replacing its symlink.
+
+    :raises ValueError: If the index directory is a plain directory
+    """
+    indexDir = os.path.normpath(indexDir)
+    if not canPublish(indexDir):
+        raise ValueError('{} is not a symlink to an index generation'.format(indexDir))
+
+    swapLink = indexDir + '.swap'
+    if os.path.lexists(swapLink):
+        os.unlink(swapLink)
+    os.symlink(os.path.relpath(generationDir, os.path.dirname(indexDir)), swapLink)
+    os.replace(swapLink, indexDir)
+
+
+def pruneGenerations(indexDir, keep):
+    """Deletes the oldest generations, always keeping the active one.
+
+    :param keep: Number of generations to keep, including the active one
+    :type keep: int
+    :return: The deleted directories
+    :rtype: list
+    """
+    root = generationsDir(indexDir)
+    active = os.path.realpath(indexDir)
+    generations = sorted(
+        (os.path.join(root, name) for name in os.listdir(root)),
+        key=os.path.getmtime, reverse=True)
+    kept = [path for path in generations if os.path.realpath(path) == active]
+    deleted = []
+    for path in generations:
+        if path in kept:
+            continue
+        if len(kept) < keep:
+            kept.append(path)
+        else:
+            shutil.rmtree(path)
+            deleted.append(path)
+    return deleted
+
+
+def directorySize(path):
+    """Returns the total size in bytes of the files in a directory."""
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
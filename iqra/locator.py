@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Locates the span of consecutive ayahs a long transcript was recited from.
+
+The normalized words of the whole Quran are laid end to end, surah by surah, and every
+word n-gram is indexed by its positions in that stream. Each n-gram of the transcript
+that occurs in the Quran votes for the offset between its position in the Quran and its
+position in the transcript. A recitation of consecutive ayahs puts most of its votes on
+one offset, give or take the words the recognizer dropped or added. The best band of
+offsets anchors the alignment, which then slides along the transcript in both
+directions, following the offset as dropped and added words shift it. The Quran
+positions of the aligned n-grams give the span.
+
+Every transcript n-gram looks up at most ``maxOccurrences`` positions, so locating is
+linear in the length of the transcript.
+"""
+from array import array
+from collections import Counter
+
+
+class Location(object):
+    """The span of ayahs a transcript was located in.
+
+    :param surahNum: The surah number
+    :param startAyah: The first ayah number of the span
+    :param endAyah: The last ayah number of the span
+    :param coverage: The fraction of the transcript's n-grams aligned with the span
+    """
+
+    def __init__(self, surahNum, startAyah, endAyah, coverage):
+        self.surahNum = surahNum
+        self.startAyah = startAyah
+        self.endAyah = endAyah
+        self.coverage = coverage
+
+
+class SpanLocator(object):
+    """A word n-gram index over the whole Quran.
+
+    :param ayahs: The normalized text of every ayah by (surah number, ayah number)
+    :type ayahs: dict
+    :param n: Number of words per n-gram
+    :type n: int
+    :param maxOccurrences: N-grams occurring more often than this, like the basmala, do
+        not vote, since they do not say where the transcript is
+    :type maxOccurrences: int
+    :param bandWidth: Width in words of the bands of offsets votes are counted in
+    :type bandWidth: int
+    """
+
+    def __init__(self, ayahs, n=3, maxOccurrences=32, bandWidth=8):
+        self.n = n
+        self.maxOccurrences = maxOccurrences
+        self.bandWidth = bandWidth
+        self.ayahs = sorted(ayahs)
+        positions = {}
+        ayahIds = array('H')
+        wordCount = 0
+        surahNum = None
+        surahStart = 0
+        for ayahId, ayah in enumerate(self.ayahs):
+            if ayah[0] != surahNum:
+                surahNum = ayah[0]
+                surahStart = wordCount
+                surahWords = []
+            for word in ayahs[ayah].split():
+                surahWords.append(word)
+                ayahIds.append(ayahId)
+                wordCount += 1
+                # N-grams never cross from one surah into the next.
+                if wordCount - surahStart >= n:
+                    ngram = ' '.join(surahWords[-n:])
+                    positions.setdefault(ngram, []).append(wordCount - n)
+        self._ayahIds = ayahIds
+        self._positions = {
+            ngram: array('I', ngramPositions)
+            for ngram, ngramPositions in positions.items()
+            if len(ngramPositions) <= maxOccurrences
+        }
+
+    def locate(self, value, minVotes=2):
+        """Finds the span of consecutive ayahs best aligned with a transcript.
+
+        :param value: The normalized transcript
+        :type value: str
+        :param minVotes: Minimum number of aligned n-grams for a span to be returned
+        :type minVotes: int
+        :return: The span, or None if the transcript could not be located
+        :rtype: Location, None
+        """
+        words = value.split()
+        n = self.n
+        ngramCount = len(words) - n + 1
+        if ngramCount < 1:
+            return None
+
+        # The Quran positions of every n-gram of the transcript.
+        hits = []
+        votes = Counter()
+        for position in range(ngramCount):
+            ngram = ' '.join(words[position:position + n])
+            quranPositions = self._positions.get(ngram, ())
+            hits.append(quranPositions)
+            for quranPosition in quranPositions:
+                votes[(quranPosition - position) // self.bandWidth] += 1
+        if not votes:
+            return None
+
+        # A band also counts the votes of its neighbours, for the offsets near a border.
+        def bandVotes(band):
+            return votes[band - 1] + votes[band] + votes[band + 1]
+        bestBand = max(votes, key=lambda band: (bandVotes(band), -band))
+        anchors = [
+            (position, quranPosition - position)
+            for position, quranPositions in enumerate(hits)
+            for quranPosition in quranPositions
+            if abs((quranPosition - position) // self.bandWidth - bestBand) <= 1
+        ]
+        anchorPosition, anchorOffset = anchors[len(anchors) // 2]
+        aligned = (self._follow(hits, range(anchorPosition, ngramCount), anchorOffset) +
+                   self._follow(hits, range(anchorPosition - 1, -1, -1), anchorOffset))
+        if len(aligned) < minVotes:
+            return None
+
+        # The span stays inside the surah with most of the aligned n-grams.
+        surahVotes = Counter(self._surahAt(quranPosition) for _, quranPosition in aligned)
+        surahNum = surahVotes.most_common(1)[0][0]
+        aligned = [(position, quranPosition) for position, quranPosition in aligned
+                   if self._surahAt(quranPosition) == surahNum]
+        quranPositions = [quranPosition for _, quranPosition in aligned]
+        start = self.ayahs[self._ayahIds[min(quranPositions)]]
+        end = self.ayahs[self._ayahIds[max(quranPositions) + n - 1]]
+        return Location(surahNum, start[1], end[1], len(aligned) / ngramCount)
+
+    def _follow(self, hits, positions, offset):
+        """Aligns transcript n-grams in order, keeping the occurrence of each that is
+        closest to the current offset and moving the offset with it.
+
+        :return: The aligned (transcript position, Quran position) pairs
+        :rtype: list
+        """
+        aligned = []
+        for position in positions:
+            best = None
+            for quranPosition in hits[position]:
+                shift = abs(quranPosition - position - offset)
+                if shift <= self.bandWidth and (best is None or shift < best[0]):
+                    best = (shift, quranPosition)
+            if best is not None:
+                aligned.append((position, best[1]))
+                offset = best[1] - position
+        return aligned
+
+    def _surahAt(self, quranPosition):
+        return self.ayahs[self._ayahIds[quranPosition]][0]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from iqra.backends import loadBackend
+from iqra.cache import ResultCache
+from iqra.Iqra import Iqra
+from iqra.normalization import normalize
+
+DEFAULT_QUERIES = [
+    u'بسم الله الرحمن الرحيم',
+    u'الحمد لله رب العالمين',
+    u'لقد خلقنا الانسان في كبد',
+    u'قل هو الله احد',
+    u'الله',
+]
+
+
+def _percentile(samples, percent):
+    """Returns the given percentile of a list of samples (nearest rank)."""
+    ordered = sorted(samples)
+    index = max(0, int(round(percent / 100.0 * len(ordered))) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Measures cold vs. warm Iqra search latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help='Queries to run (Arabic text).')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of warm runs per query.')
+        parser.add_argument('--translation', default='en-hilali')
+        parser.add_argument('--backend', action='append', dest='backends',
+                            help='Backend to benchmark (whoosh, memory, sqlite or a '
+                                 'dotted path). Repeat to compare backends. Defaults to '
+                                 'IQRA_BACKEND.')
+        parser.add_argument('--concurrent-fallback', action='store_true',
+                            help='Also measure warm searches with the fallback stages '
+                                 'run concurrently.')
+        parser.add_argument('--normalization', action='store_true',
+                            help='Also measure the cost of normalizing the queries and '
+                                 'every ayah.')
+
+    def report(self, label, samples):
+        # Throughput of one thread running the queries back to back.
+        self.stdout.write(
+            '{:<16} n={:<5} p50={:8.2f}ms p90={:8.2f}ms p99={:8.2f}ms max={:8.2f}ms '
+            'qps={:8.1f}'.format(
+                label, len(samples), _percentile(samples, 50),
+                _percentile(samples, 90), _percentile(samples, 99), max(samples),
+                len(samples) * 1000 / sum(samples)))
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or DEFAULT_QUERIES
+        for backend in options['backends'] or [settings.IQRA_BACKEND]:
+            self.benchmark(backend, queries, options['translation'], options['repeat'],
+                           options['concurrent_fallback'])
+        if options['normalization']:
+            self.benchmarkNormalization(queries, options['repeat'])
+
+    def benchmark(self, backend, queries, translation, repeat, concurrentFallback=False):
+        # Cold: open the index and run the query the way every request used to.
+        cold = []
+        for query in queries:
+            start = time.perf_counter()
+            Iqra(settings.IQRA_INDEX_DIR, backend=backend).getResult(query, translation)
+            cold.append((time.perf_counter() - start) * 1000)
+
+        # Warm: one long-lived engine, reusing its backend across queries. The result
+        # cache is disabled so every run actually searches.
+        iqra = Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0), backend=backend,
+                    concurrentFallback=False)
+        warm = self.runWarm(iqra, queries, translation, repeat)
+        if concurrentFallback:
+            concurrent = self.runWarm(
+                    Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0),
+                         backend=backend, concurrentFallback=True),
+                    queries, translation, repeat)
+
+        # Cached: the default engine, where repeated queries hit the result cache.
+        cachedIqra = Iqra(settings.IQRA_INDEX_DIR, backend=backend)
+        cached = []
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                cachedIqra.getResult(query, translation)
+                cached.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write('backend {}'.format(backend))
+        self.report('  cold', cold)
+        self.report('  warm', warm)
+        if concurrentFallback:
+            self.report('  concurrent', concurrent)
+        self.report('  cached', cached)
+        for name, stats in sorted(iqra.stageStats().items()):
+            self.stdout.write(
+                '  stage {:<20} calls={:<6} hitRate={:.2f} mean={:.2f}ms'.format(
+                    name, stats['calls'], stats['hitRate'], stats['meanMs']))
+
+    def runWarm(self, iqra, queries, translation, repeat):
+        for query in queries:
+            iqra.getResult(query, translation)
+        warm = []
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                iqra.getResult(query, translation)
+                warm.append((time.perf_counter() - start) * 1000)
+        return warm
+
+    def benchmarkNormalization(self, queries, repeat):
+        loops = 1000
+        perQuery = []
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                for _ in range(loops):
+                    normalize(query)
+                perQuery.append((time.perf_counter() - start) * 1e6 / loops)
+        self.stdout.write('normalization')
+        self.stdout.write(
+            '  {:<14} n={:<5} p50={:8.2f}us p90={:8.2f}us max={:8.2f}us'.format(
+                'per query', len(perQuery), _percentile(perQuery, 50),
+                _percentile(perQuery, 90), max(perQuery)))
+
+        backend = loadBackend(settings.IQRA_BACKEND, settings.IQRA_INDEX_DIR)
+        texts = [document['simple_ayah'] for document in backend.getAllDocuments()]
+        start = time.perf_counter()
+        for text in texts:
+            normalize(text)
+        self.stdout.write('  {:<14} n={:<5} total={:8.2f}ms'.format(
+                'every ayah', len(texts), (time.perf_counter() - start) * 1000))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from whoosh.index import exists_in
+from iqra import indexing
+
+
+class Command(BaseCommand):
+    help = ('Builds the SQLite FTS5 database searched by the sqlite backend from the '
+            'whoosh index, and atomically replaces the previous one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index-dir', default=settings.IQRA_INDEX_DIR,
+                            help='The index directory. Defaults to IQRA_INDEX_DIR.')
+
+    def handle(self, *args, **options):
+        # The database goes into the active generation, next to the index it mirrors.
+        directory = os.path.realpath(options['index_dir'])
+        if not os.path.isdir(directory) or not exists_in(directory):
+            raise CommandError('No whoosh index in {}.'.format(directory))
+
+        start = time.perf_counter()
+        try:
+            count = indexing.writeFtsDatabase(directory)
+        except sqlite3.OperationalError as error:
+            raise CommandError('Could not build the database, is SQLite compiled with '
+                               'FTS5? {}'.format(error))
+        self.stdout.write('Wrote {} ayahs into {} in {:.2f}s'.format(
+                count, directory, time.perf_counter() - start))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from whoosh.index import create_in, exists_in, open_dir
+from iqra import indexing
+
+
+class Command(BaseCommand):
+    help = ('Builds the Iqra whoosh index from the quran database into a new generation '
+            'and atomically makes it the active index.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index-dir', default=settings.IQRA_INDEX_DIR,
+                            help='The index directory (a symlink to the active '
+                                 'generation, created by the first build). Defaults '
+                                 'to IQRA_INDEX_DIR.')
+        parser.add_argument('--morphology',
+                            help='JSON file with the roots and decomposed_ayah of every '
+                                 'ayah, keyed by "surah:ayah". Defaults to the values '
+                                 'stored in the active index.')
+        parser.add_argument('--no-morphology', action='store_true',
+                            help='Build even though the roots and decomposed_ayah of '
+                                 'some ayahs are unknown, leaving them empty.')
+        parser.add_argument('--surah', type=int, action='append', dest='surahs',
+                            help='Incremental build: copy the active index and only '
+                                 'reindex these surahs. Can be repeated.')
+        parser.add_argument('--procs', type=int, default=os.cpu_count() or 1,
+                            help='Number of writer processes for full builds.')
+        parser.add_argument('--limitmb', type=int, default=128,
+                            help='Memory limit per writer process, in MB.')
+        parser.add_argument('--keep', type=int, default=3,
+                            help='Number of generations to keep, including the new one.')
+        parser.add_argument('--fts', action='store_true',
+                            help='Also build the database of the sqlite backend into '
+                                 'the generation. Always done if the active index has '
+                                 'one.')
+        parser.add_argument('--similarity', action='store_true',
+                            help='Also compute the similar ayahs used for suggestions '
+                                 'into the generation. Always done if the active index '
+                                 'has them.')
+        parser.add_argument('--no-publish', action='store_true',
+                            help='Build the generation without making it active.')
+
+    def handle(self, *args, **options):
+        indexDir = options['index_dir']
+        surahs = options['surahs']
+        hasIndex = os.path.isdir(indexDir) and exists_in(indexDir)
+        if surahs and not hasIndex:
+            raise CommandError('An incremental build needs an existing index.')
+        if not options['no_publish'] and not indexing.canPublish(indexDir):
+            raise CommandError(
+                    '{} is a plain directory, which is never replaced. Set '
+                    'IQRA_INDEX_DIR or --index-dir to a path outside the source tree, '
+                    'where the symlink to the active generation will be created.'.format(
+                            indexDir))
+
+        if options['morphology']:
+            morphology = indexing.loadMorphology(options['morphology'])
+        elif hasIndex:
+            morphology = indexing.morphologyFromIndex(indexDir)
+        else:
+            morphology = {}
+        missing = indexing.missingMorphology(morphology, surahs)
+        if missing and not options['no_morphology']:
+            raise CommandError(
+                    'The roots and decomposed_ayah of {} ayahs (e.g. {}:{}) are unknown: '
+                    'the index does not store them, or they are missing from the '
+                    'morphology file. Pass --morphology, or --no-morphology to leave '
+                    'them empty.'.format(len(missing), *missing[0]))
+        elif missing:
+            self.stderr.write('The roots and decomposed_ayah of {} ayahs will be '
+                              'empty.'.format(len(missing)))
+
+        start = time.perf_counter()
+        generationDir = indexing.newGenerationDir(indexDir)
+        count = 0
+        if surahs:
+            indexing.copyGeneration(indexDir, generationDir)
+            writer = open_dir(generationDir).writer()
+            for surah in surahs:
+                writer.delete_by_term('surah_num', surah)
+        else:
+            ix = create_in(generationDir, indexing.buildSchema())
+            writer = ix.writer(procs=options['procs'], limitmb=options['limitmb'])
+        try:
+            for document in indexing.ayahDocuments(surahs, morphology):
+                writer.add_document(**document)
+                count += 1
+        except BaseException:
+            writer.cancel()
+            raise
+        writer.commit()
+        # The copied database of an incremental build is stale, so it is rebuilt too.
+        if options['fts'] or (hasIndex and indexing.hasFtsDatabase(indexDir)):
+            indexing.writeFtsDatabase(generationDir)
+        if options['similarity'] or (hasIndex and indexing.hasSimilarity(indexDir)):
+            indexing.writeSimilarity(generationDir)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write('Indexed {} ayahs into {} in {:.2f}s ({:.1f} MB)'.format(
+                count, generationDir, elapsed,
+                indexing.directorySize(generationDir) / 2.0**20))
+        if options['no_publish']:
+            return
+        indexing.publishGeneration(indexDir, generationDir)
+        self.stdout.write('{} now points to {}'.format(indexDir, generationDir))
+        for deleted in indexing.pruneGenerations(indexDir, options['keep']):
+            self.stdout.write('Deleted old generation {}'.format(deleted))
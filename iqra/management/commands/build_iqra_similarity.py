@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from whoosh.index import exists_in
+from iqra import indexing
+
+
+class Command(BaseCommand):
+    help = ('Finds the most similar ayahs of every ayah with MinHash and writes them '
+            'next to the Iqra index, where searches look up their suggestions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index-dir', default=settings.IQRA_INDEX_DIR,
+                            help='The index directory. Defaults to IQRA_INDEX_DIR.')
+        parser.add_argument('--neighbours', type=int, default=5,
+                            help='Maximum number of similar ayahs kept per ayah.')
+        parser.add_argument('--threshold', type=float, default=0.4,
+                            help='Minimum Jaccard similarity of the word bigrams of two '
+                                 'similar ayahs.')
+        parser.add_argument('--hashes', type=int, default=64,
+                            help='Length of the MinHash signatures.')
+        parser.add_argument('--bands', type=int, default=32,
+                            help='Number of LSH bands. More bands find less similar '
+                                 'pairs, but compare more candidates.')
+
+    def handle(self, *args, **options):
+        # The neighbours go into the active generation, next to the index they describe.
+        directory = os.path.realpath(options['index_dir'])
+        if not os.path.isdir(directory) or not exists_in(directory):
+            raise CommandError('No whoosh index in {}.'.format(directory))
+        if options['bands'] < 1 or options['hashes'] % options['bands']:
+            raise CommandError('--hashes must be a multiple of --bands.')
+
+        start = time.perf_counter()
+        count = indexing.writeSimilarity(
+                directory, neighbours=options['neighbours'],
+                threshold=options['threshold'], numHashes=options['hashes'],
+                bands=options['bands'])
+        self.stdout.write('Found similar ayahs for {} ayahs in {:.2f}s'.format(
+                count, time.perf_counter() - start))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from iqra.translations import TranslationStore
+from quran.models import Ayah, Translation
+from quran.versioning import stamp_version
+
+
+class Command(BaseCommand):
+    help = ('Downloads Iqra translations and imports them into the quran Translation '
+            'table, replacing any previous import of the same translations.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('translations', nargs='+',
+                            help='Translation names, e.g. en-hilali. They are stored as '
+                                 'the resource name of the rows.')
+        parser.add_argument('--language',
+                            help='Language name of the rows. Defaults to the prefix of '
+                                 'the translation name, e.g. EN for en-hilali.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        maxLength = Translation._meta.get_field('resource_name').max_length
+        for translation in options['translations']:
+            if len(translation) > maxLength:
+                raise CommandError('Translation names are at most {} characters: '
+                                   '{}'.format(maxLength, translation))
+
+        store = TranslationStore(settings.IQRA_TRANSLATION_DIR,
+                                 settings.IQRA_TRANSLATION_URL,
+                                 settings.IQRA_TRANSLATION_CACHE_BYTES)
+        ayahIds = {
+            (surahNum, ayahNum): ayahId for surahNum, ayahNum, ayahId in
+            Ayah.objects.values_list('chapter_id__number', 'verse_number', 'id')
+        }
+        for translation in options['translations']:
+            language = options['language'] or translation.split('-')[0].upper()
+            rows = []
+            missing = 0
+            for surahNum, surah in enumerate(store.download(translation), 1):
+                for ayahNum, text in enumerate(surah, 1):
+                    ayahId = ayahIds.get((surahNum, ayahNum))
+                    if ayahId is None:
+                        missing += 1
+                        continue
+                    rows.append(Translation(ayah_id=ayahId, resource_name=translation,
+                                            language_name=language, text=text))
+
+            with transaction.atomic():
+                Translation.objects.filter(resource_name=translation).delete()
+                Translation.objects.bulk_create(rows, batch_size=options['batch_size'])
+            # Invalidates the HTTP caches of the quran endpoints and the loaded corpora.
+            stamp_version()
+            self.stdout.write('{}: imported {} ayahs ({} not in the database)'.format(
+                    translation, len(rows), missing))
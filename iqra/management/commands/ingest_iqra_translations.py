@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from iqra.translations import TranslationStore
+
+
+class Command(BaseCommand):
+    help = 'Downloads Iqra translations and packs them into the local translation store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('translations', nargs='+',
+                            help='Translation names, e.g. en-hilali')
+
+    def handle(self, *args, **options):
+        store = TranslationStore(settings.IQRA_TRANSLATION_DIR,
+                                 settings.IQRA_TRANSLATION_URL,
+                                 settings.IQRA_TRANSLATION_CACHE_BYTES)
+        for translation in options['translations']:
+            path = store.ingest(translation)
+            self.stdout.write('{}: {} ({} bytes)'.format(
+                    translation, path, os.path.getsize(path)))
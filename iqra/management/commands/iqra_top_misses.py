@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count
+from django.utils import timezone
+from iqra.models import SearchQueryLog
+
+
+class Command(BaseCommand):
+    help = ('Summarizes the Iqra searches that found nothing, most frequent first, from '
+            'the search query log (IQRA_QUERY_LOG).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7,
+                            help='Only look at the searches of the last days.')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Number of queries to list.')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        searches = SearchQueryLog.objects.filter(timestamp__gte=since)
+        total = searches.count()
+        misses = searches.filter(result_count=0)
+        missCount = misses.count()
+        self.stdout.write(
+            '{} searches since {:%Y-%m-%d %H:%M}, {} misses ({:.1f}%)'.format(
+                total, since, missCount, 100.0 * missCount / total if total else 0.0))
+
+        topMisses = (misses.values('query')
+                     .annotate(count=Count('id'), latency=Avg('latency_ms'))
+                     .order_by('-count', 'query')[:options['limit']])
+        for miss in topMisses:
+            self.stdout.write('{:>7} {:>9.2f}ms  {}'.format(
+                    miss['count'], miss['latency'], miss['query']))
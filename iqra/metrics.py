@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Timing instrumentation for the Iqra engine.
+
+Every search and translation lookup collects the time spent in each of its steps in a
+:class:`Timings`. The steps can be returned with the response for debugging, and are
+aggregated into per-step latency histograms rendered in the Prometheus text format, so
+they can be scraped from ``iqra/metrics/``.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0)
+
+
+class Timings(object):
+    """The time spent in each step of one call, in the order the steps started.
+    Steps measured several times add up.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.steps = OrderedDict()
+        self._clock = clock
+
+    def add(self, step, seconds):
+        self.steps[step] = self.steps.get(step, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, step):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.add(step, self._clock() - start)
+
+    def asDict(self):
+        """Returns the time of every step in milliseconds.
+
+        :rtype: dict
+        """
+        return OrderedDict((step, round(seconds * 1000, 3))
+                           for step, seconds in self.steps.items())
+
+
+class _Histogram(object):
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                    for name, value in labels)
+
+
+def formatMetric(name, value, labels=()):
+    """Formats one sample in the Prometheus text format.
+
+    :param labels: (label name, value) pairs
+    :type labels: iterable
+    :rtype: str
+    """
+    labels = _labels(labels)
+    return '{}{} {}'.format(name, '{' + labels + '}' if labels else '', value)
+
+
+class LatencyHistograms(object):
+    """Thread-safe latency histograms per operation and step."""
+
+    NAME = 'iqra_step_duration_seconds'
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, operation, timings):
+        """Adds the steps of one call to the histograms.
+
+        :param operation: The kind of call, e.g. 'search'
+        :type operation: str
+        :type timings: Timings
+        """
+        with self._lock:
+            for step, seconds in timings.steps.items():
+                histogram = self._histograms.get((operation, step))
+                if histogram is None:
+                    histogram = self._histograms[(operation, step)] = _Histogram()
+                histogram.counts[bisect_left(BUCKETS, seconds)] += 1
+                histogram.count += 1
+                histogram.sum += seconds
+
+    def snapshot(self):
+        """Returns the cumulative bucket counts, count and sum of every histogram.
+
+        :return: Histograms by (operation, step)
+        :rtype: dict
+        """
+        snapshot = {}
+        with self._lock:
+            for key, histogram in self._histograms.items():
+                cumulative = []
+                total = 0
+                for count in histogram.counts:
+                    total += count
+                    cumulative.append(total)
+                snapshot[key] = {
+                    'buckets': cumulative,
+                    'count'  : histogram.count,
+                    'sum'    : histogram.sum,
+                }
+        return snapshot
+
+    def render(self):
+        """Renders the histograms in the Prometheus text format.
+
+        :rtype: list(str)
+        """
+        lines = [
+            '# HELP {} Time spent in each step of the Iqra engine.'.format(self.NAME),
+            '# TYPE {} histogram'.format(self.NAME),
+        ]
+        for (operation, step), histogram in sorted(self.snapshot().items()):
+            labels = [('operation', operation), ('step', step)]
+            bounds = [repr(bound) for bound in BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, histogram['buckets']):
+                lines.append(formatMetric(self.NAME + '_bucket', count,
+                                          labels + [('le', bound)]))
+            lines.append(formatMetric(self.NAME + '_count', histogram['count'], labels))
+            lines.append(formatMetric(self.NAME + '_sum', histogram['sum'], labels))
+        return lines
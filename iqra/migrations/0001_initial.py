@@ -0,0 +1,31 @@
+# Generated by Django 2.2.1 on 2026-10-18 07:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=512)),
+                ('result_count', models.IntegerField()),
+                ('stage', models.CharField(blank=True, max_length=32)),
+                ('latency_ms', models.FloatField()),
+                ('cached', models.BooleanField(default=False)),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchquerylog',
+            index=models.Index(fields=['result_count', 'timestamp'], name='iqra_search_result__878f8c_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import models
+from django.utils import timezone
+
+
+class SearchQueryLog(models.Model):
+    """One Iqra search, written in batches by iqra.querylog.QueryLog."""
+    query = models.CharField(max_length=512)
+    result_count = models.IntegerField()
+    # The search stage that matched, 'special_case', or empty for a miss.
+    stage = models.CharField(max_length=32, blank=True)
+    latency_ms = models.FloatField()
+    cached = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Summaries of the misses over a time range.
+            models.Index(fields=['result_count', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return "{} ({} results)".format(self.query, self.result_count)
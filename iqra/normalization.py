@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Arabic text normalization shared by indexing and querying.
+
+Recitations, keyboards and the Uthmani text spell the same words differently: with or
+without tashkeel and Quranic marks, with any of the hamza forms of alef, with hamza
+on a waw or ya seat or on the line, with ta marbuta or ha, with alef maqsura or ya, and
+stretched by tatweel. Normalizing folds
+all of them into one spelling, using a single precompiled ``str.translate`` table so
+normalizing a query is one pass in C.
+
+Indexes built by ``build_iqra_index`` tokenize with :class:`ArabicTokenizer`, which
+applies the same table, so the index and the queries are normalized identically.
+"""
+from whoosh.analysis import LowercaseFilter, RegexTokenizer
+
+TATWEEL = u'ـ'
+
+# Harakat, tanween, shadda, sukun, dagger alef and the small Quranic annotation marks.
+TASHKEEL = u''.join(
+    chr(codepoint) for codepoint in (
+        list(range(0x0610, 0x061B)) + list(range(0x064B, 0x0660)) + [0x0670] +
+        list(range(0x06D6, 0x06DD)) + list(range(0x06DF, 0x06E9)) +
+        list(range(0x06EA, 0x06EE))
+    )
+)
+
+# Alef with madda, hamza above, hamza below and wasla, and the rarer wavy hamzas.
+ALEF_VARIANTS = u'آأإٱٲٳ'
+ALEF = u'ا'
+# Hamza on waw and on ya, which spellings confuse with the hamza on the line.
+HAMZA_SEATS = u'ؤئ'
+HAMZA = u'ء'
+TA_MARBUTA = u'ة'
+HA = u'ه'
+ALEF_MAQSURA = u'ى'
+YA = u'ي'
+
+NORMALIZATION_TABLE = str.maketrans(
+    dict(
+        [(character, None) for character in TASHKEEL + TATWEEL] +
+        [(character, ALEF) for character in ALEF_VARIANTS] +
+        [(character, HAMZA) for character in HAMZA_SEATS] +
+        [(TA_MARBUTA, HA), (ALEF_MAQSURA, YA)]
+    )
+)
+
+
+def normalize(text):
+    """Returns the normalized form of a piece of Arabic text, with its whitespace
+    collapsed to single spaces.
+
+    :param text: The text to normalize
+    :type text: str
+    :rtype: str
+    """
+    return ' '.join(text.translate(NORMALIZATION_TABLE).split())
+
+
+class ArabicTokenizer(RegexTokenizer):
+    """Tokenizer that normalizes the text before splitting it into words. Tashkeel are
+    not word characters, so normalizing after tokenizing would split words at every
+    haraka. Character offsets refer to the normalized text.
+    """
+
+    def __call__(self, value, **kwargs):
+        return super(ArabicTokenizer, self).__call__(
+                value.translate(NORMALIZATION_TABLE), **kwargs)
+
+
+def ArabicAnalyzer():
+    """Returns the analyzer of the Iqra text fields: words with the Arabic
+    normalization applied. Unlike whoosh's standard analyzer it has no stop words and
+    keeps single letters, like the muqatta'at ayahs and the clitics.
+
+    :rtype: whoosh.analysis.CompositeAnalyzer
+    """
+    return ArabicTokenizer() | LowercaseFilter()
+
+
+def ArabicKeywordAnalyzer():
+    """Returns the analyzer of the roots and decomposed_ayah keyword fields: their
+    whitespace separated terms, with the Arabic normalization applied.
+
+    :rtype: whoosh.analysis.RegexTokenizer
+    """
+    return ArabicTokenizer(r'[^ \t\r\n]+')
+
+
+def isNormalized(schema, fieldName='simple_ayah'):
+    """True if a field of an index schema was analyzed with the Arabic normalization.
+    Indexes built before it was introduced keep their texts as they were.
+
+    :type schema: whoosh.fields.Schema
+    :rtype: bool
+    """
+    if fieldName not in schema:
+        return False
+    analyzer = schema[fieldName].analyzer
+    return any(isinstance(item, ArabicTokenizer)
+               for item in getattr(analyzer, 'items', [analyzer]))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Phonetic matching of speech transcripts.
+
+Speech recognizers confuse letters that sound alike, like ص and س or ط and ت, and drop
+or add alefs, hamzas and doubled letters. Every word is reduced to a phonetic skeleton
+that such confusions do not change: its normalized letters are mapped to one letter
+per group of confusable sounds, alefs, ains and hamzas are dropped and doubled letters
+are collapsed. Waw and ya are kept, so a dropped or added long u or i still changes the
+skeleton. The skeleton of every word of the Quran is indexed by the ayahs containing
+it, so a transcript whose words have the same skeletons as an ayah's is matched with
+a few set intersections instead of going through the OR fallback stages.
+"""
+from .backends.base import Hit, SearchResults
+from .normalization import normalize
+
+# One letter per group of letters a recognizer confuses.
+PHONETIC_GROUPS = (
+    (u'ص', u'س'),
+    (u'ث', u'س'),
+    (u'ذ', u'ز'),
+    (u'ظ', u'ز'),
+    (u'ط', u'ت'),
+    (u'ض', u'د'),
+    (u'ح', u'ه'),
+    (u'ق', u'ك'),
+)
+# Letters dropped from the skeleton. str.translate makes a single pass, so ain, which
+# recognizers confuse with alef, is dropped directly rather than mapped to alef.
+SILENT_LETTERS = u'اعءؤئ'
+PHONETIC_TABLE = dict((ord(letter), key) for letter, key in PHONETIC_GROUPS)
+PHONETIC_TABLE.update((ord(letter), None) for letter in SILENT_LETTERS)
+
+
+def phoneticKey(word):
+    """Returns the phonetic skeleton of a word.
+
+    :param word: The word, normalized or not
+    :type word: str
+    :rtype: str
+    """
+    letters = normalize(word).translate(PHONETIC_TABLE)
+    return ''.join(letter for position, letter in enumerate(letters)
+                   if position == 0 or letter != letters[position - 1])
+
+
+class PhoneticIndex(object):
+    """The ayahs containing every phonetic skeleton of the Quran.
+
+    :param ayahs: The normalized text of every ayah by (surah number, ayah number)
+    :type ayahs: dict
+    :param documents: The stored fields of every ayah by (surah number, ayah number)
+    :type documents: dict
+    """
+
+    def __init__(self, ayahs, documents):
+        self.ayahs = sorted(ayahs)
+        self._documents = [documents[ayah] for ayah in self.ayahs]
+        self._words = []
+        self._postings = {}
+        for ayahId, ayah in enumerate(self.ayahs):
+            words = ayahs[ayah].split()
+            self._words.append(words)
+            for word in words:
+                key = phoneticKey(word)
+                if key:
+                    self._postings.setdefault(key, set()).add(ayahId)
+
+    def search(self, stage, value, limit=None, terms=False):
+        """Finds the ayahs containing a word with the skeleton of every query word. It
+        takes the same arguments as :meth:`iqra.backends.base.SearchBackend.search`, so
+        it can stand in for the backend in the search pipeline. Shorter ayahs score
+        higher, and the matched terms are the words of the best ayah the query words
+        were taken for.
+
+        :rtype: iqra.backends.base.SearchResults
+        """
+        keys = []
+        for word in value.split():
+            key = phoneticKey(word)
+            if key and key not in keys:
+                keys.append(key)
+        if not keys:
+            return SearchResults([], 0, [])
+        postingsList = sorted((self._postings.get(key, frozenset()) for key in keys),
+                              key=len)
+        ayahIds = set(postingsList[0])
+        for postings in postingsList[1:]:
+            ayahIds &= postings
+        if not ayahIds:
+            return SearchResults([], 0, [])
+
+        scored = sorted((-len(keys) / len(self._words[ayahId]), ayahId)
+                        for ayahId in ayahIds)
+        bestWords = {phoneticKey(word): word for word in self._words[scored[0][1]]}
+        if limit is not None:
+            scored = scored[:limit]
+        hits = [Hit(-negativeScore, self._documents[ayahId])
+                for negativeScore, ayahId in scored]
+        return SearchResults(hits, len(ayahIds), [bestWords[key] for key in keys])
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative description of the Iqra search cascade.
+
+A query runs through the stages in order and the first stage with results wins. The
+stages only describe the searches; each backend compiles them into its own queries
+once and shares them between threads.
+"""
+import threading
+import time
+
+SINGLE_WORD = 'single'
+MULTI_WORD = 'multi'
+
+AND = 'and'
+OR = 'or'
+
+
+class SearchStage(object):
+    """A single search in the cascade.
+
+    :param name: Name used in the stage statistics
+    :type name: str
+    :param fields: The fields searched by the stage
+    :type fields: list
+    :param group: How the query terms are combined, AND or OR
+    :type group: str
+    :param appliesTo: SINGLE_WORD or MULTI_WORD queries
+    :type appliesTo: str
+    :param fallback: True if a match is only partial, so the results need refining
+        and can produce suggestions
+    :type fallback: bool
+    :param corrected: True to search the query with its misspelled words corrected.
+        The stage is skipped when there is nothing to correct.
+    :type corrected: bool
+    :param phonetic: True to match the phonetic skeletons of the query words instead of
+        searching the backend. The stage is skipped without a phonetic index.
+    :type phonetic: bool
+    """
+
+    def __init__(self, name, fields, group=AND, appliesTo=MULTI_WORD, fallback=False,
+                 corrected=False, phonetic=False):
+        self.name = name
+        self.fields = fields
+        self.group = group
+        self.appliesTo = appliesTo
+        self.fallback = fallback
+        self.corrected = corrected
+        self.phonetic = phonetic
+
+
+SEARCH_STAGES = (
+    SearchStage('fields', ["simple_ayah", "roots", "decomposed_ayah"],
+                appliesTo=SINGLE_WORD),
+    SearchStage('fields_phonetic', ["simple_ayah"], appliesTo=SINGLE_WORD,
+                phonetic=True),
+    SearchStage('fields_corrected', ["simple_ayah", "roots", "decomposed_ayah"],
+                appliesTo=SINGLE_WORD, corrected=True),
+    SearchStage('simple_ayah', ["simple_ayah"]),
+    SearchStage('simple_ayah_phonetic', ["simple_ayah"], phonetic=True),
+    SearchStage('simple_ayah_corrected', ["simple_ayah"], corrected=True),
+    SearchStage('simple_ayah_or', ["simple_ayah"], group=OR, fallback=True),
+    SearchStage('roots_or', ["roots"], group=OR, fallback=True),
+    SearchStage('decomposed_ayah_or', ["decomposed_ayah"], group=OR, fallback=True),
+)
+
+# Looks up the ayahs with the exact text of the best partial match.
+REFINE_STAGE = SEARCH_STAGES[3]
+
+
+class StageStats(object):
+    """Thread-safe call, hit and latency counters for the search stages."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, hit, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "hits": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["hits"] += int(hit)
+            stats["seconds"] += seconds
+
+    def snapshot(self):
+        """Returns the counters per stage with the hit rate and mean latency.
+
+        :rtype: dict
+        """
+        with self._lock:
+            snapshot = {}
+            for name, stats in self._stats.items():
+                snapshot[name] = dict(
+                    stats,
+                    hitRate=stats["hits"] / stats["calls"],
+                    meanMs=stats["seconds"] * 1000 / stats["calls"],
+                )
+            return snapshot
+
+
+class SearchPipeline(object):
+    """Runs queries through the stages of the cascade on a search backend.
+
+    :param stages: The stages, in priority order
+    :type stages: tuple(SearchStage)
+    :param stats: The counters to record the stages in
+    :type stats: StageStats, None
+    :param executor: Thread pool to run consecutive fallback stages on at the same
+        time, or None to run every stage in turn. The backend must be safe to search
+        from several threads.
+    :type executor: concurrent.futures.Executor, None
+    """
+
+    def __init__(self, stages=SEARCH_STAGES, stats=None, executor=None):
+        self.stages = stages
+        self.stats = stats if stats is not None else StageStats()
+        self.executor = executor
+
+    def _record(self, stage, results, seconds, timings):
+        self.stats.record(stage.name, bool(results), seconds)
+        if timings is not None:
+            timings.add('stage.' + stage.name, seconds)
+
+    def _searchStage(self, backend, stage, value, limit):
+        start = time.perf_counter()
+        results = backend.search(stage, value, limit, terms=stage.fallback)
+        return results, time.perf_counter() - start
+
+    def _runConcurrently(self, backend, stages, value, limit, timings):
+        """Starts the searches of several stages at once and returns the results of the
+        first one in priority order that has any. Searches that have not started by
+        then are cancelled.
+
+        :return: The winning stage and its results, or (None, None)
+        :rtype: tuple(SearchStage, iqra.backends.base.SearchResults)
+        """
+        futures = [self.executor.submit(self._searchStage, backend, stage, value, limit)
+                   for stage in stages]
+        try:
+            for stage, future in zip(stages, futures):
+                results, seconds = future.result()
+                self._record(stage, results, seconds, timings)
+                if results:
+                    return stage, results
+        finally:
+            for future in futures:
+                future.cancel()
+        return None, None
+
+    def run(self, backend, value, limit=None, corrector=None, timings=None,
+            phonetic=None):
+        """Runs a query through the stages that apply to it, stopping at the first
+        stage with results. The results of a corrected stage have the corrected words
+        as their matched terms, and those of a phonetic stage the words they matched.
+
+        :param backend: The backend to search
+        :type backend: iqra.backends.base.SearchBackend
+        :param value: The query text
+        :type value: str
+        :param limit: Maximum number of top scoring hits to collect, None for all. The
+            fallback stages always collect every hit, since their results are refined
+            from the best hit and their suggestions can come from any of them.
+        :type limit: int, None
+        :param corrector: Returns the query text with its misspelled words corrected,
+            or None to skip the corrected stages
+        :type corrector: callable, None
+        :param timings: Collects the time spent correcting the query and in each stage
+        :type timings: iqra.metrics.Timings, None
+        :param phonetic: The index searched by the phonetic stages, or None to skip them
+        :type phonetic: iqra.phonetic.PhoneticIndex, None
+        :return: The winning stage and its results, or (None, None)
+        :rtype: tuple(SearchStage, iqra.backends.base.SearchResults)
+        """
+        appliesTo = SINGLE_WORD if len(value.split()) == 1 else MULTI_WORD
+        stages = [stage for stage in self.stages if stage.appliesTo == appliesTo]
+        correctedValue = None
+        index = 0
+        while index < len(stages):
+            stage = stages[index]
+            index += 1
+            if stage.fallback and self.executor is not None:
+                fallbacks = [stage]
+                while index < len(stages) and stages[index].fallback:
+                    fallbacks.append(stages[index])
+                    index += 1
+                if len(fallbacks) > 1:
+                    stage, results = self._runConcurrently(backend, fallbacks, value,
+                                                           None, timings)
+                    if results:
+                        return stage, results
+                    continue
+            start = time.perf_counter()
+            if stage.corrected:
+                if corrector is None:
+                    continue
+                if correctedValue is None:
+                    correctedValue = corrector(value)
+                    if timings is not None:
+                        timings.add('correction', time.perf_counter() - start)
+                    start = time.perf_counter()
+                if correctedValue == value:
+                    continue
+                results = backend.search(stage, correctedValue, limit)
+                results.matchedTerms = correctedValue.split()
+            elif stage.phonetic:
+                if phonetic is None:
+                    continue
+                results = phonetic.search(stage, value, limit)
+            else:
+                results = backend.search(stage, value, None if stage.fallback else limit,
+                                         terms=stage.fallback)
+            self._record(stage, results, time.perf_counter() - start, timings)
+            if results:
+                return stage, results
+        return None, None
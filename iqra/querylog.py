@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind log of the Iqra searches.
+
+Writing a row per search would put a database round trip on every request, so
+searches only put their entry on a bounded in-memory queue. A background thread is
+woken up as soon as a batch is full, or when the flush interval has passed, and writes
+the queued entries with one bulk insert per batch. When the database falls behind and
+the queue is full, new entries are dropped and counted instead of blocking searches.
+The entries still queued when the worker exits are written by an atexit handler.
+"""
+import atexit
+import queue
+import threading
+from django.db import close_old_connections
+from django.utils import timezone
+
+# Longest query stored, in characters.
+MAX_QUERY_LENGTH = 512
+
+
+def _writeEntries(entries):
+    from .models import SearchQueryLog
+
+    SearchQueryLog.objects.bulk_create([SearchQueryLog(**entry) for entry in entries])
+
+
+class QueryLog(object):
+    """Buffers search log entries and writes them in batches on a background thread.
+
+    :param batchSize: Number of entries written per insert
+    :type batchSize: int
+    :param maxQueued: Number of entries waiting to be written beyond which new ones are
+        dropped
+    :type maxQueued: int
+    :param flushInterval: Maximum number of seconds an entry waits for its batch to fill
+    :type flushInterval: float
+    :param write: Writes a list of entries, by default into the SearchQueryLog table
+    :type write: callable
+    """
+
+    def __init__(self, batchSize=500, maxQueued=10000, flushInterval=5.0,
+                 write=_writeEntries):
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self._write = write
+        self._queue = queue.Queue(maxQueued)
+        self._wake = threading.Event()
+        self._thread = None
+        self._threadLock = threading.Lock()
+        self._statsLock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def record(self, query, resultCount, stage, seconds, cached=False):
+        """Queues the log entry of one search. Never blocks.
+
+        :param query: The normalized query text
+        :type query: str
+        :param resultCount: The number of matching ayahs
+        :type resultCount: int
+        :param stage: The name of the stage that matched, or None for a miss
+        :type stage: str, None
+        :param seconds: The time the search took
+        :type seconds: float
+        :param cached: True if the result came from the result cache
+        :type cached: bool
+        """
+        entry = {
+            'query'       : query[:MAX_QUERY_LENGTH],
+            'result_count': resultCount,
+            'stage'       : stage or '',
+            'latency_ms'  : seconds * 1000,
+            'cached'      : cached,
+            'timestamp'   : timezone.now(),
+        }
+        self._startThread()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._statsLock:
+                self.dropped += 1
+            return
+        with self._statsLock:
+            self.recorded += 1
+        if self._queue.qsize() >= self.batchSize:
+            self._wake.set()
+
+    def _startThread(self):
+        if self._thread is None:
+            with self._threadLock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True,
+                                                    name='iqra-query-log')
+                    self._thread.start()
+                    # The daemon thread is stopped abruptly at exit.
+                    atexit.register(self.flush)
+
+    def _takeBatch(self):
+        """Takes up to a batch of entries off the queue.
+
+        :rtype: list
+        """
+        batch = []
+        while len(batch) < self.batchSize:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _writeBatch(self, batch):
+        try:
+            self._write(batch)
+        except Exception:
+            # The entries are lost, but the logging thread must survive a database
+            # outage.
+            with self._statsLock:
+                self.failed += len(batch)
+        else:
+            with self._statsLock:
+                self.written += len(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flushInterval)
+            self._wake.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """Writes every queued entry from the calling thread, e.g. before shutdown."""
+        batch = self._takeBatch()
+        while batch:
+            self._writeBatch(batch)
+            batch = self._takeBatch()
+
+    def stats(self):
+        """Returns the number of entries recorded, dropped, written and failed, and the
+        number still queued.
+
+        :rtype: dict
+        """
+        with self._statsLock:
+            return {
+                'recorded': self.recorded,
+                'dropped' : self.dropped,
+                'written' : self.written,
+                'failed'  : self.failed,
+                'queued'  : self._queue.qsize(),
+            }
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Offline similarity graph of the ayahs.
+
+Many ayahs are repeated with small differences (the mutashabihat), which is what
+makes a partial match ambiguous. Every ayah is reduced to the set of its word
+bigrams, and the pairs of ayahs sharing many of them are found with MinHash and
+locality-sensitive hashing: the signatures are cut into bands, and only ayahs with an
+identical band become candidates, whose exact Jaccard similarity is then computed. The
+most similar ayahs of each one are written next to the index, so suggestions for a
+match are a dictionary lookup.
+"""
+from itertools import combinations
+import json
+import os
+import random
+import zlib
+
+SIMILARITY_FILENAME = 'similar_ayahs.json'
+
+# A Mersenne prime larger than any 32-bit shingle hash.
+_PRIME = (1 << 61) - 1
+
+
+def shingles(text, n=2):
+    """Returns the word n-grams of a normalized text. Texts shorter than n words are
+    a single shingle.
+
+    :rtype: set
+    """
+    words = text.split()
+    if len(words) <= n:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[start:start + n]) for start in range(len(words) - n + 1)}
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+class MinHasher(object):
+    """Computes MinHash signatures with a fixed family of random hash functions.
+
+    :param numHashes: Length of the signatures
+    :type numHashes: int
+    :param seed: Seed of the hash functions, so signatures are reproducible
+    :type seed: int
+    """
+
+    def __init__(self, numHashes=64, seed=0):
+        rng = random.Random(seed)
+        self._functions = [(rng.randrange(1, _PRIME), rng.randrange(_PRIME))
+                           for _ in range(numHashes)]
+
+    def signature(self, shingleSet):
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingleSet]
+        return [min((a * value + b) % _PRIME for value in hashes)
+                for a, b in self._functions]
+
+
+def similarAyahs(ayahs, neighbours=5, threshold=0.4, numHashes=64, bands=32,
+                 maxBucket=500):
+    """Finds the most similar ayahs of every ayah.
+
+    :param ayahs: The normalized text of every ayah by (surah number, ayah number)
+    :type ayahs: dict
+    :param neighbours: Maximum number of similar ayahs kept per ayah
+    :type neighbours: int
+    :param threshold: Minimum Jaccard similarity of the word bigrams of two ayahs
+    :type threshold: float
+    :param numHashes: Length of the MinHash signatures
+    :type numHashes: int
+    :param bands: Number of bands the signatures are cut into. More bands find pairs
+        with a lower similarity, at the cost of more candidates.
+    :type bands: int
+    :param maxBucket: Buckets with more ayahs than this, which come from formulas
+        repeated all over the Quran, do not produce candidates
+    :type maxBucket: int
+    :return: The similar ayahs of every ayah with any, most similar first, as
+        (surah number, ayah number, similarity) tuples
+    :rtype: dict
+    """
+    keys = sorted(ayahs)
+    shingleSets = [shingles(ayahs[ayah]) for ayah in keys]
+    hasher = MinHasher(numHashes)
+    rows = numHashes // bands
+    buckets = {}
+    for ayahId, shingleSet in enumerate(shingleSets):
+        if not shingleSet:
+            continue
+        signature = hasher.signature(shingleSet)
+        for band in range(bands):
+            bucket = (band,) + tuple(signature[band * rows:(band + 1) * rows])
+            buckets.setdefault(bucket, []).append(ayahId)
+
+    candidates = set()
+    for ayahIds in buckets.values():
+        if 1 < len(ayahIds) <= maxBucket:
+            candidates.update(combinations(ayahIds, 2))
+
+    similar = {}
+    for first, second in candidates:
+        similarity = jaccard(shingleSets[first], shingleSets[second])
+        if similarity >= threshold:
+            similar.setdefault(first, []).append((similarity, second))
+            similar.setdefault(second, []).append((similarity, first))
+    return {
+        keys[ayahId]: [keys[other] + (round(similarity, 4),) for similarity, other in
+                       sorted(pairs, key=lambda pair: (-pair[0], pair[1]))[:neighbours]]
+        for ayahId, pairs in similar.items()
+    }
+
+
+def writeNeighbours(path, similar):
+    """Writes the similar ayahs of every ayah to a JSON file, replacing it atomically.
+
+    :param similar: The result of :func:`similarAyahs`
+    :type similar: dict
+    """
+    data = {
+        '{}:{}'.format(*ayah): [list(neighbour) for neighbour in neighbours]
+        for ayah, neighbours in similar.items()
+    }
+    partialPath = path + '.partial'
+    with open(partialPath, 'w', encoding='utf-8') as neighboursFile:
+        json.dump(data, neighboursFile, sort_keys=True)
+    os.replace(partialPath, path)
+
+
+def loadNeighbours(path):
+    """Loads the similar ayahs written by :func:`writeNeighbours`.
+
+    :return: The (surah number, ayah number) of the similar ayahs of every ayah, most
+        similar first, or None if the file does not exist
+    :rtype: dict, None
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as neighboursFile:
+        data = json.load(neighboursFile)
+    neighbours = {}
+    for key, similar in data.items():
+        surahNum, ayahNum = key.split(':')
+        neighbours[(int(surahNum), int(ayahNum))] = [
+            (neighbour[0], neighbour[1]) for neighbour in similar]
+    return neighbours
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Typo-tolerant term correction for Iqra queries.
+
+ASR transcripts often get a letter or two of a word wrong, which makes the AND search
+miss the ayah. The corrector rewrites query words that are not in the index vocabulary
+to the closest word that is, using a symmetric-delete dictionary: every vocabulary word
+is stored under all the strings obtained by deleting up to ``maxDistance`` of its
+letters, so the candidates for a query word are found by looking up its own deletes
+instead of comparing it with the whole vocabulary. Candidates are then checked with a
+bounded edit distance.
+"""
+from itertools import combinations
+import time
+
+
+def editDistance(first, second, maxDistance):
+    """Returns the edit distance between two words, counting an adjacent transposition
+    as one edit, or maxDistance + 1 as soon as it is known to be larger than
+    maxDistance.
+
+    :rtype: int
+    """
+    if abs(len(first) - len(second)) > maxDistance:
+        return maxDistance + 1
+    beforePrevious = None
+    previous = list(range(len(second) + 1))
+    for i, firstChar in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        rowMinimum = i
+        for j, secondChar in enumerate(second, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1,
+                           previous[j - 1] + (firstChar != secondChar))
+            if (i > 1 and j > 1 and firstChar == second[j - 2] and
+                    first[i - 2] == secondChar):
+                distance = min(distance, beforePrevious[j - 2] + 1)
+            current[j] = distance
+            rowMinimum = min(rowMinimum, distance)
+        if rowMinimum > maxDistance:
+            return maxDistance + 1
+        beforePrevious, previous = previous, current
+    return min(previous[-1], maxDistance + 1)
+
+
+def _deletes(word, maxDistance):
+    """Returns the word and every string made by deleting up to maxDistance letters."""
+    deletes = {word}
+    for distance in range(1, min(maxDistance, len(word)) + 1):
+        for positions in combinations(range(len(word)), len(word) - distance):
+            deletes.add(''.join(word[position] for position in positions))
+    return deletes
+
+
+class SpellingCorrector(object):
+    """Corrects query words against a vocabulary.
+
+    :param vocabulary: The number of ayahs containing each word, used to prefer common
+        words between candidates at the same distance
+    :type vocabulary: dict
+    :param maxDistance: Maximum number of edits between a word and its correction
+    :type maxDistance: int
+    :param budget: Seconds a query may spend on corrections. Words left when it runs
+        out are kept as they are. None for no limit.
+    :type budget: float, None
+    :param minLength: Words shorter than this are never corrected, since nearly every
+        short word is one edit away from another
+    :type minLength: int
+    """
+
+    def __init__(self, vocabulary, maxDistance=1, budget=None, minLength=3,
+                 clock=time.perf_counter):
+        self.vocabulary = vocabulary
+        self.maxDistance = maxDistance
+        self.budget = budget
+        self.minLength = minLength
+        self._clock = clock
+        self._deletes = {}
+        for word in vocabulary:
+            for delete in _deletes(word, maxDistance):
+                self._deletes.setdefault(delete, []).append(word)
+
+    def suggest(self, word):
+        """Returns the closest vocabulary word, the word itself if it is in the
+        vocabulary, or None if nothing is within the maximum distance.
+
+        :rtype: str, None
+        """
+        if word in self.vocabulary:
+            return word
+        best = None
+        bestKey = None
+        seen = set()
+        for delete in _deletes(word, self.maxDistance):
+            for candidate in self._deletes.get(delete, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = editDistance(word, candidate, self.maxDistance)
+                if distance > self.maxDistance:
+                    continue
+                key = (distance, -self.vocabulary[candidate], candidate)
+                if bestKey is None or key < bestKey:
+                    best, bestKey = candidate, key
+        return best
+
+    def correct(self, value):
+        """Corrects the words of a query that are not in the vocabulary.
+
+        :param value: The query text
+        :type value: str
+        :return: The corrected query text
+        :rtype: str
+        """
+        deadline = None if self.budget is None else self._clock() + self.budget
+        words = value.split()
+        for index, word in enumerate(words):
+            if deadline is not None and self._clock() > deadline:
+                break
+            if len(word) < self.minLength:
+                continue
+            words[index] = self.suggest(word) or word
+        return ' '.join(words)
@@ -1,6 +1,32 @@
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
+from whoosh.fields import Schema, KEYWORD, NUMERIC, TEXT
+from whoosh.index import create_in, open_dir
+from . import indexing
+from .backends import loadBackend
+from .cache import ResultCache
+from .Iqra import getIqra, Iqra, Page
+from .normalization import ArabicAnalyzer, ArabicKeywordAnalyzer, normalize
+from .models import SearchQueryLog
+from .phonetic import PhoneticIndex, phoneticKey
+from .querylog import QueryLog
+from .similarity import similarAyahs
+from .spelling import SpellingCorrector
+from .translations import (
+    DatabaseTranslations, PackedTranslation, TranslationStore, writePackedTranslation
+)
+from quran.models import Ayah, QuranVersion, Surah, Translation
 
 search_json_request = {
     'arabicText': u'لقد خلقنا الانسان في كبد ',
@@ -52,3 +78,445 @@ class IqraTestCase(APITestCase):
         self.assertJSONEqual(str(response.content, encoding='utf8'),
                              translation_json_response)
 
+    def test_translation_debug(self):
+        url = reverse('iqra-translation')
+        response = self.client.post(url, dict(translation_json_request, debug='false'),
+                                    format='json')
+        self.assertJSONEqual(str(response.content, encoding='utf8'),
+                             translation_json_response)
+        response = self.client.post(url, dict(translation_json_request, debug=True),
+                                    format='json')
+        self.assertIn('translation', response.json()['timings'])
+        response = self.client.post(url, dict(translation_json_request, debug='maybe'),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_engine_is_shared(self):
+        self.assertIs(getIqra(), getIqra())
+
+    def test_repeated_search_is_cached(self):
+        url = reverse('iqra-search')
+        self.client.post(url, search_json_request, format='json')
+        hits = getIqra().resultCache.stats()['hits']
+        response = self.client.post(url, search_json_request, format='json')
+        self.assertEqual(getIqra().resultCache.stats()['hits'], hits + 1)
+        self.assertJSONEqual(str(response.content, encoding='utf8'),
+                             search_json_response)
+
+    def test_paginated_search(self):
+        url = reverse('iqra-search')
+        request = dict(search_json_request, limit=1, offset=0, ranked=True)
+        response = self.client.post(url, request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()['result']
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(result['matches'], search_json_response['result']['matches'])
+
+    def test_search_invalid_page(self):
+        url = reverse('iqra-search')
+        for params in ({'limit': -1}, {'limit': 0, 'ranked': True}, {'offset': -1}):
+            response = self.client.post(url, dict(search_json_request, **params),
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ranked_fallback_is_refined(self):
+        # The page size does not change which ayahs an OR fallback query matches.
+        url = reverse('iqra-search')
+        request = dict(search_json_request, arabicText=u'الرحمن مالك', limit=1)
+        ranked = self.client.post(url, dict(request, ranked=True), format='json').json()
+        unranked = self.client.post(url, request, format='json').json()
+        self.assertEqual(ranked['result']['total'], unranked['result']['total'])
+        self.assertEqual(ranked['result']['suggestions'],
+                         unranked['result']['suggestions'])
+
+    def test_search_boolean_params(self):
+        url = reverse('iqra-search')
+        response = self.client.post(url, dict(search_json_request, debug='false'),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('timings', response.json()['result'])
+        for params in ({'ranked': 'yes'}, {'debug': 1}):
+            response = self.client.post(url, dict(search_json_request, **params),
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('iqra-search-batch'),
+                                    {'queries': [u'الله'], 'parallel': 'no'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_search(self):
+        url = reverse('iqra-search-batch')
+        request = {
+            'queries': [search_json_request, search_json_request['arabicText']],
+            'parallel': True,
+        }
+        response = self.client.post(url, request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['result']
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertEqual(result['result'], search_json_response['result'])
+
+    def test_batch_search_malformed_query(self):
+        url = reverse('iqra-search-batch')
+        for query in ({'translation': 'en-hilali'}, {'arabicText': 3}, None):
+            response = self.client.post(url, {'queries': [search_json_request, query]},
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_misspelled_search(self):
+        url = reverse('iqra-search')
+        request = dict(search_json_request, arabicText=u'لقد خلقنا الانسن في كبد')
+        response = self.client.post(url, request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()['result']
+        self.assertEqual(result['matches'], search_json_response['result']['matches'])
+        self.assertIn(u'الانسان', result['matchedTerms'])
+
+    def test_phonetic_search(self):
+        iqra = Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0))
+        result = iqra.getResult(u'لكد خلكنا الانسان في قبد', 'en-hilali')
+        self.assertEqual(result['matches'], search_json_response['result']['matches'])
+        self.assertIn(u'كبد', result['matchedTerms'])
+        self.assertEqual(iqra.stageStats()['simple_ayah_phonetic']['hits'], 1)
+
+    def test_suggestions_from_similar_ayahs(self):
+        directory = os.path.join(tempfile.mkdtemp(), 'index')
+        self.addCleanup(shutil.rmtree, os.path.dirname(directory))
+        shutil.copytree(settings.IQRA_INDEX_DIR, directory)
+        indexing.writeSimilarity(directory)
+        iqra = Iqra(directory, resultCache=ResultCache(0))
+        result = iqra.getResult(u'لقد خلقنا الانسان في تقويم كبد', 'en-hilali')
+        self.assertEqual(result['matches'], search_json_response['result']['matches'])
+        self.assertEqual(result['suggestions'], [u'لقد خلقنا الانسان في أحسن تقويم'])
+
+    def test_autocomplete(self):
+        url = reverse('iqra-autocomplete')
+        response = self.client.get(url, {'q': u'لقد خلقنا الانس'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()['result']
+        self.assertEqual(result['continuations'][0]['text'], u'لقد خلقنا الانسان')
+        self.assertIn({
+            'surahNum': 90, 'ayahNum': 4, 'arabicSurahName': u'سورة الـبلد',
+            'arabicAyah': u'لَقَدْ خَلَقْنَا الْإِنْسَانَ فِي كَبَدٍ'
+        }, result['ayahs'])
+
+        response = self.client.get(url, {'q': u'لقد خلقنا الانسان '})
+        result = response.json()['result']
+        self.assertEqual(result['continuations'][0]['text'], u'لقد خلقنا الانسان في')
+
+    def test_locate(self):
+        url = reverse('iqra-locate')
+        request = {
+            'arabicText': u'الحمد لله رب العالمين الرحمن الرحيم مالك يوم الدين',
+            'translation': 'en-hilali',
+        }
+        response = self.client.post(url, request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()['result']
+        self.assertEqual((result['surahNum'], result['startAyah'], result['endAyah']),
+                         (1, 2, 4))
+        self.assertEqual([match['ayahNum'] for match in result['matches']], [2, 3, 4])
+
+    def test_search_debug_timings(self):
+        url = reverse('iqra-search')
+        request = dict(search_json_request, debug=True)
+        response = self.client.post(url, request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = response.json()['result']['timings']
+        self.assertIn('total', timings)
+        self.assertIn('cache', timings)
+
+        response = self.client.get(reverse('iqra-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('iqra_step_duration_seconds_count{operation="search",step="total"}',
+                      response.content.decode('utf-8'))
+
+    def test_concurrent_fallback(self):
+        query = u'الرحمن الرحيم مالك'
+        iqra = Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0),
+                    concurrentFallback=True)
+        self.assertEqual(iqra.getResult(query, 'en-hilali'),
+                         getIqra().getResult(query, 'en-hilali'))
+        self.assertIn('simple_ayah_or', iqra.stageStats())
+
+    def test_engines_share_thread_pools(self):
+        engines = [Iqra(settings.IQRA_INDEX_DIR, concurrentFallback=True)
+                   for _ in range(2)]
+        self.assertIs(engines[0]._pipeline.executor, engines[1]._pipeline.executor)
+        self.assertIs(engines[0]._getExecutor(), engines[1]._getExecutor())
+        self.assertIsNot(engines[0]._getExecutor(), engines[0]._pipeline.executor)
+
+    def test_sqlite_backend(self):
+        directory = os.path.join(tempfile.mkdtemp(), 'index')
+        self.addCleanup(shutil.rmtree, os.path.dirname(directory))
+        shutil.copytree(settings.IQRA_INDEX_DIR, directory)
+        indexing.writeFtsDatabase(directory)
+        iqra = Iqra(directory, resultCache=ResultCache(0), backend='sqlite')
+        self.assertEqual(iqra.getResult(search_json_request['arabicText'], 'en-hilali'),
+                         search_json_response['result'])
+        # Partial matches fall back to the same stages as with whoosh.
+        query = u'الرحمن الرحيم مالك'
+        self.assertEqual(iqra.getResult(query, 'en-hilali')['matches'],
+                         getIqra().getResult(query, 'en-hilali')['matches'])
+
+
+class BuildIndexTestCase(TestCase):
+    morphology = {
+        '90:4': {'roots': u'خلق انس كبد',
+                 'decomposed_ayah': u'ل قد خلق نا ال انسان في كبد'},
+        '112:1': {'roots': u'قول اله احد', 'decomposed_ayah': u'قل هو ال له احد'},
+    }
+
+    def setUp(self):
+        for surahNum, ayahNum, text in ((90, 4, u'لقد خلقنا الانسان في كبد'),
+                                        (112, 1, u'قل هو الله احد')):
+            surah = Surah.objects.create(number=surahNum, name_en=str(surahNum))
+            Ayah.objects.create(chapter_id=surah, verse_number=ayahNum, text_madani=text,
+                                text_simple=text, sajdah=False)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.indexDir = os.path.join(self.directory, 'index')
+        self.morphologyPath = os.path.join(self.directory, 'morphology.json')
+        with open(self.morphologyPath, 'w', encoding='utf-8') as morphologyFile:
+            json.dump(self.morphology, morphologyFile)
+
+    def build(self, **options):
+        call_command('build_iqra_index', index_dir=self.indexDir, procs=1,
+                     stdout=StringIO(), stderr=StringIO(), **options)
+
+    def assertMorphologyIndexed(self):
+        with open_dir(self.indexDir).reader() as reader:
+            self.assertEqual(reader.doc_count(), 2)
+            for fieldName, term in (('roots', u'انس'), ('roots', u'اله'),
+                                    ('decomposed_ayah', u'انسان'),
+                                    ('decomposed_ayah', u'له'),
+                                    ('decomposed_ayah', u'ل')):
+                self.assertEqual(reader.doc_frequency(fieldName, term), 1)
+
+    def test_rebuild_keeps_morphology(self):
+        with self.assertRaises(CommandError):
+            self.build()
+        self.build(morphology=self.morphologyPath)
+        self.assertTrue(os.path.islink(self.indexDir))
+        self.assertMorphologyIndexed()
+        backend = loadBackend('whoosh', self.indexDir)
+        generation = backend.generation
+
+        # Without a morphology file, the fields are carried over from the active index.
+        self.build()
+        self.assertMorphologyIndexed()
+        self.assertTrue(backend.refresh())
+        self.assertNotEqual(backend.generation[0], generation[0])
+        self.assertEqual(len(os.listdir(indexing.generationsDir(self.indexDir))), 2)
+
+    def test_unrecoverable_morphology(self):
+        # Indexes built before build_iqra_index keep the fields without positions.
+        legacyDir = os.path.join(self.directory, 'legacy')
+        os.mkdir(legacyDir)
+        schema = Schema(surah_num=NUMERIC(stored=True), ayah_num=NUMERIC(stored=True),
+                        simple_ayah=TEXT(stored=True), roots=KEYWORD,
+                        decomposed_ayah=KEYWORD)
+        writer = create_in(legacyDir, schema).writer()
+        for key, fields in self.morphology.items():
+            surahNum, ayahNum = map(int, key.split(':'))
+            writer.add_document(surah_num=surahNum, ayah_num=ayahNum, simple_ayah=u'',
+                                **fields)
+        writer.commit()
+        os.symlink(legacyDir, self.indexDir)
+        with self.assertRaises(CommandError):
+            self.build()
+        self.assertEqual(os.path.realpath(self.indexDir), legacyDir)
+
+    def test_plain_directory_is_not_replaced(self):
+        os.mkdir(self.indexDir)
+        with self.assertRaises(CommandError):
+            self.build(morphology=self.morphologyPath)
+        self.assertFalse(os.path.islink(self.indexDir))
+
+
+class MemoryBackendTestCase(SimpleTestCase):
+    def test_matches_whoosh(self):
+        iqra = Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0), backend='memory')
+        whoosh = Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0))
+        for engine in (iqra, whoosh):
+            self.assertEqual(
+                    engine.getResult(search_json_request['arabicText'], 'en-hilali'),
+                    search_json_response['result'])
+        page = Page(limit=10, ranked=True)
+        for query in (u'"الرحمن الرحيم"', u'"رب العالمين" الحمد',
+                      u'الرحمن الرحيم مالك'):
+            result = iqra.getResult(query, 'en-hilali', page)
+            expected = whoosh.getResult(query, 'en-hilali', page)
+            # Hits are in the same order, but the matched terms may not be.
+            self.assertEqual(result['matches'], expected['matches'])
+            self.assertEqual(result['total'], expected['total'])
+            self.assertEqual(set(result['matchedTerms']), set(expected['matchedTerms']))
+        # The queries matched at the same stages of the cascade.
+        self.assertEqual(
+                {name: stats['hits'] for name, stats in iqra.stageStats().items()},
+                {name: stats['hits'] for name, stats in whoosh.stageStats().items()})
+
+
+class NormalizationTestCase(SimpleTestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize(u'لَقَدْ  خَلَقْنَا الْإِنْسَانَ'), u'لقد خلقنا الانسان')
+        self.assertEqual(normalize(u'ٱلرَّحْمَـٰنِ'), u'الرحمن')
+        self.assertEqual(normalize(u'رحمة موسى'), u'رحمه موسي')
+
+    def test_analyzer_normalizes_whole_words(self):
+        tokens = [token.text for token in ArabicAnalyzer()(u'قُلْ هُوَ ٱللَّهُ أَحَدٌ')]
+        self.assertEqual(tokens, [u'قل', u'هو', u'الله', u'احد'])
+        # Single letters are kept.
+        tokens = [token.text for token in ArabicAnalyzer()(u'صٓ وَٱلْقُرْءَانِ')]
+        self.assertEqual(tokens, [u'ص', u'والقرءان'])
+
+    def test_hamza_seats(self):
+        self.assertEqual(normalize(u'يؤمنون'), normalize(u'يءمنون'))
+        self.assertEqual(normalize(u'شيئا'), u'شيءا')
+
+    def test_keyword_analyzer(self):
+        tokens = [token.text for token in ArabicKeywordAnalyzer()(u'وَ قَالُوا۟ ف')]
+        self.assertEqual(tokens, [u'و', u'قالوا', u'ف'])
+
+
+class PhoneticTestCase(SimpleTestCase):
+    def test_phonetic_key(self):
+        self.assertEqual(phoneticKey(u'الصِّرَاطَ'), phoneticKey(u'السرات'))
+        self.assertEqual(phoneticKey(u'الإنسان'), phoneticKey(u'الانسن'))
+        self.assertNotEqual(phoneticKey(u'الانسان'), phoneticKey(u'الانعام'))
+        self.assertEqual(phoneticKey(u'العلم'), phoneticKey(u'الالم'))
+        self.assertEqual(phoneticKey(u'يؤمنون'), phoneticKey(u'يمنون'))
+
+    def test_search_limit(self):
+        index = PhoneticIndex({(90, 4): u'لقد خلقنا الانسان في كبد'},
+                              {(90, 4): {'surah_num': 90, 'ayah_num': 4}})
+        results = index.search(None, u'قبد', limit=0)
+        self.assertEqual((results.hits, results.total, results.matchedTerms),
+                         ([], 1, [u'كبد']))
+        self.assertFalse(index.search(None, u'تقويم', limit=0))
+        self.assertEqual(index.search(None, u'الانسن', limit=1).total, 1)
+
+
+class QueryLogTestCase(TestCase):
+    def test_search_is_logged(self):
+        queryLog = QueryLog(flushInterval=60)
+        iqra = Iqra(settings.IQRA_INDEX_DIR, resultCache=ResultCache(0),
+                    queryLog=queryLog)
+        iqra.getResult(search_json_request['arabicText'], 'en-hilali')
+        iqra.getResult(u'كلمة غير موجودة', 'en-hilali')
+        queryLog.flush()
+        self.assertEqual(
+            list(SearchQueryLog.objects.order_by('id').values_list('result_count',
+                                                                  'stage')),
+            [(1, 'simple_ayah'), (0, '')])
+
+    def test_full_queue_drops_entries(self):
+        batches = []
+        queryLog = QueryLog(batchSize=2, maxQueued=2, flushInterval=60,
+                            write=batches.append)
+        queryLog._startThread = lambda: None
+        for _ in range(3):
+            queryLog.record(u'الله', 4, 'fields', 0.001)
+        queryLog.flush()
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(queryLog.stats()['dropped'], 1)
+        self.assertEqual(queryLog.stats()['written'], 2)
+
+    def test_flush_at_exit(self):
+        batches = []
+        queryLog = QueryLog(flushInterval=60, write=batches.append)
+        with mock.patch('atexit.register') as register:
+            queryLog.record(u'الله', 4, 'fields', 0.001)
+        register.assert_called_once_with(queryLog.flush)
+        queryLog.flush()
+        self.assertEqual(len(batches), 1)
+
+
+class SimilarityTestCase(SimpleTestCase):
+    def test_similar_ayahs(self):
+        similar = similarAyahs({
+            (90, 4): u'لقد خلقنا الانسان في كبد',
+            (95, 4): u'لقد خلقنا الانسان في احسن تقويم',
+            (112, 1): u'قل هو الله احد',
+        })
+        self.assertEqual(similar, {(90, 4): [(95, 4, 0.5)], (95, 4): [(90, 4, 0.5)]})
+
+
+class SpellingTestCase(SimpleTestCase):
+    vocabulary = {u'الانسان': 3, u'الرحمن': 5, u'الرحيم': 4, u'كبد': 1}
+
+    def test_correct(self):
+        corrector = SpellingCorrector(self.vocabulary, maxDistance=1)
+        self.assertEqual(corrector.correct(u'خلقنا الانسن في كبد'),
+                         u'خلقنا الانسان في كبد')
+        # Transposed letters are one edit.
+        self.assertEqual(corrector.suggest(u'الرحنم'), u'الرحمن')
+        self.assertIsNone(corrector.suggest(u'الحمد'))
+
+    def test_budget(self):
+        corrector = SpellingCorrector(self.vocabulary, budget=0, clock=iter(
+                [0, 0, 1]).__next__)
+        self.assertEqual(corrector.correct(u'الانسن الرحمان'), u'الانسان الرحمان')
+
+
+class TranslationStoreTestCase(SimpleTestCase):
+    surahs = [[u'In the name of Allah', u'All praise'], [u'قل هو الله احد']]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for translation in ('en-a', 'en-b', 'en-c'):
+            writePackedTranslation(os.path.join(self.directory, translation + '.bin'),
+                                   self.surahs)
+
+    def test_round_trip(self):
+        packed = PackedTranslation(os.path.join(self.directory, 'en-a.bin'))
+        self.addCleanup(packed.close)
+        self.assertEqual(packed.get(1, 2), u'All praise')
+        self.assertEqual(packed.get(2, 1), u'قل هو الله احد')
+        self.assertEqual(packed.globalIndex(2, 1), 2)
+
+    def test_out_of_range(self):
+        packed = PackedTranslation(os.path.join(self.directory, 'en-a.bin'))
+        self.addCleanup(packed.close)
+        for surahNum, ayahNum in ((1, 3), (1, 0), (0, 1), (3, 1)):
+            with self.assertRaises(IndexError):
+                packed.get(surahNum, ayahNum)
+        store = TranslationStore(self.directory, '', 2**20)
+        self.assertEqual(store.lookup('en-a', [(1, 1), (1, 3), (3, 1)]),
+                         {(1, 1): u'In the name of Allah'})
+
+    def test_lru_eviction(self):
+        size = os.path.getsize(os.path.join(self.directory, 'en-a.bin'))
+        store = TranslationStore(self.directory, '', 2 * size)
+        first = store.get('en-a')
+        second = store.get('en-b')
+        self.assertIs(store.get('en-a'), first)
+        # en-b is now the least recently used, so opening en-c evicts it.
+        store.get('en-c')
+        self.assertIs(store.get('en-a'), first)
+        self.assertIsNot(store.get('en-b'), second)
+
+
+class DatabaseTranslationsTestCase(TestCase):
+    def setUp(self):
+        surah = Surah.objects.create(number=90, name_en='Al-Balad')
+        for ayahNum in (3, 4):
+            ayah = Ayah.objects.create(chapter_id=surah, verse_number=ayahNum,
+                                       text_madani='', text_simple='', sajdah=False)
+            Translation.objects.create(ayah=ayah, resource_name='en-hilali',
+                                       text='90:{}'.format(ayahNum))
+
+    def test_lookup(self):
+        with self.assertNumQueries(1):
+            translations = DatabaseTranslations().lookup('en-hilali', [(90, 4), (90, 5)])
+        self.assertEqual(translations, {(90, 4): '90:4'})
+
+    def test_import_stamps_version(self):
+        call_command('import_iqra_translations', 'en-hilali', stdout=StringIO())
+        self.assertEqual(
+                Translation.objects.get(ayah__verse_number=4,
+                                        resource_name='en-hilali').text,
+                'Verily, We have created man in toil.')
+        self.assertTrue(QuranVersion.objects.exists())
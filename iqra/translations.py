@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Sources of the Iqra translations.
+
+The local store downloads each translation once, packs it into a single file indexed by
+global ayah number and memory-maps it, so looking up an ayah is a slice of the mapped
+file instead of a download and parse of the whole translation. Translations imported
+into the quran Translation table can be served from the database instead.
+
+Both sources look up the translations of a list of ayahs at once, so the cost of a
+lookup depends on the number of ayahs requested rather than on the size of the Quran.
+
+File layout (all integers are little-endian unsigned 32 bit)::
+
+    magic | version | surah count | ayah count
+    surah starts   (surah count + 1 entries, global index of each surah's first ayah)
+    ayah offsets   (ayah count + 1 entries, byte offsets into the text blob)
+    text blob      (UTF-8 ayah texts, back to back)
+"""
+from array import array
+from collections import OrderedDict
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from urllib.request import urlopen
+
+_MAGIC = b'IQTR'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIII')
+_TRANSLATION_NAME = re.compile(r'^[\w-]+$')
+
+
+def _littleEndianArray(values):
+    table = array('I', values)
+    if sys.byteorder != 'little':
+        table.byteswap()
+    return table
+
+
+def writePackedTranslation(path, surahs, encoding='utf-8'):
+    """Packs a translation into the store file format. The file is written next to
+    its destination and renamed into place so readers never see a partial file.
+
+    :param path: The destination file
+    :type path: str
+    :param surahs: The translation as a list of surahs, each a list of ayah texts
+    :type surahs: list
+    """
+    surahStarts = [0]
+    offsets = [0]
+    blob = bytearray()
+    for surah in surahs:
+        for ayah in surah:
+            blob += ayah.encode(encoding)
+            offsets.append(len(blob))
+        surahStarts.append(len(offsets) - 1)
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as packedFile:
+            packedFile.write(
+                    _HEADER.pack(_MAGIC, _VERSION, len(surahs), len(offsets) - 1))
+            _littleEndianArray(surahStarts).tofile(packedFile)
+            _littleEndianArray(offsets).tofile(packedFile)
+            packedFile.write(blob)
+        os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+class PackedTranslation(object):
+    """A memory-mapped, read-only translation file."""
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self._encoding = encoding
+        with open(path, 'rb') as packedFile:
+            self._map = mmap.mmap(packedFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, surahCount, ayahCount = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._map.close()
+            raise ValueError('{} is not a packed translation'.format(path))
+
+        position = _HEADER.size
+        self._surahStarts = self._readTable(position, surahCount + 1)
+        position += (surahCount + 1) * 4
+        self._offsets = self._readTable(position, ayahCount + 1)
+        self._blobStart = position + (ayahCount + 1) * 4
+
+    def _readTable(self, position, length):
+        table = array('I')
+        table.frombytes(self._map[position:position + length * 4])
+        if sys.byteorder != 'little':
+            table.byteswap()
+        return table
+
+    @property
+    def size(self):
+        """Size of the mapped file in bytes."""
+        return len(self._map)
+
+    def globalIndex(self, surahNum, ayahNum):
+        """Converts a surah and ayah number (both 1-indexed) to a global ayah index.
+
+        :raises IndexError: If the surah or ayah does not exist.
+        """
+        if not 1 <= surahNum < len(self._surahStarts):
+            raise IndexError('surah {} out of range'.format(surahNum))
+        index = self._surahStarts[surahNum - 1] + ayahNum - 1
+        if ayahNum < 1 or index >= self._surahStarts[surahNum]:
+            raise IndexError('ayah {}:{} out of range'.format(surahNum, ayahNum))
+        return index
+
+    def get(self, surahNum, ayahNum):
+        """Returns the translated text of an ayah.
+
+        :param surahNum: The surah number (1-indexed)
+        :type surahNum: int
+        :param ayahNum: The ayah number (1-indexed)
+        :type ayahNum: int
+        :return: The translation of the ayah
+        :rtype: str
+        """
+        index = self.globalIndex(surahNum, ayahNum)
+        start = self._blobStart + self._offsets[index]
+        end = self._blobStart + self._offsets[index + 1]
+        return self._map[start:end].decode(self._encoding)
+
+    def close(self):
+        self._map.close()
+
+
+class TranslationStore(object):
+    """Downloads, packs and caches translations on local disk. Opened translations are
+    kept in an LRU bounded by the total size of the mapped files.
+    """
+
+    def __init__(self, directory, sourceUrl, maxBytes):
+        self._directory = directory
+        self._sourceUrl = sourceUrl
+        self._maxBytes = maxBytes
+        self._opened = OrderedDict()
+        self._openedBytes = 0
+        self._lock = threading.Lock()
+        self._loadLock = threading.Lock()
+
+    def _path(self, translation):
+        if not _TRANSLATION_NAME.match(translation):
+            raise ValueError('Invalid translation name: {!r}'.format(translation))
+        return os.path.join(self._directory, translation + '.bin')
+
+    def download(self, translation, encoding='utf-8'):
+        """Downloads a translation JSON and converts it to a list of surahs.
+
+        :param translation: Filename without the .json extension
+        :type translation: str
+        :return: The translation as a list of surahs, each a list of ayah texts
+        :rtype: list
+        """
+        self._path(translation)
+        data_response = urlopen(self._sourceUrl + translation + '.json')
+        return json.loads(data_response.read().decode(encoding))
+
+    def ingest(self, translation):
+        """Downloads a translation and (re)writes its packed file.
+
+        :return: The path to the packed file
+        :rtype: str
+        """
+        path = self._path(translation)
+        writePackedTranslation(path, self.download(translation))
+        return path
+
+    def get(self, translation):
+        """Returns a packed translation, ingesting it first if it is not on disk.
+
+        :param translation: The translation name, e.g. 'en-hilali'
+        :type translation: str
+        :rtype: PackedTranslation
+        """
+        with self._lock:
+            packed = self._opened.get(translation)
+            if packed is not None:
+                self._opened.move_to_end(translation)
+                return packed
+
+        with self._loadLock:
+            with self._lock:
+                packed = self._opened.get(translation)
+            if packed is not None:
+                return packed
+            path = self._path(translation)
+            if not os.path.exists(path):
+                self.ingest(translation)
+            packed = PackedTranslation(path)
+
+            with self._lock:
+                self._opened[translation] = packed
+                self._openedBytes += packed.size
+                # Evicted maps are not closed here since in-flight readers may still
+                # hold them; they are unmapped once garbage collected.
+                while self._openedBytes > self._maxBytes and len(self._opened) > 1:
+                    _, evicted = self._opened.popitem(last=False)
+                    self._openedBytes -= evicted.size
+        return packed
+
+    def lookup(self, translation, ayahs):
+        """Returns the translations of some ayahs.
+
+        :param translation: The translation name, e.g. 'en-hilali'
+        :type translation: str
+        :param ayahs: (surah number, ayah number) tuples
+        :type ayahs: iterable
+        :return: The translations of the ayahs that exist, by (surah number, ayah
+            number)
+        :rtype: dict
+        """
+        packed = self.get(translation)
+        translations = {}
+        for surahNum, ayahNum in ayahs:
+            try:
+                translations[(surahNum, ayahNum)] = packed.get(surahNum, ayahNum)
+            except IndexError:
+                pass
+        return translations
+
+
+class DatabaseTranslations(object):
+    """Translations imported into the quran Translation table by the
+    import_iqra_translations command. The translation name is the resource name of the
+    rows.
+    """
+
+    def lookup(self, translation, ayahs):
+        """Returns the translations of some ayahs with a single query.
+
+        :param translation: The translation name, e.g. 'en-hilali'
+        :type translation: str
+        :param ayahs: (surah number, ayah number) tuples
+        :type ayahs: iterable
+        :return: The translations of the ayahs found, by (surah number, ayah number)
+        :rtype: dict
+        """
+        from quran.models import Translation
+
+        ayahs = set(ayahs)
+        if not ayahs:
+            return {}
+        # Filtering on the surah and ayah numbers separately keeps the query small and
+        # indexed; the few extra rows are dropped here.
+        rows = Translation.objects.filter(
+                resource_name=translation,
+                ayah__chapter_id__number__in={surahNum for surahNum, _ in ayahs},
+                ayah__verse_number__in={ayahNum for _, ayahNum in ayahs},
+        ).values_list('ayah__chapter_id__number', 'ayah__verse_number', 'text')
+        return {(surahNum, ayahNum): text for surahNum, ayahNum, text in rows
+                if (surahNum, ayahNum) in ayahs}
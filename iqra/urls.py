@@ -3,5 +3,9 @@ from . import views
 
 urlpatterns = [
     path('search/', views.getSearchResult, name='iqra-search'),
+    path('search/batch/', views.getBatchSearchResults, name='iqra-search-batch'),
+    path('locate/', views.getLocation, name='iqra-locate'),
+    path('autocomplete/', views.getAutocomplete, name='iqra-autocomplete'),
     path('translations/', views.getAyahTranslations, name='iqra-translation'),
+    path('metrics/', views.getMetrics, name='iqra-metrics'),
 ]
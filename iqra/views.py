@@ -1,7 +1,57 @@
 # -*- coding: utf-8 -*-
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from rest_framework.decorators import api_view
-from .Iqra import Iqra
+from .Iqra import getIqra, Page
+from .metrics import Timings
+
+# Upper bound on the continuations and ayahs returned by one autocomplete request.
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+
+def _getBoolFromData(data, name):
+    """Reads an optional boolean parameter of a request. Form-encoded requests send
+    booleans as strings, so 'true' and 'false' are accepted too.
+
+    :param data: The request data
+    :type data: dict
+    :param name: The parameter name
+    :type name: str
+    :return: The parameter, False if it is missing
+    :rtype: bool
+    :raises ValueError: If the parameter is not a boolean
+    """
+    value = data.get(name, False)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValueError('{} must be true or false'.format(name))
+
+
+def _getPageFromData(data):
+    """Reads the optional pagination parameters of a search request.
+
+    :param data: The request JSON
+    :type data: dict
+    :return: The requested page, or None if the request is not paginated
+    :rtype: Page, None
+    :raises ValueError: If limit is not a positive integer, offset is not a non-negative
+        integer, or ranked is not a boolean
+    """
+    if not any(param in data for param in ('limit', 'offset', 'ranked')):
+        return None
+    try:
+        limit = data.get('limit')
+        limit = None if limit is None else int(limit)
+        offset = int(data.get('offset', 0))
+    except (TypeError, ValueError):
+        raise ValueError('limit and offset must be integers')
+    if limit is not None and limit < 1:
+        raise ValueError('limit must be at least 1')
+    if offset < 0:
+        raise ValueError('offset must not be negative')
+    return Page(limit, offset, _getBoolFromData(data, 'ranked'))
 
 
 @api_view(['POST'])
@@ -11,7 +61,12 @@ def getSearchResult(request):
     JSON: {
         'arabicText': u'محمد',
         'translation': 'en-hilali',
+        'limit': 10,        (optional, page size)
+        'offset': 0,        (optional)
+        'ranked': false,    (optional, order by score instead of surah/ayah)
+        'debug': false,     (optional, add the milliseconds spent in each step)
     }
+    Paginated responses also contain the total number of matches.
     :param request: REST API request object.
     :type request: rest_framework.request.Request
     :return: JSON response with query text, matches, and suggestions
@@ -23,8 +78,122 @@ def getSearchResult(request):
         translation = data['translation']
     else:
         translation = 'en-hilali'
-    iqra = Iqra()
-    result = iqra.getResult(value, translation)
+    try:
+        page = _getPageFromData(data)
+        debug = _getBoolFromData(data, 'debug')
+    except ValueError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+    iqra = getIqra()
+    result = iqra.getResult(value, translation, page, debug)
+    result = {'result': result}
+    return JsonResponse(result)
+
+
+@api_view(['POST'])
+def getBatchSearchResults(request):
+    """Returns the results of several searches, in the order of the queries.
+    Parameters need to be JSON in the body
+    Example: /iqra/search/batch/
+    JSON: {
+        'queries': [
+            {'arabicText': u'محمد', 'translation': 'en-hilali', 'limit': 10},
+            u'الله',
+        ],
+        'translation': 'en-hilali', (optional, default for queries without one)
+        'parallel': false,          (optional, run the queries on a thread pool)
+        'debug': false,             (optional, add the milliseconds spent in each step)
+    }
+    Queries are either the query text or an object with the same parameters as
+    /iqra/search/.
+    :param request: REST API request object.
+    :type request: rest_framework.request.Request
+    :return: JSON response with the result and time in milliseconds of every query
+    :rtype: JsonResponse
+    """
+    data = request.data
+    queries = data['queries']
+    if not isinstance(queries, list):
+        return JsonResponse({'detail': 'queries must be a list'}, status=400)
+    if len(queries) > settings.IQRA_BATCH_MAX_QUERIES:
+        return JsonResponse({'detail': 'At most {} queries are allowed'.format(
+                settings.IQRA_BATCH_MAX_QUERIES)}, status=400)
+    defaultTranslation = data.get('translation', 'en-hilali')
+    try:
+        parallel = _getBoolFromData(data, 'parallel')
+        debug = _getBoolFromData(data, 'debug')
+    except ValueError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+
+    searches = []
+    for query in queries:
+        if not isinstance(query, dict):
+            query = {'arabicText': query}
+        if not isinstance(query.get('arabicText'), str):
+            return JsonResponse({'detail': 'every query must have an arabicText string'},
+                                status=400)
+        try:
+            page = _getPageFromData(query)
+        except ValueError as error:
+            return JsonResponse({'detail': str(error)}, status=400)
+        translation = query.get('translation', defaultTranslation)
+        searches.append((query['arabicText'], translation, page))
+
+    iqra = getIqra()
+    results = iqra.getResults(searches, parallel=parallel, debug=debug)
+    result = {'result': [
+        {'result': queryResult, 'timeMs': seconds * 1000}
+        for queryResult, seconds in results
+    ]}
+    return JsonResponse(result)
+
+
+@api_view(['POST'])
+def getLocation(request):
+    """Returns the span of consecutive ayahs a long transcript was recited from.
+    Parameters need to be JSON in the body
+    Example: /iqra/locate/
+    JSON: {
+        'arabicText': u'الحمد لله رب العالمين الرحمن الرحيم مالك يوم الدين',
+        'translation': 'en-hilali',
+    }
+    :param request: REST API request object.
+    :type request: rest_framework.request.Request
+    :return: JSON response with the surah, first and last ayah of the span, the
+        fraction of the transcript aligned with it and its ayahs
+    :rtype: JsonResponse
+    """
+    data = request.data
+    value = data['arabicText']
+    translation = data.get('translation', 'en-hilali')
+    iqra = getIqra()
+    result = iqra.getLocation(value, translation)
+    result = {'result': result}
+    return JsonResponse(result)
+
+
+@api_view(['GET'])
+def getAutocomplete(request):
+    """Completes a partial phrase of ayah text, for search as you type. The last word
+    is completed unless the phrase ends with a space, in which case the next word is.
+    Example: /iqra/autocomplete/?q=بسم%20الل&limit=10
+    :param request: REST API request object.
+    :type request: rest_framework.request.Request
+    :return: JSON response with the most frequent continuations of the phrase, the
+        ayahs containing them and the number of times the phrase occurs
+    :rtype: JsonResponse
+    """
+    value = request.query_params.get('q', '')
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return JsonResponse({'detail': 'limit must be an integer'}, status=400)
+    if not 0 < limit <= AUTOCOMPLETE_MAX_LIMIT:
+        return JsonResponse({'detail': 'limit must be between 1 and {}'.format(
+                AUTOCOMPLETE_MAX_LIMIT)}, status=400)
+    if not value.strip():
+        return JsonResponse({'detail': 'q must not be empty'}, status=400)
+    iqra = getIqra()
+    result = iqra.getAutocomplete(value, limit)
     result = {'result': result}
     return JsonResponse(result)
 
@@ -36,6 +205,7 @@ def getAyahTranslations(request):
     JSON: {
         'ayahs': [Ayahs(surahNum, ayahNum)],
         'translation': 'en-hilali',
+        'debug': false, (optional, add the milliseconds spent in each step)
     }
     :param request: REST API request object.
     :type request: rest_framework.request.Request
@@ -48,7 +218,29 @@ def getAyahTranslations(request):
         translation = data['translation']
     else:
         translation = 'en-hilali'
-    iqra = Iqra()
-    result = iqra.getTranslations(ayahs, translation)
+    try:
+        debug = _getBoolFromData(data, 'debug')
+    except ValueError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+    timings = Timings()
+    iqra = getIqra()
+    result = iqra.getTranslations(ayahs, translation, timings)
     result = {'result': result}
+    if debug:
+        result['timings'] = timings.asDict()
     return JsonResponse(result)
+
+
+@api_view(['GET'])
+def getMetrics(request):
+    """Returns the latency histograms and counters of this worker's search engine in
+    the Prometheus text format, for scraping.
+    Example: /iqra/metrics/
+    :param request: REST API request object.
+    :type request: rest_framework.request.Request
+    :return: The metrics as plain text
+    :rtype: HttpResponse
+    """
+    iqra = getIqra()
+    return HttpResponse(iqra.renderMetrics(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,97 @@
+"""
+Pre-rendered surah documents for the reader.
+
+The build_quran_blobs command renders every surah, with its ayahs, their words in
+order and their translations, into one JSON document, and writes it to disk both as is
+and gzipped. The full surah endpoint then streams the stored bytes without any ORM or
+serializer work.
+"""
+import gzip
+from io import BytesIO
+import json
+import os
+
+GZIP_SUFFIX = '.gz'
+
+
+def blob_path(directory, surah_num, gzipped=False):
+    """Returns the path of the document of a surah.
+
+    :rtype: str
+    """
+    return os.path.join(directory, '{}.json{}'.format(
+            surah_num, GZIP_SUFFIX if gzipped else ''))
+
+
+def render_surah(corpus, surah):
+    """Renders the document of a surah.
+
+    :param corpus: The Quran corpus
+    :type corpus: quran.corpus.QuranCorpus
+    :param surah: The surah
+    :type surah: quran.models.Surah
+    :return: The UTF-8 encoded JSON document
+    :rtype: bytes
+    """
+    ayahs = []
+    for number in corpus.surah_range(surah.number):
+        ayah = corpus.get_ayah(number)
+        # Every ayah of the surah is in the document, so the reader needs no links.
+        del ayah['next'], ayah['prev']
+        ayahs.append(ayah)
+    document = {
+        'surah': {
+            'number': surah.number,
+            'name_en': surah.name_en,
+            'name_ar': surah.name_ar,
+        },
+        'version': corpus.version,
+        'ayahs': ayahs,
+    }
+    return json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _write_atomically(path, data):
+    partial_path = path + '.partial'
+    with open(partial_path, 'wb') as blob_file:
+        blob_file.write(data)
+    os.replace(partial_path, path)
+
+
+def write_blobs(corpus, surahs, directory, compress=True):
+    """Renders the documents of some surahs and writes them to a directory. Every file
+    is replaced atomically, so readers never see a partial document.
+
+    :param corpus: The Quran corpus
+    :type corpus: quran.corpus.QuranCorpus
+    :param surahs: The surahs to render
+    :type surahs: iterable(quran.models.Surah)
+    :param directory: The output directory, created if needed
+    :type directory: str
+    :param compress: True to also write a gzipped copy of every document, False to
+        delete the gzipped copies of earlier builds, which would be served instead
+    :type compress: bool
+    :return: The total size of the documents and of their gzipped copies, in bytes
+    :rtype: tuple(int, int)
+    """
+    os.makedirs(directory, exist_ok=True)
+    size = compressed_size = 0
+    for surah in surahs:
+        data = render_surah(corpus, surah)
+        _write_atomically(blob_path(directory, surah.number), data)
+        size += len(data)
+        if compress:
+            # A fixed mtime keeps the gzipped bytes identical across builds.
+            buffer = BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                               mtime=0) as gzip_file:
+                gzip_file.write(data)
+            compressed = buffer.getvalue()
+            _write_atomically(blob_path(directory, surah.number, True), compressed)
+            compressed_size += len(compressed)
+        else:
+            try:
+                os.remove(blob_path(directory, surah.number, True))
+            except FileNotFoundError:
+                pass
+    return size, compressed_size
@@ -0,0 +1,217 @@
+"""
+In-memory copy of the Quran text.
+
+The ayahs, their words and their translations never change while the server runs, so
+every worker loads them once, in reading order, instead of querying them for every page
+turn. An ayah is addressed by its global number (0-6235 for the whole Quran), and the
+global numbers of the next and previous ayahs are precomputed, wrapping around from
+the last ayah of a surah to the first ayah of the next one, and from An-Nas back to
+Al-Fatiha.
+
+Random ayahs are drawn from the same arrays. The ayahs of a range of surahs are a
+contiguous range of global numbers, and the global numbers sorted by length and the
+sajdah ayahs are precomputed, so every filter narrows the draw without scanning.
+"""
+from array import array
+from bisect import bisect_right
+import random
+import threading
+from django.db.models import F
+from quran.models import Ayah, AyahWord, Translation
+from quran.versioning import get_version
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def _group_by_ayah(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row['ayah_id'], []).append(row)
+    return grouped
+
+
+class QuranCorpus(object):
+    """The ayahs of the Quran with their words and translations.
+
+    :param ayahs: The ayah rows, in reading order, with the surah number under
+        'surah_number'
+    :type ayahs: list(dict)
+    :param words: The word rows of every ayah by ayah id, in the order they are returned
+    :type words: dict
+    :param translations: The translation rows of every ayah by ayah id
+    :type translations: dict
+    :param version: The version of the data, see quran.versioning
+    :type version: str, None
+    """
+
+    def __init__(self, ayahs, words, translations, version=None):
+        self.version = version
+        self._ayahs = []
+        self._positions = []
+        self._words = []
+        self._translations = []
+        self._index = {}
+        for number, row in enumerate(ayahs):
+            row = dict(row)
+            position = (row.pop('surah_number'), row['verse_number'])
+            self._ayahs.append(row)
+            self._positions.append(position)
+            self._words.append(tuple(words.get(row['id'], ())))
+            self._translations.append(tuple(translations.get(row['id'], ())))
+            self._index[position] = number
+        count = len(self._ayahs)
+        self._next = array('H', [(number + 1) % count for number in range(count)])
+        self._previous = array('H', [(number - 1) % count for number in range(count)])
+
+        # The global numbers of the first ayah of every surah, and of the end.
+        self._surah_starts = {}
+        for number, (surah_num, _) in enumerate(self._positions):
+            self._surah_starts.setdefault(surah_num, number)
+        self._surah_numbers = sorted(self._surah_starts)
+        self._lengths = array('H', [len(row['text_simple']) for row in self._ayahs])
+        self._by_length = array('H', sorted(range(count), key=self._lengths.__getitem__))
+        self._sorted_lengths = array('H', sorted(self._lengths))
+        self._sajdahs = array('H', [number for number, row in enumerate(self._ayahs)
+                                    if row['sajdah']])
+        self._is_sajdah = bytearray(bool(row['sajdah']) for row in self._ayahs)
+
+    @classmethod
+    def load(cls, version=None):
+        """Loads the corpus from the database, with one query per table.
+
+        :rtype: QuranCorpus
+        """
+        ayahs = Ayah.objects.order_by('chapter_id__number', 'verse_number').values(
+                'id', 'chapter_id', 'verse_number', 'text_madani', 'text_simple',
+                'sajdah', surah_number=F('chapter_id__number'))
+        # The reader lays words out right to left, so they are served in reverse.
+        words = _group_by_ayah(AyahWord.objects.order_by('ayah_id', '-id').values())
+        translations = _group_by_ayah(
+                Translation.objects.order_by('ayah_id', 'id').values())
+        return cls(list(ayahs), words, translations, version)
+
+    def __len__(self):
+        return len(self._ayahs)
+
+    def find(self, surah_num, ayah_num):
+        """Returns the global number of an ayah.
+
+        :return: The global number, or None if the ayah does not exist
+        :rtype: int, None
+        """
+        return self._index.get((surah_num, ayah_num))
+
+    def position(self, number):
+        """Returns the (surah number, ayah number) of an ayah.
+
+        :rtype: tuple(int, int)
+        """
+        return self._positions[number]
+
+    def next(self, number):
+        return self._next[number]
+
+    def previous(self, number):
+        return self._previous[number]
+
+    def _surah_range(self, first_surah, last_surah):
+        """Returns the range of global numbers of the ayahs of a range of surahs."""
+        surahs = self._surah_numbers
+        first = bisect_right(surahs, first_surah - 1) if first_surah is not None else 0
+        last = bisect_right(surahs, last_surah) if last_surah is not None else len(surahs)
+        start = self._surah_starts[surahs[first]] if first < len(surahs) else len(self)
+        end = self._surah_starts[surahs[last]] if last < len(surahs) else len(self)
+        return start, max(start, end)
+
+    def surah_range(self, surah_num):
+        """Returns the global numbers of the ayahs of a surah.
+
+        :rtype: range
+        """
+        return range(*self._surah_range(surah_num, surah_num))
+
+    def random_ayah(self, first_surah=None, last_surah=None, max_length=None,
+                    sajdah=None, rng=random, attempts=32):
+        """Draws a random ayah matching some filters. The draw is from the smallest
+        precomputed set matching one of the filters, and the other filters are checked on
+        the drawn ayah. Only if attempts draws in a row miss is the set scanned.
+
+        :param first_surah: The first surah number to draw from
+        :type first_surah: int, None
+        :param last_surah: The last surah number to draw from
+        :type last_surah: int, None
+        :param max_length: Maximum number of characters of the simple text
+        :type max_length: int, None
+        :param sajdah: True for sajdah ayahs only, False to exclude them
+        :type sajdah: bool, None
+        :return: The global number of the ayah, or None if no ayah matches
+        :rtype: int, None
+        """
+        start, end = self._surah_range(first_surah, last_surah)
+        lengths = self._lengths
+        is_sajdah = self._is_sajdah
+
+        def matches(number):
+            return (start <= number < end and
+                    (max_length is None or lengths[number] <= max_length) and
+                    (sajdah is None or bool(is_sajdah[number]) == sajdah))
+
+        candidates = [(range(start, end), end - start)]
+        if max_length is not None:
+            candidates.append((self._by_length,
+                               bisect_right(self._sorted_lengths, max_length)))
+        if sajdah:
+            candidates.append((self._sajdahs, len(self._sajdahs)))
+        numbers, count = min(candidates, key=lambda candidate: candidate[1])
+        if count == 0:
+            return None
+        for _ in range(attempts):
+            number = numbers[rng.randrange(count)]
+            if matches(number):
+                return number
+        matching = [numbers[index] for index in range(count) if matches(numbers[index])]
+        return rng.choice(matching) if matching else None
+
+    def get_ayah(self, number):
+        """Returns an ayah with its words and translations, and the position of the
+        ayahs before and after it. The result is a new dict the caller can modify.
+
+        :param number: The global number of the ayah
+        :type number: int
+        :rtype: dict
+        """
+        next_surah, next_ayah = self._positions[self._next[number]]
+        prev_surah, prev_ayah = self._positions[self._previous[number]]
+        return dict(
+            self._ayahs[number],
+            words=list(self._words[number]),
+            translations=list(self._translations[number]),
+            next={'surah': next_surah, 'ayah': next_ayah},
+            prev={'surah': prev_surah, 'ayah': prev_ayah},
+        )
+
+
+def get_corpus():
+    """Returns the process-wide corpus, loading it on first use and again when
+    fill_quran_db has imported a new version of the data.
+
+    :rtype: QuranCorpus
+    """
+    global _corpus
+    stamp = get_version()
+    version = stamp.version if stamp is not None else None
+    corpus = _corpus
+    if corpus is None or corpus.version != version:
+        with _corpus_lock:
+            if _corpus is None or _corpus.version != version:
+                _corpus = QuranCorpus.load(version)
+            corpus = _corpus
+    return corpus
+
+
+def reset_corpus():
+    """Drops the loaded corpus, so the next request loads the database again."""
+    global _corpus
+    with _corpus_lock:
+        _corpus = None
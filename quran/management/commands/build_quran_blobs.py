@@ -0,0 +1,36 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from quran.blobs import write_blobs
+from quran.corpus import QuranCorpus
+from quran.models import Surah
+from quran.versioning import get_version
+
+
+class Command(BaseCommand):
+    help = ('Renders every surah into one JSON document, and a gzipped copy, served by '
+            'v1/quran/surah/<n>/full/.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=settings.QURAN_BLOB_DIR,
+                            help='Where to write the documents. Defaults to '
+                                 'QURAN_BLOB_DIR.')
+        parser.add_argument('--surah', type=int, action='append', dest='surahs',
+                            help='Only render this surah. Can be repeated.')
+        parser.add_argument('--no-gzip', action='store_true',
+                            help='Do not write gzipped copies.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        stamp = get_version()
+        corpus = QuranCorpus.load(stamp.version if stamp is not None else None)
+        surahs = Surah.objects.order_by('number')
+        if options['surahs']:
+            surahs = surahs.filter(number__in=options['surahs'])
+        surahs = list(surahs)
+        size, compressed_size = write_blobs(corpus, surahs, options['output_dir'],
+                                            not options['no_gzip'])
+        self.stdout.write(
+            'Rendered {} surahs into {} in {:.2f}s ({:.1f} MB, {:.1f} MB gzipped)'.format(
+                len(surahs), options['output_dir'], time.perf_counter() - start,
+                size / 2.0**20, compressed_size / 2.0**20))
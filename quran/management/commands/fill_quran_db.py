@@ -1,88 +1,121 @@
-from django.core.management.base import BaseCommand
 import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
 from quran.models import Surah, Ayah, AyahWord, Translation
-from tqdm import tqdm
+from quran.versioning import stamp_version
 
-DATA_JSON_PATH = '/Users/piraka/Downloads/data-words.json'
-UTH_JSON_PATH = '/Users/piraka/Downloads/data-uthmani.json'
+# Rows inserted per query, which keeps SQLite under its limit of query parameters.
+BATCH_SIZE = 500
 
 
 class Command(BaseCommand):
+    help = ('Imports the surahs, ayahs, words and translations of the Quran in one '
+            'transaction. Rows already in the database are kept, so the import can be '
+            'run again safely.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('words_path',
+                            help='data-words.json: the verses of every surah with their '
+                                 'words and translations.')
+        parser.add_argument('uthmani_path',
+                            help='data-uthmani.json: the Arabic names of the surahs.')
+
     def handle(self, *args, **options):
-        # Get the surah names
-        with open(UTH_JSON_PATH, encoding='utf-8') as uth_json_file:
-            quran = json.load(uth_json_file)
-            quran = quran['quran']
-            surah_name_list = []
-            for i, surah in tqdm(enumerate(quran['surahs']), desc='Surah Names'):
-                surah_name_list.append(surah['name'])
-                
-        with open(DATA_JSON_PATH, encoding='utf-8') as data_json_file:
-            data_file = json.load(data_json_file)
-            # Go over each surah
-            for surah, verses in tqdm(data_file.items(), desc='Surahs', total=114):
-                surah_num = int(surah)
-                new_surah, created = Surah.objects.get_or_create(
-                        number=surah_num, name_ar=surah_name_list[surah_num-1])
+        start = time.perf_counter()
+        with open(options['uthmani_path'], encoding='utf-8') as uth_json_file:
+            quran = json.load(uth_json_file)['quran']
+        surah_names = [surah['name'] for surah in quran['surahs']]
+        with open(options['words_path'], encoding='utf-8') as data_json_file:
+            data = json.load(data_json_file)
+        surahs = sorted((int(surah), verses['verses']) for surah, verses in data.items())
+        self.stdout.write('Parsed {} surahs in {:.2f}s'.format(
+                len(surahs), time.perf_counter() - start))
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            created = self._import(surahs, surah_names)
+            # Invalidates the HTTP caches of the quran endpoints and the loaded corpora.
+            if any(created.values()):
+                stamp_version()
+        seconds = time.perf_counter() - start
+        total = sum(created.values())
+        counts = ', '.join('{} {}'.format(count, name) for name, count in created.items())
+        self.stdout.write('Created {} rows in {:.2f}s ({:.0f} rows/s): {}'.format(
+                total, seconds, total / seconds if seconds else 0, counts))
+
+    def _import(self, surahs, surah_names):
+        """Inserts the rows missing from the database, found by their natural keys:
+        the surah number, the surah and verse number of an ayah, the ayah and position
+        of a word, and the ayah, resource and text of a translation.
 
-                # Now go over all the ayahs
-                for verse in tqdm(verses['verses'], desc='Ayahs'):
-                    # Extract
-                    sajdah = True if verse['sajdah'] else False
-                    text_madani = verse['text_madani']
-                    text_simple = verse['text_simple']
-                    verse_number = verse['verse_number']
+        :return: The number of rows created per table
+        :rtype: dict
+        """
+        # Surahs
+        surah_ids = dict(Surah.objects.values_list('number', 'id'))
+        new_surahs = [Surah(number=number, name_ar=surah_names[number - 1])
+                      for number, _ in surahs if number not in surah_ids]
+        Surah.objects.bulk_create(new_surahs, batch_size=BATCH_SIZE)
+        # Primary keys of bulk created rows are only set on PostgreSQL.
+        surah_ids = dict(Surah.objects.values_list('number', 'id'))
 
-                    # Create the ayah
-                    try:
-                        new_ayah = Ayah.objects.get(chapter_id=new_surah,
-                                                    verse_number=verse_number)
-                    except Ayah.DoesNotExist:
-                        new_ayah = Ayah(chapter_id=new_surah,
-                                        verse_number=verse_number,
-                                        text_madani=text_madani,
-                                        text_simple=text_simple,
-                                        sajdah=sajdah)
-                        new_ayah.save()
+        # Ayahs
+        def ayah_keys():
+            return {(surah_num, verse_number): ayah_id
+                    for ayah_id, surah_num, verse_number in Ayah.objects.values_list(
+                            'id', 'chapter_id__number', 'verse_number')}
 
-                    # Go over translations
-                    for translation in verse['translations']:
-                        text = translation['text']
-                        language_name = translation['language_name']
-                        resource_name = translation['resource_name']
-                        if translation['language_name'] != 'english':
-                            print("non-english translation at: {},{}".format(
-                                    surah, verse['verse_number']))
+        ayah_ids = ayah_keys()
+        new_ayahs = []
+        for surah_num, verses in surahs:
+            for verse in verses:
+                if (surah_num, verse['verse_number']) in ayah_ids:
+                    continue
+                new_ayahs.append(Ayah(chapter_id_id=surah_ids[surah_num],
+                                      verse_number=verse['verse_number'],
+                                      text_madani=verse['text_madani'],
+                                      text_simple=verse['text_simple'],
+                                      sajdah=bool(verse['sajdah'])))
+        Ayah.objects.bulk_create(new_ayahs, batch_size=BATCH_SIZE)
+        ayah_ids = ayah_keys()
 
-                        try:
-                            new_translation = Translation.objects.get(ayah=new_ayah,
-                                                                      text=text)
-                        except Translation.DoesNotExist:
-                            new_translation = Translation(
-                                    ayah=new_ayah, resource_name=resource_name,
-                                    text=text, language_name=language_name)
-                            new_translation.save()
+        # Words and translations
+        word_keys = set(AyahWord.objects.values_list('ayah_id', 'number'))
+        translation_keys = set(Translation.objects.values_list(
+                'ayah_id', 'resource_name', 'text'))
+        new_words = []
+        new_translations = []
+        for surah_num, verses in surahs:
+            for verse in verses:
+                ayah_id = ayah_ids[(surah_num, verse['verse_number'])]
+                for translation in verse['translations']:
+                    if translation['language_name'] != 'english':
+                        self.stderr.write('non-english translation at: {},{}'.format(
+                                surah_num, verse['verse_number']))
+                    key = (ayah_id, translation['resource_name'], translation['text'])
+                    if key in translation_keys:
+                        continue
+                    translation_keys.add(key)
+                    new_translations.append(Translation(
+                            ayah_id=ayah_id, resource_name=translation['resource_name'],
+                            text=translation['text'],
+                            language_name=translation['language_name']))
+                for number, word in enumerate(verse['words'], 1):
+                    if (ayah_id, number) in word_keys:
+                        continue
+                    new_words.append(AyahWord(ayah_id=ayah_id, number=number,
+                                              text_madani=word['text_madani'],
+                                              text_simple=word['text_simple'],
+                                              code=word['code'],
+                                              class_name=word['class_name'],
+                                              char_type=word['char_type']))
+        AyahWord.objects.bulk_create(new_words, batch_size=BATCH_SIZE)
+        Translation.objects.bulk_create(new_translations, batch_size=BATCH_SIZE)
 
-                    # Go over words
-                    for i, word in enumerate(verse['words'], 1):
-                        text_madani = word['text_madani']
-                        text_simple = word['text_simple']
-                        code = word['code']
-                        class_name = word['class_name']
-                        char_type = word['char_type']
-                        try:
-                            new_word = AyahWord.objects.get(number=i,
-                                                            ayah=new_ayah,
-                                                            text_simple=text_simple,
-                                                            code=code,
-                                                            class_name=class_name,
-                                                            char_type=char_type)
-                        except AyahWord.DoesNotExist:
-                            new_word = AyahWord(number=i,
-                                                ayah=new_ayah,
-                                                text_madani=text_madani,
-                                                text_simple=text_simple,
-                                                code=code,
-                                                class_name=class_name,
-                                                char_type=char_type)
-                            new_word.save()
+        return {
+            'surahs': len(new_surahs),
+            'ayahs': len(new_ayahs),
+            'words': len(new_words),
+            'translations': len(new_translations),
+        }
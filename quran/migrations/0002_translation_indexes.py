@@ -0,0 +1,27 @@
+# Generated by Django 2.2.1 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='translation',
+            name='language_name',
+            field=models.CharField(choices=[('EN', 'English')], db_index=True, default='EN', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='translation',
+            name='resource_name',
+            field=models.CharField(choices=[('transliteration', 'Transliteration')], db_index=True, default='transliteration', max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='translation',
+            index=models.Index(fields=['resource_name', 'ayah'], name='quran_trans_resourc_9c688d_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.1 on 2026-10-18 07:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quran', '0002_translation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuranVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=32)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Surah(models.Model):
@@ -46,11 +47,29 @@ class Translation(models.Model):
     )
     ayah = models.ForeignKey(Ayah, on_delete=models.CASCADE)
     language_name = models.CharField(choices=LANGUAGE_CHOICES, default='EN',
-                                     max_length=32)
+                                     max_length=32, db_index=True)
     resource_name = models.CharField(choices=TRANSLATION_CHOICES,
-                                     default='transliteration', max_length=32)
+                                     default='transliteration', max_length=32,
+                                     db_index=True)
     text = models.CharField(max_length=2048)
 
+    class Meta:
+        indexes = [
+            # Bulk lookups of one translation for a list of ayahs.
+            models.Index(fields=['resource_name', 'ayah']),
+        ]
+
     def __str__(self):
         return "{}:{}, {} ()".format(self.ayah.chapter_id, self.ayah.verse_number,
                                      self.resource_name, self.text)
+
+
+class QuranVersion(models.Model):
+    """Stamp of the Quran data, replaced every time fill_quran_db imports it. HTTP
+    caches of the quran endpoints are keyed on it.
+    """
+    version = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} ({})".format(self.version, self.updated_at)
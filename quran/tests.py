@@ -1,3 +1,185 @@
-from django.test import TestCase
+import gzip
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from quran.corpus import reset_corpus
+from quran.versioning import reset_version, stamp_version
+from quran.models import Ayah, AyahWord, QuranVersion, Surah, Translation
 
-# Create your tests here.
+
+class GetAyahTestCase(APITestCase):
+    def setUp(self):
+        for number, name, ayah_count in ((1, 'Al-Fatiha', 2), (2, 'Al-Baqara', 2)):
+            surah = Surah.objects.create(name_en=name, number=number)
+            for verse_number in range(1, ayah_count + 1):
+                ayah = Ayah.objects.create(chapter_id=surah, verse_number=verse_number,
+                                           text_madani='', text_simple='', sajdah=False)
+                for word_number in range(1, 3):
+                    AyahWord.objects.create(ayah=ayah, number=word_number,
+                                            code=str(word_number))
+                Translation.objects.create(ayah=ayah, text='{}:{}'.format(
+                        number, verse_number))
+        reset_corpus()
+        reset_version()
+        self.addCleanup(reset_corpus)
+        self.addCleanup(reset_version)
+
+    def test_get_ayah(self):
+        response = self.client.get('/v1/quran/1/2/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ayah = response.json()
+        self.assertEqual(ayah['verse_number'], 2)
+        self.assertEqual([word['number'] for word in ayah['words']], [2, 1])
+        self.assertEqual([translation['text'] for translation in ayah['translations']],
+                         ['1:2'])
+        self.assertEqual(ayah['next'], {'surah': 2, 'ayah': 1})
+        self.assertEqual(ayah['prev'], {'surah': 1, 'ayah': 1})
+
+        # The corpus is loaded once and wraps around at both ends.
+        with self.assertNumQueries(0):
+            ayah = self.client.get('/v1/quran/1/1/').json()
+        self.assertEqual(ayah['prev'], {'surah': 2, 'ayah': 2})
+        ayah = self.client.get('/v1/quran/2/2/').json()
+        self.assertEqual(ayah['next'], {'surah': 1, 'ayah': 1})
+
+    def test_random_ayah(self):
+        Ayah.objects.filter(chapter_id__number=2, verse_number=1).update(sajdah=True)
+        reset_corpus()
+        response = self.client.get('/v1/quran/ayah/random/', {'surah_start': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('session_id', response.json())
+        self.assertEqual(response.json()['translations'][0]['text'][:2], '2:')
+
+        response = self.client.get('/v1/quran/ayah/random/', {'sajdah': 'true'})
+        self.assertEqual(response.json()['translations'][0]['text'], '2:1')
+        response = self.client.get('/v1/quran/ayah/random/',
+                                   {'surah_end': 1, 'sajdah': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/v1/quran/ayah/random/', {'max_length': 'long'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_missing_ayah(self):
+        response = self.client.get('/v1/quran/3/1/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_get(self):
+        # Without a version stamp, responses are not cached.
+        response = self.client.get('/v1/quran/1/1/')
+        self.assertFalse(response.has_header('ETag'))
+
+        stamp_version()
+        for url in ('/v1/quran/1/1/', '/v1/quran/surah/?surah=1'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('max-age=', response['Cache-Control'])
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        etag = self.client.get('/v1/quran/1/1/')['ETag']
+        self.assertNotEqual(self.client.get('/v1/quran/1/2/')['ETag'], etag)
+        stamp_version()
+        response = self.client.get('/v1/quran/1/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(self.client.get('/v1/quran/ayah/random/').has_header('ETag'))
+
+    def test_get_surah_full(self):
+        blob_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blob_dir)
+        call_command('build_quran_blobs', output_dir=blob_dir, stdout=StringIO())
+        with override_settings(QURAN_BLOB_DIR=blob_dir):
+            with self.assertNumQueries(0):
+                response = self.client.get('/v1/quran/surah/2/full/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            document = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+            self.assertEqual(document['surah']['name_en'], 'Al-Baqara')
+            self.assertEqual([ayah['verse_number'] for ayah in document['ayahs']], [1, 2])
+            self.assertEqual([word['number'] for word in document['ayahs'][0]['words']],
+                             [2, 1])
+            self.assertEqual(document['ayahs'][1]['translations'][0]['text'], '2:2')
+
+            for encoding in ('gzip;q=0, deflate', 'identity, *;q=0', 'br'):
+                response = self.client.get('/v1/quran/surah/2/full/',
+                                           HTTP_ACCEPT_ENCODING=encoding)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                response.close()
+            response = self.client.get('/v1/quran/surah/2/full/',
+                                       HTTP_ACCEPT_ENCODING='*;q=0.5')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            response.close()
+            response = self.client.get('/v1/quran/surah/2/full/',
+                                       HTTP_ACCEPT_ENCODING='deflate, GZIP;q=0.8')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            data = gzip.decompress(b''.join(response.streaming_content))
+            self.assertEqual(json.loads(data.decode('utf-8')), document)
+            response = self.client.get('/v1/quran/surah/2/full/',
+                                       HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            response = self.client.get('/v1/quran/surah/3/full/')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+            # A rebuild without gzip does not leave the old gzipped documents served.
+            Translation.objects.filter(text='2:2').update(text='2:2 revised')
+            reset_corpus()
+            call_command('build_quran_blobs', output_dir=blob_dir, no_gzip=True,
+                         stdout=StringIO())
+            response = self.client.get('/v1/quran/surah/2/full/',
+                                       HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(response.has_header('Content-Encoding'))
+            document = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+            self.assertEqual(document['ayahs'][1]['translations'][0]['text'],
+                             '2:2 revised')
+
+
+class FillQuranDbTestCase(APITestCase):
+    def _write_json(self, directory, name, data):
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as json_file:
+            json.dump(data, json_file)
+        return path
+
+    def test_import(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        verse = {
+            'verse_number': 1, 'text_madani': 'madani', 'text_simple': 'simple',
+            'sajdah': None,
+            'translations': [{'text': 'text', 'language_name': 'english',
+                              'resource_name': 'transliteration'}],
+            'words': [{'text_madani': 'w', 'text_simple': 'w', 'code': str(number),
+                       'class_name': 'p1', 'char_type': 'word'} for number in range(3)],
+        }
+        words_path = self._write_json(directory, 'data-words.json', {
+            '1': {'verses': [verse, dict(verse, verse_number=2)]},
+            '2': {'verses': [verse]},
+        })
+        uthmani_path = self._write_json(directory, 'data-uthmani.json', {
+            'quran': {'surahs': [{'name': 'الفاتحة'}, {'name': 'البقرة'}]},
+        })
+
+        call_command('fill_quran_db', words_path, uthmani_path, stdout=StringIO())
+        self.assertEqual(Surah.objects.get(number=2).name_ar, 'البقرة')
+        self.assertEqual(Ayah.objects.count(), 3)
+        self.assertEqual(AyahWord.objects.count(), 9)
+        self.assertEqual(list(AyahWord.objects.filter(
+                ayah__chapter_id__number=1, ayah__verse_number=2).order_by(
+                'number').values_list('code', flat=True)), ['0', '1', '2'])
+        self.assertEqual(Translation.objects.count(), 3)
+        version = QuranVersion.objects.get().version
+
+        # Running it again creates nothing and keeps the version.
+        call_command('fill_quran_db', words_path, uthmani_path, stdout=StringIO())
+        self.assertEqual(Ayah.objects.count(), 3)
+        self.assertEqual(AyahWord.objects.count(), 9)
+        self.assertEqual(Translation.objects.count(), 3)
+        self.assertEqual(QuranVersion.objects.get().version, version)
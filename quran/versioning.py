@@ -0,0 +1,105 @@
+"""
+Version stamp of the Quran data, and HTTP caching of the quran endpoints.
+
+The data only changes when fill_quran_db imports it, which records a new
+:class:`QuranVersion`. Responses carry a strong ETag derived from the version and the
+request URL, the time of the import as their Last-Modified date and a long-lived
+Cache-Control header. Every worker keeps the version in memory for QURAN_VERSION_TTL
+seconds, so conditional requests are answered with a 304 before any query runs.
+"""
+from functools import wraps
+import hashlib
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from quran.models import QuranVersion
+
+# The current stamp and the monotonic time until which it is trusted.
+_version = None
+_version_lock = threading.Lock()
+
+
+def get_version():
+    """Returns the stamp of the Quran data, reading it from the database at most once
+    per QURAN_VERSION_TTL seconds.
+
+    :return: The stamp, or None if the data was never imported with fill_quran_db
+    :rtype: QuranVersion, None
+    """
+    global _version
+    now = time.monotonic()
+    entry = _version
+    if entry is None or entry[1] <= now:
+        with _version_lock:
+            entry = _version
+            if entry is None or entry[1] <= now:
+                stamp = QuranVersion.objects.order_by('-updated_at').first()
+                entry = _version = (stamp, now + settings.QURAN_VERSION_TTL)
+    return entry[0]
+
+
+def reset_version():
+    """Forgets the stamp kept in memory, so the next request reads it again."""
+    global _version
+    with _version_lock:
+        _version = None
+
+
+def stamp_version():
+    """Records that the Quran data changed, replacing the previous stamp.
+
+    :rtype: QuranVersion
+    """
+    with transaction.atomic():
+        QuranVersion.objects.all().delete()
+        stamp = QuranVersion.objects.create(version=uuid.uuid4().hex)
+    reset_version()
+    return stamp
+
+
+def _etag(request, *args, **kwargs):
+    stamp = get_version()
+    if stamp is None:
+        return None
+    key = '{}\n{}'.format(stamp.version, request.get_full_path())
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _last_modified(request, *args, **kwargs):
+    stamp = get_version()
+    return stamp.updated_at if stamp is not None else None
+
+
+def cache_quran(view):
+    """Makes a view answer conditional GET requests from the data version, and lets
+    clients and CDNs cache its responses for QURAN_CACHE_MAX_AGE seconds. Views are
+    served as usual until the data has a version.
+    """
+    conditional_view = condition(etag_func=_etag, last_modified_func=_last_modified)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        if response.status_code in (200, 304) and response.has_header('ETag'):
+            patch_cache_control(response, public=True,
+                                max_age=settings.QURAN_CACHE_MAX_AGE)
+        return response
+    return wrapper
+
+
+class CachedQuranMixin(object):
+    """Applies :func:`cache_quran` to every action of a viewset but its
+    uncached_actions.
+    """
+    uncached_actions = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = super(CachedQuranMixin, self).dispatch
+        # The viewset only sets self.action once dispatching.
+        if self.action_map.get(request.method.lower()) in self.uncached_actions:
+            return dispatch(request, *args, **kwargs)
+        return cache_quran(dispatch)(request, *args, **kwargs)
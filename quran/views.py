@@ -1,17 +1,53 @@
-import random
+import os
 # Django
+from django.conf import settings
+from django.http import FileResponse, JsonResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
 from django_filters import rest_framework as filters
-from django.forms.models import model_to_dict
 # Django Rest Framework
 from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 # Quran app
+from quran.blobs import blob_path
+from quran.corpus import get_corpus
+from quran.versioning import CachedQuranMixin, cache_quran
 from quran.models import Surah, Ayah, AyahWord, Translation
 import quran.serializers
 
 
+def _get_int_param(request, name):
+    """Reads an optional integer query parameter.
+
+    :raises ValueError: If the parameter is not an integer
+    """
+    value = request.query_params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('{} must be an integer'.format(name))
+
+
+def _get_bool_param(request, name):
+    """Reads an optional true/false query parameter.
+
+    :raises ValueError: If the parameter is not true or false
+    """
+    value = request.query_params.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() not in ('true', 'false'):
+        raise ValueError('{} must be true or false'.format(name))
+    return value.lower() == 'true'
+
+
 class SurahFilter(filters.FilterSet):
     """Filter surahs by name, number or ayah number."""
     ayah = filters.NumberFilter(field_name='ayah__verse_number')
@@ -23,7 +59,7 @@ class SurahFilter(filters.FilterSet):
         fields = ['ayah', 'surah', 'name']
 
 
-class SurahViewSet(viewsets.ReadOnlyModelViewSet):
+class SurahViewSet(CachedQuranMixin, viewsets.ReadOnlyModelViewSet):
     """Read only view set for surahs."""
     queryset = Surah.objects.all()
     serializer_class = quran.serializers.SurahSerializer
@@ -42,8 +78,10 @@ class AyahFilter(filters.FilterSet):
         fields = ['surah', 'ayah', 'sajdah']
 
 
-class AyahViewSet(viewsets.ReadOnlyModelViewSet):
+class AyahViewSet(CachedQuranMixin, viewsets.ReadOnlyModelViewSet):
     """Read only view set for ayahs."""
+    # Random ayahs differ on every request.
+    uncached_actions = ('random',)
     queryset = Ayah.objects.all()
     serializer_class = quran.serializers.AyahSerializer
     filter_backends = (filters.DjangoFilterBackend,)
@@ -51,24 +89,33 @@ class AyahViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=['get'])
     def random(self, request):
+        """Returns a random ayah with its words and translations, drawn from the
+        in-memory corpus. Optional query parameters: surah_start and surah_end (a range
+        of surah numbers), max_length (in characters of the simple text) and sajdah
+        (true or false).
+        """
+        try:
+            ayah_filters = {
+                'first_surah': _get_int_param(request, 'surah_start'),
+                'last_surah': _get_int_param(request, 'surah_end'),
+                'max_length': _get_int_param(request, 'max_length'),
+                'sajdah': _get_bool_param(request, 'sajdah'),
+            }
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
         # User tracking - Ensure there is always a session key.
         session_key = request.session.session_key
         if not session_key:
             request.session.create()
             session_key = request.session.session_key
 
-        ayah_count = Ayah.objects.count() - 1
-        rand_index = random.randint(0, ayah_count)
-        rand_ayah = Ayah.objects.all()[rand_index]
-        surah_num = rand_ayah.chapter_id.number
-        ayah_num = rand_ayah.verse_number
-        words = AyahWord.objects.filter(ayah=rand_ayah, ayah__verse_number=ayah_num,
-                                        ayah__chapter_id__number=surah_num)
-        translations = Translation.objects.filter(ayah__verse_number=ayah_num,
-                                                  ayah__chapter_id__number=surah_num)
-        ayah_dict = model_to_dict(rand_ayah)
-        ayah_dict['translations'] = list(translations.values())
-        ayah_dict['words'] = list(reversed(words.values()))
+        corpus = get_corpus()
+        number = corpus.random_ayah(**ayah_filters)
+        if number is None:
+            return Response({"detail": "No ayah matches the filters"},
+                            status=status.HTTP_404_NOT_FOUND)
+        ayah_dict = corpus.get_ayah(number)
         ayah_dict['session_id'] = session_key
 
         return Response(ayah_dict)
@@ -85,7 +132,7 @@ class AyahWordFilter(filters.FilterSet):
         fields = ['surah', 'ayah', 'number']
 
 
-class AyahWordViewSet(viewsets.ReadOnlyModelViewSet):
+class AyahWordViewSet(CachedQuranMixin, viewsets.ReadOnlyModelViewSet):
     """Read only view set for an ayah's words."""
     queryset = AyahWord.objects.all()
     serializer_class = quran.serializers.AyahWordSerializer
@@ -105,7 +152,7 @@ class TranslationFilter(filters.FilterSet):
         fields = ['surah', 'ayah', 'translation', 'language']
 
 
-class TranslationViewSet(viewsets.ReadOnlyModelViewSet):
+class TranslationViewSet(CachedQuranMixin, viewsets.ReadOnlyModelViewSet):
     """Read only view set for an ayah's translation."""
     queryset = Translation.objects.all()
     serializer_class = quran.serializers.Translation
@@ -113,10 +160,12 @@ class TranslationViewSet(viewsets.ReadOnlyModelViewSet):
     filter_class = AyahWordFilter
 
 
+@cache_quran
 @api_view(['GET'])
 def get_ayah(request, surah, ayah):
-    """ Returns the current, next, and previous ayah. Assumes next/previous surah if
-    out of bounds.
+    """ Returns an ayah with its words and translations, and the surah and ayah numbers
+    of the next and previous ayahs. Assumes next/previous surah if out of bounds.
+    The ayahs are served from the in-memory corpus, without querying the database.
     :param request: rest API request object.
     :type request: Request
     :param surah: The surah number.
@@ -126,33 +175,69 @@ def get_ayah(request, surah, ayah):
     :return: A JSON response with the requested text.
     :rtype: Response
     """
-    try:
-        curr_ayah = model_to_dict(Ayah.objects.get(verse_number=ayah,
-                                                   chapter_id__number=surah))
-    except Ayah.DoesNotExist:
+    corpus = get_corpus()
+    number = corpus.find(surah, ayah)
+    if number is None:
         return Response({"detail": "Ayah not found"}, status=status.HTTP_404_NOT_FOUND)
-    try:
-        next_ayah = model_to_dict(Ayah.objects.get(verse_number=ayah+1,
-                                                   chapter_id__number=surah))
-    except (Ayah.DoesNotExist, AttributeError):
-        new_surah = 0 if surah == 114 else surah
-        next_ayah = model_to_dict(Ayah.objects.get(verse_number=1,
-                                                   chapter_id__number=new_surah+1))
-    try:
-        prev_ayah = model_to_dict(Ayah.objects.get(verse_number=ayah-1,
-                                                   chapter_id__number=surah))
-    except (Ayah.DoesNotExist, AttributeError):
-        new_surah = 115 if surah == 1 else surah
-        prev_ayah = model_to_dict(Ayah.objects.filter(chapter_id__number=new_surah-1).last())
-    response = curr_ayah
-    words = AyahWord.objects.filter(ayah__verse_number=ayah,
-                                    ayah__chapter_id__number=surah)
-    translations = Translation.objects.filter(ayah__verse_number=ayah,
-                                              ayah__chapter_id__number=surah)
-    response['words'] = list(reversed(words.values()))
-    response['translations'] = list(translations.values())
+    return Response(corpus.get_ayah(number))
 
-    return Response(response)
+
+def _accepts_gzip(request):
+    """True if the Accept-Encoding header of a request allows gzip, by name or through
+    *, with a non-zero quality.
+    """
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+@require_safe
+def get_surah_full(request, surah_num):
+    """Returns a whole surah, with the words and translations of every ayah, as
+    rendered by build_quran_blobs. The stored bytes are streamed as they are, gzipped
+    if the client accepts it, and validated with the size and time of the file.
+
+    :param request: The request object.
+    :type request: HttpRequest
+    :param surah_num: The surah number
+    :type surah_num: int
+    :return: The JSON document of the surah.
+    :rtype: HttpResponse
+    """
+    path = blob_path(settings.QURAN_BLOB_DIR, surah_num)
+    gzipped = _accepts_gzip(request)
+    if gzipped and os.path.exists(blob_path(settings.QURAN_BLOB_DIR, surah_num, True)):
+        path = blob_path(settings.QURAN_BLOB_DIR, surah_num, True)
+    else:
+        gzipped = False
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return JsonResponse({"detail": "Surah not found"},
+                            status=status.HTTP_404_NOT_FOUND)
+    # The encodings are different files, so they get different tags.
+    etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=int(stat.st_mtime))
+    if response is None:
+        response = FileResponse(open(path, 'rb'), content_type='application/json')
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    patch_cache_control(response, public=True, max_age=settings.QURAN_CACHE_MAX_AGE)
+    return response
 
 
 @api_view(['GET'])
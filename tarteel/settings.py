@@ -310,3 +310,70 @@ else:
     SECURE_SSL_REDIRECT = env('SECURE_SSL_REDIRECT', bool, default=False)
     SESSION_COOKIE_SECURE = env('SESSION_COOKIE_SECURE', bool, default=False)
     CSRF_COOKIE_SECURE = env('CSRF_COOKIE_SECURE', bool, default=False)
+
+# QURAN
+# ------------------------------------------------------------------------------
+# Seconds clients and CDNs may cache responses of the quran endpoints. They are also
+# revalidated with ETags, which change whenever fill_quran_db imports new data.
+QURAN_CACHE_MAX_AGE = env('QURAN_CACHE_MAX_AGE', int, default=24 * 60 * 60)
+# Seconds a worker trusts its copy of the data version before reading it again, so
+# imports made by another process are picked up within this delay.
+QURAN_VERSION_TTL = env('QURAN_VERSION_TTL', float, default=60.0)
+# Pre-rendered surah documents served by v1/quran/surah/<n>/full/, written by
+# build_quran_blobs.
+QURAN_BLOB_DIR = env('QURAN_BLOB_DIR', str,
+                     default=os.path.join(BASE_DIR, 'quran', 'blobs'))
+
+# IQRA
+# ------------------------------------------------------------------------------
+# Whoosh index used by the Iqra search engine. The default is the index shipped in the
+# repository; deployments that rebuild it with build_iqra_index point this at a path
+# outside the source tree, where the symlink to the active generation is kept.
+IQRA_INDEX_DIR = env('IQRA_INDEX_DIR', str,
+                     default=os.path.join(BASE_DIR, 'iqra', 'whooshdir'))
+# Search backend: 'whoosh', 'memory' (postings held in memory), 'sqlite' (SQLite FTS5,
+# built with build_iqra_fts) or a dotted path to a
+# iqra.backends.base.SearchBackend subclass.
+IQRA_BACKEND = env('IQRA_BACKEND', str, default='whoosh')
+# Seconds between checks for a new index generation by the warm engine.
+IQRA_REFRESH_INTERVAL = env('IQRA_REFRESH_INTERVAL', float, default=30.0)
+# Translations are downloaded from here once and packed into IQRA_TRANSLATION_DIR.
+IQRA_TRANSLATION_URL = env('IQRA_TRANSLATION_URL', str,
+                           default='https://s3.amazonaws.com/zappa-tarteel-static/iqra_quran/')
+# Lambda only allows writes to /tmp.
+IQRA_TRANSLATION_DIR = env('IQRA_TRANSLATION_DIR', str,
+                           default=os.path.join(BASE_DIR, 'iqra', 'translations')
+                           if LOCAL_DEV else '/tmp/iqra_translations')
+# Where translations are looked up: 'store' (the packed files above) or 'database' (the
+# quran Translation table, filled by the import_iqra_translations command).
+IQRA_TRANSLATION_SOURCE = env('IQRA_TRANSLATION_SOURCE', str, default='store')
+# Upper bound on the size of the translation files kept memory-mapped at once.
+IQRA_TRANSLATION_CACHE_BYTES = env('IQRA_TRANSLATION_CACHE_BYTES', int, default=64 * 2**20)
+# Number of search results cached per worker (0 disables) and their lifetime in
+# seconds (unset keeps them until evicted or the index changes).
+IQRA_RESULT_CACHE_SIZE = env('IQRA_RESULT_CACHE_SIZE', int, default=1024)
+IQRA_RESULT_CACHE_TTL = env('IQRA_RESULT_CACHE_TTL', float, default=None)
+# Batch search: maximum number of queries per request and size of the thread pool
+# used for parallel batches.
+IQRA_BATCH_MAX_QUERIES = env('IQRA_BATCH_MAX_QUERIES', int, default=50)
+IQRA_BATCH_WORKERS = env('IQRA_BATCH_WORKERS', int, default=4)
+# Misspelled query words are corrected to index words at most this many edits away
+# (0 disables corrections), spending at most IQRA_SPELLING_BUDGET_MS per query.
+IQRA_SPELLING_MAX_DISTANCE = env('IQRA_SPELLING_MAX_DISTANCE', int, default=1)
+IQRA_SPELLING_BUDGET_MS = env('IQRA_SPELLING_BUDGET_MS', float, default=5.0)
+# Match query words with the same phonetic skeleton as ayah words (letters speech
+# recognizers confuse, like ص/س or ط/ت, count as the same) before correcting spelling.
+IQRA_PHONETIC_MATCHING = env('IQRA_PHONETIC_MATCHING', bool, default=True)
+# Run the OR fallback stages of a search concurrently on a pool of this many threads
+# instead of one after the other.
+IQRA_CONCURRENT_FALLBACK = env('IQRA_CONCURRENT_FALLBACK', bool, default=False)
+IQRA_FALLBACK_WORKERS = env('IQRA_FALLBACK_WORKERS', int, default=6)
+# Log every search (normalized query, result count, matched stage, latency) to the
+# SearchQueryLog table. Entries are written in batches of IQRA_QUERY_LOG_BATCH_SIZE or
+# every IQRA_QUERY_LOG_FLUSH_SECONDS by a background thread, and dropped once
+# IQRA_QUERY_LOG_MAX_QUEUED are waiting. Queued entries are written when the worker
+# exits, but a killed worker loses up to IQRA_QUERY_LOG_FLUSH_SECONDS of searches.
+IQRA_QUERY_LOG = env('IQRA_QUERY_LOG', bool, default=False)
+IQRA_QUERY_LOG_BATCH_SIZE = env('IQRA_QUERY_LOG_BATCH_SIZE', int, default=500)
+IQRA_QUERY_LOG_MAX_QUEUED = env('IQRA_QUERY_LOG_MAX_QUEUED', int, default=10000)
+IQRA_QUERY_LOG_FLUSH_SECONDS = env('IQRA_QUERY_LOG_FLUSH_SECONDS', float, default=5.0)